@@ -0,0 +1,154 @@
+"""Dashboard aggregates of the employee directory.
+
+Per department: headcount, gender mix, joins by month and the distribution
+of past violations. They are kept as one counter of employees per
+(department, breakdown, key), computed when the directory loads and then
+adjusted by the employees each upsert replaces and adds, so serving them
+never scans the directory.
+"""
+
+import hashlib
+import json
+from collections import Counter
+
+import numpy as np
+
+from employee_store import MISSING_DAY
+
+# Breakdowns kept per department, besides the headcount
+BREAKDOWNS = ("gender", "joins_by_month", "violations")
+# Key used for missing departments, genders and join dates
+UNKNOWN = "unknown"
+
+
+def _label(value):
+    return UNKNOWN if value is None else str(value)
+
+
+def _grouped(dept_codes, keys):
+    # (dept code, key, count) of the distinct pairs, counted with one bincount
+    if not len(keys):
+        return []
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount((dept_codes.astype(np.int64) + 1) * len(uniques) + inverse.reshape(-1))
+    pairs = np.flatnonzero(counts)
+    return zip((pairs // len(uniques) - 1).tolist(), uniques[pairs % len(uniques)].tolist(),
+               counts[pairs].tolist())
+
+
+def _month_labels(months):
+    return {month: UNKNOWN if month < 0 else str(np.datetime64(month, "M")) for month in months}
+
+
+def store_counts(store, rows=None):
+    """Counter of employees per (dept, breakdown, key) over rows of an EmployeeStore (default: all)."""
+    def column(values):
+        return values if rows is None else values[rows]
+
+    dept = store.columns["dept"]
+    dept_codes = column(dept.codes)
+    departments = dept.categories + [UNKNOWN]  # code -1 picks the last one
+    genders = store.columns["gender"].categories + [UNKNOWN]
+    days = column(store.columns["join_date"].days)
+    months = np.where(days == MISSING_DAY, -1, days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64))
+
+    counts = Counter()
+    for code, _, count in _grouped(dept_codes, np.zeros(len(dept_codes), dtype=np.int8)):
+        counts[departments[code], None, None] = count
+    for code, gender, count in _grouped(dept_codes, column(store.columns["gender"].codes)):
+        counts[departments[code], "gender", genders[gender]] = count
+    grouped = list(_grouped(dept_codes, months))
+    labels = _month_labels({month for _, month, _ in grouped})
+    for code, month, count in grouped:
+        counts[departments[code], "joins_by_month", labels[month]] = count
+    for code, violations, count in _grouped(dept_codes, column(store.columns["past_violations"].values)):
+        counts[departments[code], "violations", str(violations)] = count
+    return counts
+
+
+def record_counts(records):
+    """Counter of employees per (dept, breakdown, key) over (dept, gender, ISO join date, violations) tuples."""
+    counts = Counter()
+    for dept, gender, join_date, violations in records:
+        dept = _label(dept)
+        counts[dept, None, None] += 1
+        counts[dept, "gender", _label(gender)] += 1
+        counts[dept, "joins_by_month", _label(join_date[:7] if join_date else None)] += 1
+        counts[dept, "violations", _label(violations)] += 1
+    return counts
+
+
+def grouped_counts(rows):
+    """Counter from (dept, breakdown, key, employees) rows, breakdown None being the headcount."""
+    counts = Counter()
+    for dept, breakdown, key, employees in rows:
+        counts[_label(dept), breakdown, None if breakdown is None else _label(key)] += employees
+    return counts
+
+
+class DepartmentAggregates:
+    """Immutable aggregates of one directory version; updated() returns a new one.
+
+    The JSON payload and its ETag are rendered on first use and cached, so
+    repeated requests are served from memory.
+    """
+
+    def __init__(self, counts):
+        self.counts = counts
+        self._payload = None
+        self._body = None
+        self._etag = None
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(store_counts(store))
+
+    def updated(self, removed, added):
+        """Aggregates after the employees counted in ``removed`` were replaced by those in ``added``."""
+        counts = Counter(self.counts)
+        counts.subtract(removed)
+        counts.update(added)
+        # Unary plus drops the keys no employee is counted under any more
+        return DepartmentAggregates(+counts)
+
+    def upserted(self, base, store, rows):
+        """Aggregates of ``store``, produced by EmployeeStore.upsert replacing ``rows`` of ``base``."""
+        rows = np.asarray(rows, dtype=np.int64)
+        changed = np.concatenate([rows, np.arange(len(base), len(store), dtype=np.int64)])
+        return self.updated(store_counts(base, rows), store_counts(store, changed))
+
+    def payload(self, departments=None):
+        """Aggregates as a JSON-ready dict, optionally limited to some departments."""
+        if self._payload is None:
+            result = {}
+            for (dept, breakdown, key), count in sorted(self.counts.items(), key=lambda item: str(item[0])):
+                entry = result.setdefault(dept, {"headcount": 0, **{name: {} for name in BREAKDOWNS}})
+                if breakdown is None:
+                    entry["headcount"] = count
+                else:
+                    entry[breakdown][key] = count
+            self._payload = {"employees": sum(entry["headcount"] for entry in result.values()),
+                             "departments": dict(sorted(result.items()))}
+        if departments is None:
+            return self._payload
+        selected = {dept: entry for dept, entry in self._payload["departments"].items() if dept in departments}
+        return {"employees": sum(entry["headcount"] for entry in selected.values()), "departments": selected}
+
+    @property
+    def body(self):
+        """The full payload serialized as JSON bytes."""
+        if self._body is None:
+            self._body = json.dumps(self.payload(), separators=(",", ":")).encode("utf-8")
+        return self._body
+
+    @property
+    def etag(self):
+        """Content hash of the payload: unchanged as long as the aggregates are."""
+        if self._etag is None:
+            self._etag = hashlib.sha1(self.body).hexdigest()
+        return self._etag
+
+    def etag_for(self, departments):
+        """ETag of payload(departments): the content hash combined with the selected departments."""
+        selection = "\n".join(sorted(departments)).encode("utf-8")
+        return hashlib.sha1(self.etag.encode("ascii") + b"\0" + selection).hexdigest()
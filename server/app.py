@@ -1,15 +1,31 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, Response
+from fastapi import FastAPI, HTTPException, Query, Depends, Response, Header, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 import uvicorn
+import hmac
 import logging
+import math
 import os
 import warnings
 import tensorflow as tf
+import audit_log
+import directory
+import employee_import
+import employee_listing
+import log_pipeline
 import main_model
-from main_model import is_corporate_related, process_user_query, load_classifier
+import metrics
+import profiler
+import tenants
+from main_model import run_corporate_check, process_user_query, load_classifier
+from policy_simulator import load_policy
+from inference_pool import InferencePool, WorkerUnavailable
+from student_classifier import StudentClassifier
+from violation_store import VIOLATION_STORE_ENABLED, ViolationStore
+from rate_limit import RATE_LIMIT_ENABLED, RateLimiter
+from session_cache import SESSION_CACHE_ENABLED, SessionCache
 
 # Suppress warnings
 warnings.filterwarnings('ignore', category=UserWarning, module='torch.utils._pytree')
@@ -19,8 +35,8 @@ warnings.filterwarnings('ignore', category=DeprecationWarning)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # 0=all, 1=INFO, 2=WARNING, 3=ERROR
 tf.get_logger().setLevel('ERROR')
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging (JSON records written by a background thread, see log_pipeline)
+log_pipeline.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app with metadata for documentation
@@ -55,9 +71,61 @@ async def add_cors_headers(request, call_next):
     response = await call_next(request)
     response.headers["Access-Control-Allow-Origin"] = "*"
     response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Tenant-ID"
     return response
 
+# Serve requests naming a tenant with that tenant's directory and policy (see tenants.py)
+@app.middleware("http")
+async def route_tenant(request, call_next):
+    registry = tenants.get_registry()
+    if registry is None:
+        return await call_next(request)
+    name, path = tenants.route(request.headers.get(tenants.TENANT_HEADER), request.scope["path"])
+    if name is None:
+        return await call_next(request)
+    tenant = registry.get(name)
+    if tenant is None:
+        return JSONResponse(status_code=404, content={"detail": f"Unknown tenant: {name}"})
+    request.scope["path"] = path
+    with registry.activate(tenant):
+        return await call_next(request)
+
+def _queue_depths():
+    depths = {}
+    if main_model.inference_pool is not None:
+        depths[("inference_pool",)] = main_model.inference_pool.in_flight
+    if hasattr(main_model.classifier, "queue_depth"):
+        depths[("batcher",)] = main_model.classifier.queue_depth
+    if main_model.audit_writer is not None:
+        depths[("audit",)] = main_model.audit_writer.pending
+    log_depth = log_pipeline.queue_depth()
+    if log_depth is not None:
+        depths[("log",)] = log_depth
+    return depths
+
+metrics.QUEUE_DEPTH.callback = _queue_depths
+
+# Admin access: a shared token sent as X-Admin-Token; without ADMIN_TOKEN nobody is admin
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def is_admin(admin_token=None):
+    """Check whether a request carries the admin token (user IDs are caller-supplied and never grant admin)"""
+    return bool(ADMIN_TOKEN and admin_token and hmac.compare_digest(admin_token, ADMIN_TOKEN))
+
+def debug_timings_enabled(debug_timings: bool = Query(False, description="Attach a per-stage timing breakdown (admin only)"),
+                          x_debug_timings: Optional[str] = Header(None)):
+    """Dependency resolving the debug_timings flag from the query string or X-Debug-Timings header"""
+    return debug_timings or (x_debug_timings or "").lower() in ("1", "true", "yes")
+
+def run_traced(enabled, func, *args):
+    """Run func, returning its result and a per-request timing breakdown when enabled"""
+    if not enabled:
+        return func(*args), None
+    with metrics.trace_request() as trace:
+        result = func(*args)
+    return result, trace.to_dict()
+
+
 # Input and Response Models
 class QueryRequest(BaseModel):
     query: str
@@ -65,12 +133,15 @@ class QueryRequest(BaseModel):
 class UserQueryRequest(BaseModel):
     user_id: int
     query: str
+    conversation_id: Optional[str] = None
 
 class QueryResponse(BaseModel):
     query: str
     is_appropriate: bool
     label: str
     confidence: float
+    truncated: bool = False
+    debug_timings: Optional[dict] = None
 
 class UserQueryResponse(BaseModel):
     query: str
@@ -85,60 +156,113 @@ class UserQueryResponse(BaseModel):
     requested_dept: Optional[str] = None
     is_authorized: Optional[bool] = None
     auth_reason: Optional[str] = None
+    truncated: Optional[bool] = None
+    data: Optional[dict] = None
+    debug_timings: Optional[dict] = None
 
 # Startup Event
 @app.on_event("startup")
 async def startup_event():
+    if tenants.TENANTS_CONFIG:
+        tenants.configure(tenants.TENANTS_CONFIG, load_policy)
+    if audit_log.AUDIT_LOG_ENABLED:
+        main_model.audit_writer = audit_log.AuditWriter()
+        main_model.audit_writer.start()
+    if RATE_LIMIT_ENABLED:
+        main_model.rate_limiter = RateLimiter()
+    if SESSION_CACHE_ENABLED:
+        main_model.session_cache = SessionCache()
+    if VIOLATION_STORE_ENABLED:
+        main_model.violation_store = ViolationStore()
+        main_model.violation_store.start()
+
     try:
+        student_path = os.getenv("STUDENT_MODEL_PATH")
+        if student_path and os.path.exists(student_path):
+            logger.info("Loading student classifier from %s...", student_path)
+            main_model.student = StudentClassifier.load(student_path)
+            logger.info("Student classifier loaded (cascade threshold %.2f)", main_model.student.threshold)
+
+        workers = int(os.getenv("INFERENCE_WORKERS", "0"))
+        if workers > 0:
+            logger.info("Starting inference pool with %s workers...", workers)
+            # Classification is routed to worker processes by query hash
+            main_model.inference_pool = InferencePool(num_workers=workers)
+            main_model.inference_pool.start()
+            return
+
         logger.info("Loading classification model...")
         # Load the classifier and set it in the main_model module
         main_model.classifier = load_classifier()
         logger.info("Classification model loaded successfully")
     except Exception as e:
-        logger.error(f"Failed to load classification model: {e}")
+        logger.error("Failed to load classification model: %s", e)
         raise HTTPException(status_code=500, detail="Failed to load classification model")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if main_model.inference_pool is not None:
+        logger.info("Stopping inference pool...")
+        main_model.inference_pool.stop()
+    if main_model.violation_store is not None:
+        main_model.violation_store.stop()
+    if main_model.audit_writer is not None:
+        logger.info("Flushing audit log...")
+        main_model.audit_writer.stop()
+
 # API Routes
 @app.post("/api/classify", response_model=QueryResponse, tags=["Classification"])
-async def classify_query(request: QueryRequest):
-    if main_model.classifier is None:
+def classify_query(request: QueryRequest,
+                   timings: bool = Depends(debug_timings_enabled), x_admin_token: Optional[str] = Header(None)):
+    if timings and not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="debug_timings is restricted to admin users")
+    if not main_model.model_ready():
         raise HTTPException(status_code=503, detail="Model not loaded yet")
     
     try:
-        logger.info(f"Processing query: {request.query}")
-        is_related, predicted_label, confidence, _ = is_corporate_related(
-            request.query, 
-            main_model.classifier
-        )
+        logger.info("Processing query: %s", request.query)
+        model_query, truncated = main_model.apply_token_budget(request.query)
+        (is_related, predicted_label, confidence, _), debug_timings = run_traced(timings, run_corporate_check, model_query)
         return {
             "query": request.query,
             "is_appropriate": is_related,
             "label": predicted_label,
-            "confidence": float(confidence)
+            "confidence": float(confidence),
+            "truncated": truncated,
+            "debug_timings": debug_timings
         }
+    except WorkerUnavailable as e:
+        logger.error("Inference pool unavailable: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        logger.error(f"Error processing query: {e}")
+        logger.error("Error processing query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/classify", response_model=QueryResponse, tags=["Classification"])
-async def classify_query_get(query: str = Query(..., description="The query text to classify")):
-    if main_model.classifier is None:
+def classify_query_get(query: str = Query(..., description="The query text to classify"),
+                       timings: bool = Depends(debug_timings_enabled), x_admin_token: Optional[str] = Header(None)):
+    if timings and not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="debug_timings is restricted to admin users")
+    if not main_model.model_ready():
         raise HTTPException(status_code=503, detail="Model not loaded yet")
     
     try:
-        logger.info(f"Processing query: {query}")
-        is_related, predicted_label, confidence, _ = is_corporate_related(
-            query, 
-            main_model.classifier
-        )
+        logger.info("Processing query: %s", query)
+        model_query, truncated = main_model.apply_token_budget(query)
+        (is_related, predicted_label, confidence, _), debug_timings = run_traced(timings, run_corporate_check, model_query)
         return {
             "query": query,
             "is_appropriate": is_related,
             "label": predicted_label,
-            "confidence": float(confidence)
+            "confidence": float(confidence),
+            "truncated": truncated,
+            "debug_timings": debug_timings
         }
+    except WorkerUnavailable as e:
+        logger.error("Inference pool unavailable: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        logger.error(f"Error processing query: {e}")
+        logger.error("Error processing query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.options("/api/{path:path}")
@@ -147,7 +271,7 @@ async def options_handler(path: str):
     headers = {
         "Access-Control-Allow-Origin": "*",
         "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type, Authorization",
+        "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Tenant-ID",
         "Access-Control-Max-Age": "86400"
     }
     return JSONResponse(content={"detail": "OK"}, headers=headers)
@@ -158,18 +282,28 @@ async def options_user_query():
     headers = {
         "Access-Control-Allow-Origin": "*",
         "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type, Authorization",
+        "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Tenant-ID",
         "Access-Control-Max-Age": "86400"
     }
     return JSONResponse(content={"detail": "OK"}, headers=headers)
 
 @app.post("/api/user-query", response_model=UserQueryResponse, tags=["User Queries"])
-async def process_authenticated_query(request: UserQueryRequest):
+def process_authenticated_query(request: UserQueryRequest,
+                                timings: bool = Depends(debug_timings_enabled),
+                                x_admin_token: Optional[str] = Header(None)):
     """Process a query with user authentication and authorization"""
+    if timings and not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="debug_timings is restricted to admin users")
     try:
-        logger.info(f"Received POST request to /api/user-query")
-        logger.info(f"Request data: User ID {request.user_id}, Query: {request.query}")
-        result = process_user_query(request.user_id, request.query)
+        logger.info("Processing user query (POST): User ID %s, Query: %s", request.user_id, request.query,
+                    extra={"user_id": request.user_id})
+        result, debug_timings = run_traced(timings, process_user_query, request.user_id, request.query,
+                                           request.conversation_id)
+        result["debug_timings"] = debug_timings
+        
+        if result.get("status") == "rate_limited":
+            raise HTTPException(status_code=429, detail=result["message"],
+                                headers={"Retry-After": str(math.ceil(result["retry_after"]))})
         
         if result.get("status") == "error":
             # Return a 404 if user not found or other client errors
@@ -188,24 +322,34 @@ async def process_authenticated_query(request: UserQueryRequest):
         if "auth_reason" not in result:
             result["auth_reason"] = None
             
-        logger.info(f"Returning result: {result}")
+        logger.debug("Returning result: %s", result)
         return result
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
     except Exception as e:
-        logger.error(f"Error processing user query: {e}")
+        logger.error("Error processing user query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/user-query", response_model=UserQueryResponse, tags=["User Queries"])
-async def process_authenticated_query_get(
+def process_authenticated_query_get(
     user_id: int = Query(..., description="The ID of the user making the query"),
-    query: str = Query(..., description="The query text to classify")
+    query: str = Query(..., description="The query text to classify"),
+    conversation_id: Optional[str] = Query(None, description="Chat conversation the query continues"),
+    timings: bool = Depends(debug_timings_enabled),
+    x_admin_token: Optional[str] = Header(None)
 ):
     """Process a query with user authentication and authorization (GET method)"""
+    if timings and not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="debug_timings is restricted to admin users")
     try:
-        logger.info(f"Processing user query (GET): User ID {user_id}, Query: {query}")
-        result = process_user_query(user_id, query)
+        logger.info("Processing user query (GET): User ID %s, Query: %s", user_id, query, extra={"user_id": user_id})
+        result, debug_timings = run_traced(timings, process_user_query, user_id, query, conversation_id)
+        result["debug_timings"] = debug_timings
+        
+        if result.get("status") == "rate_limited":
+            raise HTTPException(status_code=429, detail=result["message"],
+                                headers={"Retry-After": str(math.ceil(result["retry_after"]))})
         
         if result.get("status") == "error":
             # Return a 404 if user not found
@@ -229,16 +373,130 @@ async def process_authenticated_query_get(
         # Re-raise HTTP exceptions
         raise
     except Exception as e:
-        logger.error(f"Error processing user query: {e}")
+        logger.error("Error processing user query: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/employees/upload", tags=["Employees"])
+def upload_employees(
+    file: UploadFile = File(..., description="Employee CSV or NDJSON with the columns of MOCK_DATA.csv"),
+    format: Optional[str] = Query(None, description="csv or ndjson (default: from the file name)"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Stream an employee upload into the directory chunk by chunk, inserting or replacing employees by id (admin only)"""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Employee uploads are restricted to admin users")
+    fmt = format or employee_import.detect_format(file.filename, file.content_type)
+    try:
+        summary = employee_import.import_stream(file.file, directory.get_directory(), fmt)
+    except employee_import.UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        # Malformed CSV/JSON (pandas parser errors are ValueErrors)
+        raise HTTPException(status_code=400, detail=f"Could not parse upload: {e}")
+    logger.info("Employee upload %s: %s inserted, %s updated, %s rejected", file.filename,
+                summary["inserted"], summary["updated"], summary["rejected"])
+    return summary
+
+@app.post("/api/violations/{user_id}/reset", tags=["Employees"])
+def reset_violations(user_id: int, x_admin_token: Optional[str] = Header(None)):
+    """Clear the violations counted for a user at runtime, e.g. after a review (admin only)"""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Resetting violations is restricted to admin users")
+    if main_model.violation_store is None:
+        raise HTTPException(status_code=404, detail="Runtime violation counting is disabled")
+    return {"user_id": user_id, "cleared": main_model.violation_store.reset(user_id)}
+
+@app.get("/api/employees", tags=["Employees"])
+def list_employees(
+    user_id: int = Query(..., description="User ID of the caller"),
+    dept: Optional[str] = Query(None, description="Department to list (default: every department the caller may read)"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return (default: all listed columns)"),
+    limit: int = Query(employee_listing.EMPLOYEE_PAGE_SIZE, ge=1, le=employee_listing.EMPLOYEE_PAGE_MAX),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    format: str = Query("json", description="json for one page, csv or ndjson to stream every employee")
+):
+    """Employees of the departments the caller is authorized for, paged by cursor or streamed as an export"""
+    if format != "json" and format not in employee_listing.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    try:
+        columns = employee_listing.parse_fields(fields)
+        user, departments = main_model.listing_scope(user_id, dept)
+        if user is None:
+            raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
+        if not departments:
+            raise HTTPException(status_code=403, detail=f"Not authorized to list employees of {dept or 'any department'}")
+        if format != "json":
+            return StreamingResponse(
+                employee_listing.export(directory.get_directory(), departments, columns, format),
+                media_type=employee_listing.EXPORT_FORMATS[format],
+                headers={"Content-Disposition": f'attachment; filename="employees.{format}"'})
+        with metrics.stage("employee_listing"):
+            return employee_listing.page(directory.get_directory(), departments, columns, limit, cursor)
+    except employee_listing.InvalidListing as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/aggregates", tags=["Employees"])
+def employee_aggregates(
+    user_id: int = Query(..., description="User ID of the caller"),
+    dept: Optional[List[str]] = Query(None, description="Departments to include (default: every department the caller may read)"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Dashboard aggregates per department the caller is authorized for: headcount, gender mix, joins by month and violation distribution"""
+    user, departments = main_model.listing_scope(user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail=f"User with ID {user_id} not found")
+    if dept:
+        departments = [name for name in departments if name in dept]
+    if not departments:
+        raise HTTPException(status_code=403, detail=f"Not authorized to read aggregates of {', '.join(dept or []) or 'any department'}")
+    aggregates = directory.get_directory().aggregates()
+    etag = f'"{aggregates.etag_for(departments)}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=aggregates.payload(departments), headers=headers)
+
 @app.get("/api/health", tags=["Health"])
 async def health_check():
     return {
         "status": "healthy",
-        "model_loaded": main_model.classifier is not None
+        "model_loaded": main_model.model_ready(),
+        "inference_workers": main_model.inference_pool.num_workers if main_model.inference_pool else 0,
+        "student": main_model.student.stats if main_model.student else None,
+        "cascade": main_model.get_cascade_stats(),
+        "inference": main_model.get_inference_stats(),
+        "audit": main_model.audit_writer.stats if main_model.audit_writer else None,
+        "violations": main_model.violation_store.stats if main_model.violation_store else None,
+        "directory": directory.get_directory().stats,
+        "tenants": tenants.get_registry().stats if tenants.get_registry() else None,
+        "rate_limit": dict(main_model.rate_limiter.stats, tracked_users=main_model.rate_limiter.tracked_users)
+        if main_model.rate_limiter else None,
+        "sessions": dict(main_model.session_cache.stats, sessions=main_model.session_cache.sessions,
+                         mb=round(main_model.session_cache.nbytes / 1e6, 2))
+        if main_model.session_cache else None
     }
 
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+def prometheus_metrics():
+    """Stage latency histograms, decision and cache counters in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/profile", response_class=PlainTextResponse, tags=["Debug"])
+def debug_profile(
+    seconds: float = Query(10, gt=0, le=profiler.MAX_PROFILE_SECONDS, description="How long to sample"),
+    hz: int = Query(profiler.DEFAULT_SAMPLE_HZ, ge=1, le=profiler.MAX_SAMPLE_HZ, description="Samples per second"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Sample all thread stacks of the API process and return a collapsed-stack (flamegraph) profile (admin only)"""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Profiling is restricted to admin users")
+    try:
+        logger.info("Profiling API process for %ss at %s Hz", seconds, hz)
+        stacks, ticks = profiler.sample_stacks(seconds, hz)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(profiler.format_collapsed(stacks), headers={"X-Profile-Samples": str(ticks)})
+
 if __name__ == "__main__":
     # Control auto-reload with an environment variable (default: disabled for production)
     debug_mode = os.getenv("DEBUG", "False").lower() == "true"
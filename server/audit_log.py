@@ -0,0 +1,282 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Audit log configuration (overridable through environment variables)
+AUDIT_LOG_ENABLED = os.getenv("AUDIT_LOG_ENABLED", "true").lower() == "true"
+AUDIT_LOG_DIR = os.getenv("AUDIT_LOG_DIR", "audit")
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_FSYNC_INTERVAL = float(os.getenv("AUDIT_FSYNC_INTERVAL", "5.0"))
+AUDIT_SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "100000"))
+
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx.json"
+
+# Record fields whose distinct values are kept in the segment index
+INDEXED_FIELDS = ("user_id", "user_dept", "requested_dept", "status")
+
+
+def segment_name(started, sequence):
+    return f"{SEGMENT_PREFIX}{started.strftime('%Y%m%dT%H%M%S')}-{sequence:06d}{SEGMENT_SUFFIX}"
+
+
+def index_path(segment_path):
+    return segment_path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+class SegmentIndex:
+    """Sidecar index of one audit segment.
+
+    Holds the segment's time range, the distinct values of INDEXED_FIELDS
+    and, per gzip member (block), its byte range and time range, so readers
+    can skip whole segments and seek straight to the blocks they need.
+    """
+
+    def __init__(self, segment):
+        self.segment = segment
+        self.records = 0
+        self.min_ts = None
+        self.max_ts = None
+        self.values = {field: set() for field in INDEXED_FIELDS}
+        self.blocks = []
+
+    def add_block(self, offset, length, batch):
+        timestamps = [entry["ts"] for entry in batch]
+        block_min, block_max = min(timestamps), max(timestamps)
+        self.blocks.append({"offset": offset, "length": length, "records": len(batch),
+                            "min_ts": block_min, "max_ts": block_max})
+        self.records += len(batch)
+        self.min_ts = block_min if self.min_ts is None else min(self.min_ts, block_min)
+        self.max_ts = block_max if self.max_ts is None else max(self.max_ts, block_max)
+        for field, values in self.values.items():
+            values.update(entry.get(field) for entry in batch)
+
+    def to_dict(self):
+        return {
+            "segment": self.segment,
+            "records": self.records,
+            "min_ts": self.min_ts,
+            "max_ts": self.max_ts,
+            "values": {field: sorted(values, key=lambda v: (v is None, str(v))) for field, values in self.values.items()},
+            "blocks": self.blocks
+        }
+
+    def save(self, path):
+        # Written under a temporary name so readers never see a partial index
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(data["segment"])
+        index.records = data["records"]
+        index.min_ts = data["min_ts"]
+        index.max_ts = data["max_ts"]
+        index.values = {field: set(data["values"].get(field, [])) for field in INDEXED_FIELDS}
+        index.blocks = data["blocks"]
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def build(cls, segment_path):
+        """Rebuild the index of a segment by scanning it (e.g. after a crash)."""
+        index = cls(os.path.basename(segment_path))
+        with open(segment_path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            decompressor = zlib.decompressobj(wbits=31)
+            payload = decompressor.decompress(data[offset:])
+            if not decompressor.eof:
+                # Truncated trailing member from an interrupted write
+                break
+            length = len(data) - offset - len(decompressor.unused_data)
+            batch = [json.loads(line) for line in payload.splitlines() if line]
+            if batch:
+                index.add_block(offset, length, batch)
+            offset += length
+        return index
+
+
+class AuditWriter:
+    """Append-only writer for authorization decision records.
+
+    ``record`` only appends to an in-memory buffer; a background thread
+    serializes the buffered records every AUDIT_FLUSH_INTERVAL seconds and
+    appends them to the current segment as one gzip member, so a segment is
+    readable with ``gzip.open`` at any time. Segments rotate once they reach
+    AUDIT_SEGMENT_BYTES. Data is fsynced at most AUDIT_FSYNC_INTERVAL seconds
+    after it was written, which bounds what a machine crash can lose.
+    """
+
+    def __init__(self, directory=AUDIT_LOG_DIR, flush_interval=AUDIT_FLUSH_INTERVAL,
+                 fsync_interval=AUDIT_FSYNC_INTERVAL, segment_bytes=AUDIT_SEGMENT_BYTES,
+                 buffer_size=AUDIT_BUFFER_SIZE):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.buffer_size = buffer_size
+
+        self._buffer = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._file = None
+        self._segment_path = None
+        self._index = None
+        self._sequence = 0
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+        self.stats = {"records": 0, "dropped": 0, "flushes": 0, "segments": 0, "bytes": 0}
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence = self._last_sequence() + 1
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+        logger.info("Audit log writing to %s", os.path.abspath(self.directory))
+
+    def stop(self):
+        """Flush everything buffered, fsync and close the current segment."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._close_segment()
+
+    def record(self, entry):
+        """Buffer an audit record; never blocks and never does I/O.
+
+        Records are timestamped here. If the buffer is full (the disk is not
+        keeping up) the record is dropped and counted.
+        """
+        if len(self._buffer) >= self.buffer_size:
+            self.stats["dropped"] += 1
+            metrics.AUDIT_RECORDS.inc("dropped")
+            return
+        entry["ts"] = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        # deque.append is atomic, so request threads do not contend on a lock
+        self._buffer.append(entry)
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self):
+        """Write buffered records to the current segment (called from the writer thread)."""
+        batch = []
+        while self._buffer:
+            batch.append(self._buffer.popleft())
+        if batch:
+            payload = "".join(json.dumps(entry, default=str) + "\n" for entry in batch).encode("utf-8")
+            self._write(gzip.compress(payload, compresslevel=6), batch)
+        if self._unsynced and time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._fsync()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Records stay lost for this batch, but the writer keeps going
+                logger.error("Audit log flush failed: %s", e)
+        self.flush()
+
+    def _write(self, member, batch):
+        if self._file is None:
+            self._open_segment()
+        self._index.add_block(self._file.tell(), len(member), batch)
+        self._file.write(member)
+        self._file.flush()
+        self._unsynced = True
+        self.stats["records"] += len(batch)
+        self.stats["flushes"] += 1
+        self.stats["bytes"] += len(member)
+        metrics.AUDIT_RECORDS.inc("written", amount=len(batch))
+        if self._file.tell() >= self.segment_bytes:
+            self._close_segment()
+
+    def _open_segment(self):
+        started = datetime.now(timezone.utc)
+        self._segment_path = os.path.join(self.directory, segment_name(started, self._sequence))
+        self._sequence += 1
+        self._file = open(self._segment_path, "ab")
+        self._index = SegmentIndex(os.path.basename(self._segment_path))
+        self.stats["segments"] += 1
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._fsync()
+        self._file.close()
+        self._file = None
+        try:
+            self._index.save(index_path(self._segment_path))
+        except OSError as e:
+            # audit_query rebuilds missing indexes from the segment itself
+            logger.error("Could not write audit index for %s: %s", self._segment_path, e)
+
+    def _fsync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+
+    def _last_sequence(self):
+        sequences = [-1]
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    sequences.append(int(name[:-len(SEGMENT_SUFFIX)].rsplit("-", 1)[1]))
+                except ValueError:
+                    continue
+        return max(sequences)
+
+
+def decision_record(user_id, result, details):
+    """Build the audit record for one process_user_query decision.
+
+    ``details`` holds what the response does not carry: the tenant, the
+    classifier scores, the query risk analysis and the user snapshot used for
+    authorization (violations, join date, IP address).
+    """
+    return {
+        "user_id": user_id,
+        "tenant": details.get("tenant"),
+        "user_dept": result.get("user_dept") or details.get("user_dept"),
+        "requested_dept": result.get("requested_dept"),
+        "status": result.get("status"),
+        "is_authorized": result.get("is_authorized"),
+        "auth_reason": result.get("auth_reason"),
+        "label": result.get("label"),
+        "confidence": result.get("confidence"),
+        "scores": details.get("scores"),
+        "security_risk": details.get("security_risk"),
+        "risk_details": details.get("risk_details"),
+        "past_violations": details.get("past_violations"),
+        "join_date": details.get("join_date"),
+        "ip_address": details.get("ip_address"),
+        "query": result.get("query"),
+        "truncated": result.get("truncated", False)
+    }
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Query the decision audit log.
+
+Segments are pruned with their sidecar indexes (time range and the values
+of user_id, user_dept, requested_dept and status) and only the gzip blocks
+overlapping the requested time range are read and decoded.
+
+Usage:
+    python audit_query.py --since 2024-05-01 --requested-dept Accounting --status unauthorized
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from audit_log import (AUDIT_LOG_DIR, INDEXED_FIELDS, SEGMENT_PREFIX, SEGMENT_SUFFIX, SegmentIndex,
+                       index_path)
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value):
+    """Normalize a datetime or ISO date/time string to the audit log's timestamp format."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="milliseconds")
+
+
+def load_index(segment_path):
+    """Load a segment's sidecar index, rebuilding it from the segment if it is missing or stale."""
+    path = index_path(segment_path)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(segment_path):
+            return SegmentIndex.load(path)
+    except (OSError, ValueError, KeyError):
+        pass
+    return SegmentIndex.build(segment_path)
+
+
+def _segment_matches(index, since, until, filters):
+    if index.records == 0:
+        return False
+    if since and index.max_ts < since:
+        return False
+    if until and index.min_ts >= until:
+        return False
+    return all(value in index.values[field] for field, value in filters.items())
+
+
+def _needles(filters):
+    # Byte patterns every matching line must contain, checked before decoding
+    # the JSON (records are written with json.dumps' default separators)
+    return [f'"{field}": {json.dumps(value)}'.encode("utf-8") for field, value in filters.items()]
+
+
+def query_audit(directory=AUDIT_LOG_DIR, since=None, until=None, user_id=None, user_dept=None,
+                requested_dept=None, status=None, limit=None):
+    """Stream audit records matching all given conditions, oldest segment first.
+
+    Args:
+        directory (str): Audit log directory
+        since, until (datetime or str): Time range [since, until); naive values are UTC
+        user_id, user_dept, requested_dept, status: Exact-match filters
+        limit (int): Stop after this many records
+
+    Yields:
+        dict: Matching audit records
+    """
+    since, until = _timestamp(since), _timestamp(until)
+    filters = {field: value for field, value in zip(INDEXED_FIELDS, (user_id, user_dept, requested_dept, status))
+               if value is not None}
+    needles = _needles(filters)
+
+    matched = 0
+    for segment_path in sorted(glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))):
+        index = load_index(segment_path)
+        if not _segment_matches(index, since, until, filters):
+            continue
+        with open(segment_path, "rb") as f:
+            for block in index.blocks:
+                if (since and block["max_ts"] < since) or (until and block["min_ts"] >= until):
+                    continue
+                f.seek(block["offset"])
+                payload = zlib.decompress(f.read(block["length"]), wbits=31)
+                for line in payload.splitlines():
+                    if not all(needle in line for needle in needles):
+                        continue
+                    record = json.loads(line)
+                    if (since and record["ts"] < since) or (until and record["ts"] >= until):
+                        continue
+                    if any(record.get(field) != value for field, value in filters.items()):
+                        continue
+                    yield record
+                    matched += 1
+                    if limit is not None and matched >= limit:
+                        return
+
+
+def reindex(directory=AUDIT_LOG_DIR):
+    """Write sidecar indexes for segments that have none (e.g. after a crash)."""
+    written = 0
+    for segment_path in sorted(glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))):
+        if not os.path.exists(index_path(segment_path)):
+            SegmentIndex.build(segment_path).save(index_path(segment_path))
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the decision audit log")
+    parser.add_argument("--dir", default=AUDIT_LOG_DIR, help="Audit log directory")
+    parser.add_argument("--since", help="Start of the time range (ISO date or datetime, UTC)")
+    parser.add_argument("--until", help="End of the time range, exclusive (ISO date or datetime, UTC)")
+    parser.add_argument("--last-days", type=float, help="Shortcut for --since N days ago")
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--user-dept")
+    parser.add_argument("--requested-dept")
+    parser.add_argument("--status", help="approved, unauthorized, rejected or error")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--count", action="store_true", help="Only print the number of matching records")
+    parser.add_argument("--reindex", action="store_true", help="Build missing segment indexes and exit")
+    args = parser.parse_args()
+
+    if args.reindex:
+        print(f"Wrote {reindex(args.dir)} indexes")
+        return
+
+    since = args.since
+    if args.last_days is not None:
+        since = datetime.now(timezone.utc) - timedelta(days=args.last_days)
+
+    records = query_audit(args.dir, since=since, until=args.until, user_id=args.user_id,
+                          user_dept=args.user_dept, requested_dept=args.requested_dept,
+                          status=args.status, limit=args.limit)
+    if args.count:
+        print(sum(1 for _ in records))
+        return
+    for record in records:
+        sys.stdout.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
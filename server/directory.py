@@ -0,0 +1,222 @@
+import itertools
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from aggregates import DepartmentAggregates
+from employee_store import EmployeeStore
+from indexes import DirectoryIndexes
+from snapshot import SnapshotError, load_snapshot, write_snapshot
+import tenants
+
+logger = logging.getLogger(__name__)
+
+# Resident directory configuration (overridable through environment variables)
+EMPLOYEE_DATA_PATH = os.getenv("EMPLOYEE_DATA_PATH", "MOCK_DATA.csv")
+DIRECTORY_RELOAD_INTERVAL = float(os.getenv("DIRECTORY_RELOAD_INTERVAL", "5"))
+# Binary snapshot of the employee data (see snapshot.py); empty disables snapshots
+EMPLOYEE_SNAPSHOT_PATH = os.getenv("EMPLOYEE_SNAPSHOT_PATH", EMPLOYEE_DATA_PATH + ".snap")
+# "memory" (resident columnar store) or "sqlite" (see sqlite_directory.py)
+DIRECTORY_BACKEND = os.getenv("DIRECTORY_BACKEND", "memory").lower()
+
+# Generation numbers of swapped-in stores, unique across directories (e.g. a
+# tenant's directory reloaded after eviction)
+_generations = itertools.count(1)
+
+
+class EmployeeDirectory:
+    """Employee store kept in memory and reloaded when its source file changes.
+
+    The file's mtime is checked at most every DIRECTORY_RELOAD_INTERVAL
+    seconds. A reload builds a new store and swaps it in, so readers never
+    see a partly loaded directory; if the reload fails the old store stays.
+
+    When a snapshot at least as new as the CSV exists it is memory-mapped
+    instead of parsing the CSV; otherwise the CSV is parsed and a snapshot
+    written for the next process or restart. Secondary indexes (see
+    indexes.py) and dashboard aggregates (see aggregates.py) are saved in
+    the snapshot and mapped with it; they are only built after parsing the
+    CSV or mapping a snapshot written without them.
+    """
+
+    def __init__(self, path=EMPLOYEE_DATA_PATH, reload_interval=DIRECTORY_RELOAD_INTERVAL,
+                 snapshot_path=EMPLOYEE_SNAPSHOT_PATH):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.reload_interval = reload_interval
+        self._store = None
+        self._generation = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.stats = {"loads": 0, "load_errors": 0, "last_load_seconds": None, "last_index_seconds": None,
+                      "source": None, "upserts": 0}
+
+    def _snapshot_is_fresh(self, mtime):
+        try:
+            return bool(self.snapshot_path) and os.path.getmtime(self.snapshot_path) >= mtime
+        except OSError:
+            return False
+
+    def _load(self, mtime):
+        start = time.perf_counter()
+        store = None
+        if self._snapshot_is_fresh(mtime):
+            try:
+                store, source = load_snapshot(self.snapshot_path), self.snapshot_path
+            except (SnapshotError, OSError, ValueError) as e:
+                logger.warning("Ignoring employee snapshot %s: %s", self.snapshot_path, e)
+        if store is None:
+            store, source = EmployeeStore.from_csv(self.path), self.path
+        index_start = time.perf_counter()
+        if store.aggregates is None:
+            store.aggregates = DepartmentAggregates.from_store(store)
+        if store.indexes is None:
+            store.indexes = DirectoryIndexes.build(store)
+        index_seconds = time.perf_counter() - index_start
+        if source == self.path and self.snapshot_path:
+            try:
+                write_snapshot(store, self.snapshot_path, source={"path": self.path, "mtime": mtime})
+            except OSError as e:
+                logger.warning("Could not write employee snapshot %s: %s", self.snapshot_path, e)
+        self._store, self._mtime, self._generation = store, mtime, next(_generations)
+        self.stats["loads"] += 1
+        self.stats["last_load_seconds"] = round(time.perf_counter() - start, 4)
+        self.stats["last_index_seconds"] = round(index_seconds, 4)
+        self.stats["source"] = source
+        logger.info("Loaded %s employees from %s in %.3fs (%.1f MB)", len(store), source,
+                    self.stats["last_load_seconds"], store.nbytes() / 1e6)
+
+    @property
+    def store(self):
+        now = time.monotonic()
+        if self._store is None or now - self._checked >= self.reload_interval:
+            with self._lock:
+                if self._store is None or now - self._checked >= self.reload_interval:
+                    self._checked = now
+                    self._reload_if_changed()
+        return self._store
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime != self._mtime:
+                self._load(mtime)
+        except Exception as e:
+            self.stats["load_errors"] += 1
+            if self._store is None:
+                raise
+            logger.error("Reloading employee directory failed, keeping the loaded one: %s", e)
+
+    @property
+    def generation(self):
+        """Number of the current store, changed by every reload and upsert (for caches of employee records)."""
+        self.store
+        return self._generation
+
+    def get(self, user_id):
+        """Employee record by id, or None."""
+        return self.store.get(user_id)
+
+    def nbytes(self):
+        """Memory held by the loaded store (0 before the first load), without checking for changes."""
+        store = self._store
+        return store.nbytes() if store is not None else 0
+
+    def upsert(self, frame):
+        """Insert or replace employees by id; returns (inserted, updated).
+
+        The merged store is swapped in like a reload. Upserted employees live
+        in memory (and in the snapshot once persisted) until the source file
+        changes and is reloaded.
+
+        Every upsert copies the whole store; see upsert_store for merging
+        several chunks at once.
+        """
+        return self.upsert_store(EmployeeStore.from_dataframe(frame))
+
+    def upsert_store(self, chunk):
+        """Insert or replace the employees of an EmployeeStore by id; returns (inserted, updated).
+
+        Costs O(N) for a store of N employees however small the chunk is, so
+        bulk imports merge their chunks first (see employee_import.import_stream).
+        """
+        with self._write_lock:
+            while True:
+                base = self.store
+                found = base.rows_of(chunk.ids)
+                store, inserted, updated = base.upsert(chunk)
+                store.indexes = base.indexes.upserted(store, found[found >= 0])
+                store.aggregates = base.aggregates.upserted(base, store, found[found >= 0])
+                with self._lock:
+                    # Retry on top of a reload that happened meanwhile
+                    if self._store is base:
+                        self._store, self._generation = store, next(_generations)
+                        break
+        self.stats["upserts"] += inserted + updated
+        return inserted, updated
+
+    def persist(self):
+        """Write the current store to the snapshot, so a restart keeps upserted employees."""
+        if self.snapshot_path:
+            write_snapshot(self.store, self.snapshot_path, source={"path": self.path, "mtime": self._mtime})
+
+    def departments(self):
+        return list(self.store.columns["dept"].categories)
+
+    def scan_store(self, departments):
+        """Columnar store holding (at least) the employees of these departments."""
+        return self.store
+
+    def aggregates(self):
+        """DepartmentAggregates of the current store."""
+        return self.store.aggregates
+
+    def list_department(self, dept, limit=None):
+        """Employees of a department, in file order."""
+        store = self.store
+        rows = store.indexes.departments(dept)
+        return [store.record(int(row)) for row in rows[:limit]]
+
+    def department_page(self, dept, after=None, limit=100):
+        """Keyset page of a department's employees by id, like SQLiteDirectory.department_page.
+
+        Ids survive reloads and upserts, unlike row numbers, so a cursor
+        neither skips nor repeats employees when the store is swapped.
+
+        Returns:
+            list: Up to ``limit`` records with an id above ``after`` (from the start if None)
+            int: Key to pass as ``after`` for the next page, None if the page is empty
+        """
+        store = self.store
+        rows, ids = store.indexes.department_by_id(dept, store.ids)
+        start = 0 if after is None else int(np.searchsorted(ids, after, side="right"))
+        rows = rows[start:start + limit]
+        return [store.record(int(row)) for row in rows], int(ids[start + len(rows) - 1]) if len(rows) else None
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_directory():
+    """The current tenant's directory (see tenants.py), else the process-wide one backed by DIRECTORY_BACKEND."""
+    tenant = tenants.current()
+    if tenant is not None:
+        return tenant.directory
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                if DIRECTORY_BACKEND == "sqlite":
+                    from sqlite_directory import SQLiteDirectory
+                    _directory = SQLiteDirectory()
+                elif DIRECTORY_BACKEND == "memory":
+                    _directory = EmployeeDirectory()
+                else:
+                    raise ValueError(f"Unknown DIRECTORY_BACKEND: {DIRECTORY_BACKEND}")
+    return _directory
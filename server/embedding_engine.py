@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+# Cosine similarities are mapped onto the 0..1 score range used by the
+# decision rules in is_corporate_related. Single-label calls use a softmax
+# over the candidates; multi-label calls score each label independently
+# with a sigmoid centred on EMBEDDING_MIDPOINT.
+EMBEDDING_TEMPERATURE = float(os.getenv("EMBEDDING_TEMPERATURE", "0.05"))
+EMBEDDING_MIDPOINT = float(os.getenv("EMBEDDING_MIDPOINT", "0.3"))
+QUERY_CACHE_SIZE = 256
+
+
+class EmbeddingClassifier:
+    """Bi-encoder alternative to the zero-shot NLI pipeline.
+
+    Hypotheses ("This query is about {label}") are embedded once per label
+    and stacked into a matrix for each call, so label subsets (the branches
+    and leaves of the topic tree) reuse the same vectors; each query is
+    embedded once and scored against every label with a single
+    matrix-vector product. Instances are
+    called exactly like the transformers zero-shot pipeline, so
+    ``classify_query`` and ``is_corporate_related`` work unchanged.
+    """
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, temperature=EMBEDDING_TEMPERATURE,
+                 midpoint=EMBEDDING_MIDPOINT, device=None):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self._torch = torch
+        self.model_name = model_name
+        self.temperature = temperature
+        self.midpoint = midpoint
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(self.device).eval()
+
+        self._hypotheses = {}
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+
+    def embed(self, texts):
+        """Embed texts with mean pooling; returns L2-normalized rows."""
+        torch = self._torch
+        encoded = self.tokenizer(texts, padding=True, truncation=True, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            output = self.model(**encoded).last_hidden_state
+        mask = encoded["attention_mask"].unsqueeze(-1).to(output.dtype)
+        pooled = (output * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+        return pooled.cpu().numpy()
+
+    def warm_up(self, label_sets):
+        """Pre-embed hypotheses for a list of (labels, hypothesis_template) pairs."""
+        for labels, template in label_sets:
+            self._hypothesis_matrix(labels, template)
+        logger.info("Embedded %s hypotheses", len(self._hypotheses))
+
+    def _hypothesis_matrix(self, labels, template):
+        missing = [label for label in dict.fromkeys(labels) if (template, label) not in self._hypotheses]
+        if missing:
+            for label, vector in zip(missing, self.embed([template.format(label) for label in missing])):
+                self._hypotheses[(template, label)] = vector
+        return np.stack([self._hypotheses[(template, label)] for label in labels])
+
+    def _query_vector(self, query):
+        # Both classification stages score the same query, so it is embedded once.
+        # Requests run in a threadpool; the lock is not held while embedding.
+        with self._query_cache_lock:
+            vector = self._query_cache.get(query)
+            if vector is not None:
+                self._query_cache.move_to_end(query)
+                return vector
+        vector = self.embed([query])[0]
+        with self._query_cache_lock:
+            self._query_cache[query] = vector
+            self._query_cache.move_to_end(query)
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def __call__(self, sequences, candidate_labels, hypothesis_template="This example is {}.", multi_label=False):
+        single = isinstance(sequences, str)
+        queries = [sequences] if single else list(sequences)
+        matrix = self._hypothesis_matrix(candidate_labels, hypothesis_template)
+
+        results = []
+        for query in queries:
+            similarities = matrix @ self._query_vector(query)
+            if multi_label:
+                scores = 1.0 / (1.0 + np.exp(-(similarities - self.midpoint) / self.temperature))
+            else:
+                logits = similarities / self.temperature
+                scores = np.exp(logits - logits.max())
+                scores /= scores.sum()
+            order = np.argsort(-scores)
+            results.append({
+                "sequence": query,
+                "labels": [candidate_labels[i] for i in order],
+                "scores": [float(scores[i]) for i in order]
+            })
+        return results[0] if single else results
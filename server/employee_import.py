@@ -0,0 +1,168 @@
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from employee_store import FIELDS, JOIN_DATE_FORMAT, EmployeeStore
+
+logger = logging.getLogger(__name__)
+
+# Bulk import configuration (overridable through environment variables)
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "50000"))
+UPLOAD_MAX_REPORTED_ERRORS = int(os.getenv("UPLOAD_MAX_REPORTED_ERRORS", "100"))
+
+REQUIRED_FIELDS = ("id", "dept")
+FORMATS = ("csv", "ndjson")
+MAX_EMPLOYEE_ID = np.iinfo(np.int32).max
+
+
+class UploadRejected(ValueError):
+    """Raised when an upload does not match the employee data schema as a whole."""
+
+
+def detect_format(filename=None, content_type=None):
+    """Upload format from the file name or content type (CSV unless it looks like NDJSON)."""
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl", ".json")) or "ndjson" in (content_type or "") or \
+            "jsonl" in (content_type or ""):
+        return "ndjson"
+    return "csv"
+
+
+def read_chunks(fileobj, fmt="csv", chunk_rows=UPLOAD_CHUNK_ROWS):
+    """Yield DataFrames of at most chunk_rows raw rows from a CSV or NDJSON stream."""
+    if fmt not in FORMATS:
+        raise UploadRejected(f"Unsupported upload format: {fmt}")
+    if fmt == "csv":
+        reader = pd.read_csv(fileobj, chunksize=chunk_rows, dtype=str, skipinitialspace=True)
+    else:
+        reader = pd.read_json(fileobj, lines=True, chunksize=chunk_rows, dtype=False, convert_dates=False)
+    with reader:
+        yield from reader
+
+
+def validate_chunk(chunk, first_row=0):
+    """Check a raw chunk against the employee data schema.
+
+    Returns:
+        DataFrame: Valid rows, typed like EmployeeStore.from_dataframe expects
+        list: One {"row", "id", "error"} dict per rejected row (rows are 1-based data rows)
+    """
+    unknown = [column for column in chunk.columns if column not in FIELDS]
+    if unknown:
+        raise UploadRejected(f"Unknown columns: {', '.join(map(str, unknown))}")
+    missing = [field for field in REQUIRED_FIELDS if field not in chunk.columns]
+    if missing:
+        raise UploadRejected(f"Missing required columns: {', '.join(missing)}")
+    chunk = chunk.reindex(columns=list(FIELDS)).astype(object)
+    chunk = chunk.where(chunk.notna(), None)
+
+    problems = pd.Series(None, index=chunk.index, dtype=object)
+
+    def reject(mask, error):
+        problems[mask & problems.isna()] = error
+
+    ids = pd.to_numeric(chunk["id"], errors="coerce")
+    reject(ids.isna() | (ids != ids.round()) | (ids <= 0) | (ids > MAX_EMPLOYEE_ID), "id must be a positive integer")
+
+    dept = chunk["dept"].map(lambda value: str(value).strip() if value is not None else "")
+    reject(dept == "", "dept is required")
+
+    email = chunk["email"]
+    reject(email.notna() & ~email.astype(str).str.contains("@", regex=False), "email is not an address")
+
+    join_date = chunk["join_date"]
+    # Dates repeat a lot, so only the distinct values are parsed
+    codes, uniques = pd.factorize(join_date)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object).astype(str), format=JOIN_DATE_FORMAT, errors="coerce")
+    parsed = pd.Series(np.append(parsed.to_numpy(dtype="datetime64[ns]"), np.datetime64("NaT", "ns"))[codes],
+                       index=chunk.index)
+    reject(join_date.notna() & parsed.isna(), f"join_date must use {JOIN_DATE_FORMAT}")
+
+    violations = pd.to_numeric(chunk["past_violations"], errors="coerce")
+    reject(chunk["past_violations"].notna() & (violations.isna() | (violations < 0) | (violations != violations.round())),
+           "past_violations must be a non-negative integer")
+
+    valid = problems.isna()
+    errors = [{"row": first_row + int(position) + 1, "id": chunk["id"].iat[position], "error": problems.iat[position]}
+              for position in np.flatnonzero(~valid.to_numpy())]
+    rows = chunk[valid].copy()
+    rows["id"] = ids[valid].astype(np.int64)
+    rows["dept"] = dept[valid]
+    rows["join_date"] = parsed[valid]
+    rows["past_violations"] = violations[valid].fillna(0).astype(np.int64)
+    # A later row for the same id wins, as it would when upserted one by one
+    return rows.drop_duplicates("id", keep="last"), errors
+
+
+def _push(pending, chunk):
+    # Merge chunk stores like a binary counter: equal-sized neighbours are
+    # merged, so each row is copied O(log chunks) times. Later chunks win.
+    while pending and len(pending[-1]) <= len(chunk):
+        chunk, _, _ = pending.pop().upsert(chunk)
+    pending.append(chunk)
+
+
+def _merged(pending):
+    merged = pending[0]
+    for chunk in pending[1:]:
+        merged, _, _ = merged.upsert(chunk)
+    return merged
+
+
+def import_stream(fileobj, target, fmt="csv", chunk_rows=UPLOAD_CHUNK_ROWS):
+    """Validate a CSV or NDJSON stream chunk by chunk and upsert it into a directory.
+
+    Only one chunk of parsed rows is held in memory at a time. Rows that
+    fail validation are skipped and reported; a schema problem (unknown or
+    missing columns) stops the import, leaving the chunks before it applied.
+
+    A target with upsert_store(store) (the resident directory) copies its
+    whole store on every upsert, so upserting K chunks into N employees
+    would cost O(K * N). Its chunks are instead kept as compact columnar
+    stores, merged with each other, and upserted once at the end. Other
+    targets take one upsert(frame) per chunk.
+
+    Args:
+        fileobj: Binary or text file object positioned at the start of the data
+        target: Directory with upsert(frame) returning (inserted, updated) and persist()
+
+    Returns:
+        dict: Row counts, elapsed seconds and the first UPLOAD_MAX_REPORTED_ERRORS errors
+    """
+    start = time.perf_counter()
+    summary = {"rows": 0, "inserted": 0, "updated": 0, "rejected": 0, "chunks": 0, "errors": []}
+    upsert_store = getattr(target, "upsert_store", None)
+    pending = []
+    try:
+        for chunk in read_chunks(fileobj, fmt, chunk_rows):
+            rows, errors = validate_chunk(chunk, summary["rows"])
+            summary["rows"] += len(chunk)
+            summary["rejected"] += len(errors)
+            summary["errors"].extend(errors[:UPLOAD_MAX_REPORTED_ERRORS - len(summary["errors"])])
+            if len(rows) and upsert_store is not None:
+                with metrics.stage("directory_upsert"):
+                    _push(pending, EmployeeStore.from_dataframe(rows))
+            elif len(rows):
+                with metrics.stage("directory_upsert"):
+                    inserted, updated = target.upsert(rows)
+                summary["inserted"] += inserted
+                summary["updated"] += updated
+            summary["chunks"] += 1
+            logger.info("Imported chunk %s: %s rows, %s rejected", summary["chunks"], len(chunk), len(errors))
+    finally:
+        if pending:
+            with metrics.stage("directory_upsert"):
+                inserted, updated = upsert_store(_merged(pending))
+            summary["inserted"] += inserted
+            summary["updated"] += updated
+        for result in ("inserted", "updated", "rejected"):
+            metrics.EMPLOYEE_UPSERTS.inc(result, amount=summary[result])
+        if summary["inserted"] or summary["updated"]:
+            target.persist()
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
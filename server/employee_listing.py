@@ -0,0 +1,126 @@
+"""Paged and streamed employee listings for /api/employees.
+
+Listings walk the authorized departments in name order and each
+department through the directory's department index. A page ends with an
+opaque cursor holding the department and the id of its last employee; the
+next page resumes right after it, so paging costs the same on the first
+page and the last, and stays in place when the directory is reloaded or
+upserted between pages. Exports
+stream every employee in CSV or NDJSON, one chunk at a time.
+"""
+
+import base64
+import binascii
+import csv
+import io
+import json
+import os
+from datetime import date
+
+from query_engine import RESULT_FIELDS
+
+# Employee listing configuration (overridable through environment variables)
+EMPLOYEE_PAGE_SIZE = int(os.getenv("EMPLOYEE_PAGE_SIZE", "100"))
+EMPLOYEE_PAGE_MAX = int(os.getenv("EMPLOYEE_PAGE_MAX", "1000"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+# Columns a listing can return (IP addresses and profile URLs are never listed)
+LISTING_FIELDS = RESULT_FIELDS
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+class InvalidListing(ValueError):
+    """Raised for unknown fields and for cursors this API did not produce."""
+
+
+def parse_fields(fields):
+    """Columns requested as a comma-separated ``fields`` parameter (None: all listing fields)."""
+    if not fields:
+        return LISTING_FIELDS
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in LISTING_FIELDS]
+    if unknown or not names:
+        raise InvalidListing(f"Unknown fields: {', '.join(unknown) or fields}; "
+                             f"choose from {', '.join(LISTING_FIELDS)}")
+    return tuple(dict.fromkeys(names))
+
+
+def encode_cursor(dept, after):
+    raw = json.dumps({"dept": dept, "after": after}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """(department, employee id) stored in a cursor."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        dept, after = position["dept"], position["after"]
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise InvalidListing("Invalid cursor")
+    if not isinstance(dept, str) or not isinstance(after, int):
+        raise InvalidListing("Invalid cursor")
+    return dept, after
+
+
+def _project(record, fields):
+    values = {field: record[field] for field in fields}
+    if isinstance(values.get("join_date"), date):
+        values["join_date"] = values["join_date"].isoformat()
+    return values
+
+
+def page(directory, departments, fields=LISTING_FIELDS, limit=EMPLOYEE_PAGE_SIZE, cursor=None):
+    """One page of the employees of the given departments.
+
+    Returns:
+        dict: "employees" (projected records), "departments" and "next_cursor"
+        (None once the listing is exhausted)
+    """
+    departments = sorted(departments)
+    start_dept, start_after = decode_cursor(cursor) if cursor else (None, None)
+    employees, next_cursor = [], None
+    for dept in departments:
+        if start_dept is not None and dept < start_dept:
+            continue
+        records, after = directory.department_page(dept, start_after if dept == start_dept else None,
+                                                   limit - len(employees))
+        employees.extend(_project(record, fields) for record in records)
+        if len(employees) >= limit:
+            next_cursor = encode_cursor(dept, after)
+            break
+    return {"employees": employees, "returned": len(employees), "departments": departments,
+            "fields": list(fields), "next_cursor": next_cursor}
+
+
+def _chunks(directory, departments, fields, chunk_rows):
+    # Projected records of every employee of the departments, chunk_rows at a time
+    for dept in sorted(departments):
+        after = None
+        while True:
+            records, last = directory.department_page(dept, after, chunk_rows)
+            if records:
+                yield [_project(record, fields) for record in records]
+            if len(records) < chunk_rows:
+                break
+            after = last
+
+
+def export(directory, departments, fields=LISTING_FIELDS, fmt="csv", chunk_rows=EXPORT_CHUNK_ROWS):
+    """Generator of CSV or NDJSON text (``fmt``) covering every employee of the departments.
+
+    Each chunk is serialized as soon as it is read, so memory does not grow
+    with the size of the export.
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+        writer.writeheader()
+        yield buffer.getvalue()
+    for chunk in _chunks(directory, departments, fields, chunk_rows):
+        if fmt == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+        else:
+            yield "".join(json.dumps(employee) + "\n" for employee in chunk)
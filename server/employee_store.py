@@ -0,0 +1,463 @@
+import collections.abc
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Employee data columns, in CSV order
+FIELDS = ("id", "first_name", "last_name", "email", "gender", "ip_address", "dept", "profile_url",
+          "join_date", "past_violations")
+STRING_FIELDS = ("first_name", "last_name", "email", "profile_url")
+CATEGORY_FIELDS = ("dept", "gender")
+
+EPOCH = date(1970, 1, 1)
+MISSING_DAY = np.iinfo(np.int32).min
+JOIN_DATE_FORMAT = "%d/%m/%Y"
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT
+
+
+def _upserted(values, rows, updates, appended):
+    # New array: values with rows overwritten by updates and appended added at the end
+    merged = np.concatenate([values, np.asarray(appended, dtype=values.dtype)])
+    merged[rows] = updates
+    return merged
+
+
+def _runs(rows, sources):
+    # (first row, first source, length) of the runs where rows and sources both advance by one
+    if not len(rows):
+        return []
+    breaks = np.flatnonzero((np.diff(rows) != 1) | (np.diff(sources) != 1)) + 1
+    starts = np.concatenate([[0], breaks])
+    lengths = np.diff(np.concatenate([starts, [len(rows)]]))
+    return zip(rows[starts].tolist(), sources[starts].tolist(), lengths.tolist())
+
+
+def _code_dtype(categories):
+    return np.int8 if len(categories) < 127 else np.int16 if len(categories) < 32767 else np.int32
+
+
+class StringColumn:
+    """UTF-8 strings packed into one byte heap with an offsets array (missing values are empty)."""
+
+    __slots__ = ("heap", "offsets")
+
+    def __init__(self, heap, offsets):
+        self.heap = heap
+        self.offsets = offsets
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [v.encode("utf-8") if type(v) is str else b"" if _is_missing(v) else str(v).encode("utf-8")
+                   for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __getitem__(self, row):
+        return self.heap[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def _slice(self, row, count):
+        return self.heap[self.offsets[row]:self.offsets[row + count]]
+
+    def upserted(self, rows, other, sources, appended):
+        """New column with ``rows`` replaced by ``other[sources]`` and ``other[appended]`` added.
+
+        The heap is copied in slices: one per run of unchanged rows and one
+        per run of replaced rows whose new values are adjacent in ``other``.
+        """
+        order = np.argsort(rows, kind="stable")
+        pieces, start = [], 0
+        for row, source, count in _runs(rows[order], sources[order]):
+            pieces.append(self.heap[self.offsets[start]:self.offsets[row]])
+            pieces.append(other._slice(source, count))
+            start = row + count
+        pieces.append(self.heap[self.offsets[start]:self.offsets[-1]])
+        pieces.extend(other._slice(source, count) for _, source, count in _runs(np.arange(len(appended)), appended))
+
+        lengths = np.diff(self.offsets)
+        other_lengths = np.diff(other.offsets)
+        lengths = _upserted(lengths, rows, other_lengths[sources], other_lengths[appended])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return StringColumn(np.concatenate(pieces).astype(np.uint8, copy=False), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.heap.nbytes + self.offsets.nbytes
+
+
+class CategoryColumn:
+    """Dictionary-encoded strings: small integer codes into a list of categories (-1 = missing)."""
+
+    __slots__ = ("codes", "categories")
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def from_values(cls, values):
+        codes, categories = pd.factorize(pd.Series(values, dtype=object), sort=True)
+        return cls(codes.astype(_code_dtype(categories)), [str(c) for c in categories])
+
+    def __getitem__(self, row):
+        code = self.codes[row]
+        return self.categories[code] if code >= 0 else None
+
+    def upserted(self, rows, other, sources, appended):
+        # Categories the store has not seen yet get the next free codes
+        categories = list(self.categories)
+        positions = {category: code for code, category in enumerate(categories)}
+        mapping = np.empty(len(other.categories) + 1, dtype=np.int64)
+        mapping[-1] = -1
+        for code, category in enumerate(other.categories):
+            if category not in positions:
+                positions[category] = len(categories)
+                categories.append(category)
+            mapping[code] = positions[category]
+        codes = mapping[other.codes]
+        base = self.codes.astype(_code_dtype(categories), copy=False)
+        return CategoryColumn(_upserted(base, rows, codes[sources], codes[appended]), categories)
+
+    def code_of(self, value):
+        """Code of a category, or None if no row has this value."""
+        try:
+            return self.categories.index(value)
+        except ValueError:
+            return None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + sum(len(c) for c in self.categories)
+
+
+def _pack_ipv4(value):
+    # Dotted quad -> 32-bit integer, -1 for anything else
+    try:
+        a, b, c, d = map(int, value.split("."))
+    except (ValueError, AttributeError):
+        return -1
+    return (a << 24) | (b << 16) | (c << 8) | d if 0 <= (a | b | c | d) < 256 else -1
+
+
+class IPv4Column:
+    """IPv4 addresses packed into uint32; anything else (hostnames, IPv6) is kept as text on the side."""
+
+    __slots__ = ("packed", "valid", "other")
+
+    def __init__(self, packed, valid, other):
+        self.packed = packed
+        self.valid = valid
+        self.other = other
+
+    @classmethod
+    def from_values(cls, values):
+        values = list(values)
+        parsed = np.fromiter((_pack_ipv4(v) for v in values), dtype=np.int64, count=len(values))
+        valid = parsed >= 0
+        other = {int(row): str(values[row]) for row in np.flatnonzero(~valid) if not _is_missing(values[row])}
+        return cls(np.where(valid, parsed, 0).astype(np.uint32), valid, other)
+
+    def upserted(self, rows, other, sources, appended):
+        replaced = set(rows.tolist())
+        extra = {row: value for row, value in self.other.items() if row not in replaced}
+        for row, source in zip(rows.tolist(), sources.tolist()):
+            if source in other.other:
+                extra[row] = other.other[source]
+        for row, source in enumerate(appended.tolist(), start=len(self)):
+            if source in other.other:
+                extra[row] = other.other[source]
+        return IPv4Column(_upserted(self.packed, rows, other.packed[sources], other.packed[appended]),
+                          _upserted(self.valid, rows, other.valid[sources], other.valid[appended]), extra)
+
+    def __getitem__(self, row):
+        if not self.valid[row]:
+            return self.other.get(row)
+        ip = int(self.packed[row])
+        return f"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}"
+
+    def __len__(self):
+        return len(self.packed)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes + self.valid.nbytes + sum(len(v) for v in self.other.values())
+
+
+class DateColumn:
+    """Dates as int32 day numbers since 1970-01-01 (MISSING_DAY = missing)."""
+
+    __slots__ = ("days",)
+
+    def __init__(self, days):
+        self.days = days
+
+    @classmethod
+    def from_values(cls, values, fmt=JOIN_DATE_FORMAT):
+        series = pd.Series(values)
+        if not pd.api.types.is_datetime64_any_dtype(series):
+            # Dates repeat a lot, so only the distinct values are parsed
+            codes, uniques = pd.factorize(series)
+            parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=fmt, errors="coerce").to_numpy()
+            # Missing values have code -1, which picks the trailing NaT
+            series = pd.Series(np.append(parsed.astype("datetime64[ns]"), np.datetime64("NaT", "ns"))[codes])
+        days = series.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+        days[series.isna().to_numpy()] = MISSING_DAY
+        return cls(days.astype(np.int32))
+
+    def __getitem__(self, row):
+        day = int(self.days[row])
+        return None if day == MISSING_DAY else EPOCH + timedelta(days=day)
+
+    def upserted(self, rows, other, sources, appended):
+        return DateColumn(_upserted(self.days, rows, other.days[sources], other.days[appended]))
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def nbytes(self):
+        return self.days.nbytes
+
+
+class IntColumn:
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, row):
+        return int(self.values[row])
+
+    def upserted(self, rows, other, sources, appended):
+        return IntColumn(_upserted(self.values, rows, other.values[sources], other.values[appended]))
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+
+class EmployeeRecord(collections.abc.Mapping):
+    """Read view of one employee row, used like the dict get_user_by_id returns.
+
+    Values are decoded from the columns on access. Assignments (e.g.
+    ``record['past_violations'] = ...`` in process_user_query) go into a
+    per-record overlay and never modify the store.
+    """
+
+    __slots__ = ("_store", "_row", "_overrides")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+        self._overrides = None
+
+    def __getitem__(self, key):
+        if self._overrides is not None and key in self._overrides:
+            return self._overrides[key]
+        column = self._store.columns.get(key)
+        if column is None:
+            raise KeyError(key)
+        return column[self._row]
+
+    def get(self, key, default=None):
+        if self._overrides is not None and key in self._overrides:
+            return self._overrides[key]
+        column = self._store.columns.get(key)
+        return column[self._row] if column is not None else default
+
+    def __setitem__(self, key, value):
+        if self._overrides is None:
+            self._overrides = {}
+        self._overrides[key] = value
+
+    def __contains__(self, key):
+        return key in self._store.columns or (self._overrides is not None and key in self._overrides)
+
+    def __iter__(self):
+        yield from self._store.columns
+        if self._overrides:
+            yield from (key for key in self._overrides if key not in self._store.columns)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @property
+    def row(self):
+        return self._row
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def __repr__(self):
+        return f"EmployeeRecord({self.to_dict()!r})"
+
+
+class EmployeeStore:
+    """Columnar, memory-compact employee directory.
+
+    ``dept`` and ``gender`` are dictionary-encoded, ids are int32, IPv4
+    addresses are packed into uint32, join dates are int32 day numbers and
+    the remaining strings share one UTF-8 heap per column. Employees are
+    found by id through a dense row index (O(1)) and returned as
+    EmployeeRecord views.
+
+    Stores are never modified once built: upsert() returns a new store, so
+    readers holding the old one are unaffected. ``indexes`` and
+    ``aggregates`` hold the store's secondary indexes (see indexes.py) and
+    dashboard aggregates (see aggregates.py) once the directory built them.
+    """
+
+    def __init__(self, columns, dense_index=None, index=None):
+        self.columns = columns
+        self.ids = columns["id"].values
+        self.indexes = None
+        self.aggregates = None
+        if dense_index is not None or index is not None:
+            # Prebuilt index, e.g. mapped from a snapshot or carried over by upsert
+            self._dense_index, self._index = dense_index, index
+        else:
+            self._build_index()
+
+    @classmethod
+    def from_dataframe(cls, df):
+        columns = {"id": IntColumn(df["id"].to_numpy(dtype=np.int32))}
+        for field in FIELDS[1:]:
+            values = df[field].tolist() if field in df.columns else [None] * len(df)
+            if field in STRING_FIELDS:
+                columns[field] = StringColumn.from_values(values)
+            elif field in CATEGORY_FIELDS:
+                columns[field] = CategoryColumn.from_values(values)
+            elif field == "ip_address":
+                columns[field] = IPv4Column.from_values(values)
+            elif field == "join_date":
+                columns[field] = DateColumn.from_values(df[field] if field in df.columns else values)
+            elif field == "past_violations":
+                violations = pd.to_numeric(pd.Series(values), errors="coerce").fillna(0)
+                columns[field] = IntColumn(violations.to_numpy(dtype=np.int16))
+        return cls(columns)
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        return cls.from_dataframe(pd.read_csv(csv_path, dtype={"join_date": str}))
+
+    @staticmethod
+    def _dense_fits(ids, rows):
+        return len(ids) and ids.min() >= 0 and ids.max() <= 4 * rows + 1024
+
+    def _build_index(self):
+        # Dense id -> row array when ids are reasonably compact, a dict otherwise
+        if self._dense_fits(self.ids, len(self.ids)):
+            index = np.full(int(self.ids.max()) + 1, -1, dtype=np.int32)
+            index[self.ids] = np.arange(len(self.ids), dtype=np.int32)
+            self._dense_index, self._index = index, None
+        else:
+            self._dense_index, self._index = None, {int(uid): row for row, uid in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, user_id):
+        """Row of an employee id, or None."""
+        try:
+            user_id = int(user_id)
+        except (ValueError, TypeError):
+            return None
+        if self._dense_index is not None:
+            if 0 <= user_id < len(self._dense_index):
+                row = int(self._dense_index[user_id])
+                return row if row >= 0 else None
+            return None
+        return self._index.get(user_id)
+
+    def rows_of(self, ids):
+        """Rows of an array of employee ids (-1 where there is no such employee)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._dense_index is None:
+            return np.fromiter((self._index.get(int(uid), -1) for uid in ids), dtype=np.int64, count=len(ids))
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self._dense_index))
+        rows[known] = self._dense_index[ids[known]]
+        return rows
+
+    def get(self, user_id):
+        """Employee record by id, or None if there is no such employee."""
+        row = self.row_of(user_id)
+        return EmployeeRecord(self, row) if row is not None else None
+
+    def record(self, row):
+        return EmployeeRecord(self, row)
+
+    def upsert(self, other):
+        """New store with the employees of ``other`` inserted or replaced by id.
+
+        Replaced employees keep their rows and new ones are appended. The id
+        index is carried over and patched for the new ids instead of being
+        rebuilt (secondary indexes are patched by the caller, see
+        DirectoryIndexes.upserted).
+
+        Returns:
+            EmployeeStore: The merged store
+            int: Employees inserted
+            int: Employees updated
+        """
+        found = self.rows_of(other.ids)
+        rows = found[found >= 0]
+        sources = np.flatnonzero(found >= 0)
+        appended = np.flatnonzero(found < 0)
+        columns = {field: column.upserted(rows, other.columns[field], sources, appended)
+                   for field, column in self.columns.items()}
+
+        new_ids = other.ids[appended].astype(np.int64)
+        new_rows = np.arange(len(self), len(self) + len(appended), dtype=np.int64)
+        dense_index, index = self._dense_index, self._index
+        if not len(appended):
+            pass
+        elif dense_index is not None and self._dense_fits(new_ids, len(self) + len(appended)):
+            size = max(len(dense_index), int(new_ids.max()) + 1)
+            dense_index = np.concatenate([dense_index, np.full(size - len(dense_index), -1, dtype=np.int32)])
+            dense_index[new_ids] = new_rows
+        else:
+            if dense_index is not None:
+                index = {int(uid): row for row, uid in enumerate(self.ids)}
+                dense_index = None
+            else:
+                index = dict(index)
+            index.update(zip(new_ids.tolist(), new_rows.tolist()))
+        return EmployeeStore(columns, dense_index=dense_index, index=index), len(appended), len(rows)
+
+    @property
+    def dense_index(self):
+        return self._dense_index
+
+    def nbytes(self):
+        index = self._dense_index.nbytes if self._dense_index is not None else 0
+        return sum(column.nbytes for column in self.columns.values()) + index
+
+    def to_dataframe(self):
+        """Materialize the store as a DataFrame shaped like load_user_data's."""
+        data = {}
+        for field, column in self.columns.items():
+            if isinstance(column, IntColumn):
+                data[field] = column.values
+            elif isinstance(column, CategoryColumn):
+                data[field] = pd.Categorical.from_codes(column.codes, column.categories)
+            elif isinstance(column, DateColumn):
+                days = column.days.astype("datetime64[D]")
+                data[field] = pd.to_datetime(np.where(column.days == MISSING_DAY, np.datetime64("NaT"), days))
+            else:
+                data[field] = [column[row] for row in range(len(self))]
+        return pd.DataFrame(data)
@@ -0,0 +1,329 @@
+import numpy as np
+
+from employee_store import EPOCH, MISSING_DAY
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+class Bitmap:
+    """Set of rows as a packed bit array (bit ``row % 8`` of byte ``row // 8``)."""
+
+    __slots__ = ("bits", "size")
+
+    def __init__(self, bits, size):
+        self.bits = bits
+        self.size = size
+
+    @classmethod
+    def from_mask(cls, mask):
+        return cls(np.packbits(mask, bitorder="little"), len(mask))
+
+    @classmethod
+    def empty(cls, size):
+        return cls(np.zeros((size + 7) // 8, dtype=np.uint8), size)
+
+    def contains(self, rows):
+        """Boolean array telling which of the given rows are set."""
+        return ((self.bits[rows >> 3] >> (rows & 7).astype(np.uint8)) & 1).astype(bool)
+
+    def rows(self):
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.size, bitorder="little"))
+
+    def __len__(self):
+        return int(np.unpackbits(self.bits, count=self.size, bitorder="little").sum())
+
+    def __and__(self, other):
+        return Bitmap(self.bits & other.bits, self.size)
+
+    def __or__(self, other):
+        return Bitmap(self.bits | other.bits, self.size)
+
+    def resized(self, size):
+        bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+        bits[:min(len(bits), len(self.bits))] = self.bits[:len(bits)]
+        return Bitmap(bits, size)
+
+    def set(self, rows, value):
+        # In place; only used on bitmaps that are not shared yet
+        rows = np.asarray(rows, dtype=np.int64)
+        masks = (np.uint8(1) << (rows & 7).astype(np.uint8)).astype(np.uint8)
+        if value:
+            np.bitwise_or.at(self.bits, rows >> 3, masks)
+        else:
+            np.bitwise_and.at(self.bits, rows >> 3, ~masks)
+
+
+class KeyRange:
+    """Rows whose key lies in [low, high], from a SortedIndex, materialized only when needed.
+
+    When another operand of an intersection is smaller, its rows are checked
+    against the keys directly instead of sorting the whole range.
+    """
+
+    __slots__ = ("index", "values", "low", "high", "start", "stop")
+
+    def __init__(self, index, values, low, high):
+        self.index = index
+        self.values = values
+        self.low, self.high = low, high
+        # Bounds in the keys' dtype, so the search does not convert the whole key array
+        key = index.keys.dtype.type
+        self.start = 0 if low is None else int(np.searchsorted(index.keys, key(low), side="left"))
+        self.stop = len(index.keys) if high is None else int(np.searchsorted(index.keys, key(high), side="right"))
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def rows(self):
+        return np.sort(self.index.order[self.start:self.stop]) if self.stop > self.start else _EMPTY
+
+    def contains(self, rows):
+        keys = self.values[rows]
+        inside = np.ones(len(rows), dtype=bool)
+        if self.low is not None:
+            inside &= keys >= self.low
+        if self.high is not None:
+            inside &= keys <= self.high
+        return inside
+
+
+def _member(rows, sorted_rows):
+    # Which of rows occur in sorted_rows, in O(len(rows) * log(len(sorted_rows)))
+    positions = np.searchsorted(sorted_rows, rows)
+    found = positions < len(sorted_rows)
+    found[found] = sorted_rows[positions[found]] == rows[found]
+    return found
+
+
+def intersect(*operands):
+    """Rows present in every operand (sorted row arrays, KeyRanges or Bitmaps), as a sorted array.
+
+    The smallest row array or range is materialized and probed against the
+    others, so the cost follows the smallest operand rather than the
+    directory size.
+    """
+    arrays = sorted((op for op in operands if not isinstance(op, Bitmap)), key=len)
+    bitmaps = [op for op in operands if isinstance(op, Bitmap)]
+    if not arrays:
+        if not bitmaps:
+            return _EMPTY
+        combined = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            combined = combined & bitmap
+        return combined.rows()
+    rows = arrays[0].rows() if isinstance(arrays[0], KeyRange) else arrays[0]
+    for other in arrays[1:] + bitmaps:
+        if not len(rows):
+            break
+        rows = rows[_member(rows, other) if isinstance(other, np.ndarray) else other.contains(rows)]
+    return rows
+
+
+def union(*operands):
+    """Rows present in any operand (sorted row arrays or Bitmaps), as a sorted array."""
+    arrays = [op if isinstance(op, np.ndarray) else op.rows() for op in operands]
+    if not arrays:
+        return _EMPTY
+    if len(arrays) == 1:
+        return arrays[0]
+    rows = np.sort(np.concatenate(arrays))
+    if len(rows):
+        rows = rows[np.concatenate([[True], rows[1:] != rows[:-1]])]
+    return rows
+
+
+class ValueIndex:
+    """Sorted row array per value of a dictionary-encoded column."""
+
+    __slots__ = ("rows_by_code", "column")
+
+    def __init__(self, rows_by_code, column):
+        self.rows_by_code = rows_by_code
+        self.column = column
+
+    @classmethod
+    def build(cls, column):
+        codes = column.codes
+        order = np.argsort(codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        return cls({int(codes[group[0]]): group for group in np.split(order, bounds) if len(group)}, column)
+
+    def rows(self, value):
+        code = self.column.code_of(value)
+        return _EMPTY if code is None else self.rows_by_code.get(code, _EMPTY)
+
+    def upserted(self, column, rows, new_rows):
+        """Index of ``column`` after ``rows`` were replaced and ``new_rows`` appended."""
+        rows_by_code = dict(self.rows_by_code)
+        old_codes, codes = self.column.codes[rows], column.codes[rows]
+        changed = old_codes != codes
+        for code in np.unique(old_codes[changed]).tolist():
+            moved = np.sort(rows[changed & (old_codes == code)])
+            rows_by_code[code] = rows_by_code[code][~_member(rows_by_code[code], moved)]
+        for code in np.unique(codes[changed]).tolist():
+            rows_by_code[code] = np.union1d(rows_by_code.get(code, _EMPTY), rows[changed & (codes == code)])
+        appended = column.codes[new_rows]
+        for code in np.unique(appended).tolist():
+            rows_by_code[code] = np.concatenate([rows_by_code.get(code, _EMPTY), new_rows[appended == code]])
+        return ValueIndex(rows_by_code, column)
+
+
+class SortedIndex:
+    """Rows ordered by an integer key, for range lookups by binary search."""
+
+    __slots__ = ("keys", "order")
+
+    def __init__(self, keys, order):
+        self.keys = keys
+        self.order = order
+
+    @classmethod
+    def build(cls, values):
+        order = np.argsort(values, kind="stable")
+        return cls(values[order], order)
+
+    def range(self, low=None, high=None):
+        """Sorted rows whose key is within [low, high] (either bound may be None)."""
+        return KeyRange(self, None, low, high).rows()
+
+    def upserted(self, values, rows, new_rows):
+        """Index of ``values`` after ``rows`` were replaced and ``new_rows`` appended."""
+        keep = ~np.isin(self.order, rows)
+        keys, order = self.keys[keep], self.order[keep]
+        inserted = np.concatenate([rows, new_rows])
+        inserted_keys = values[inserted]
+        by_key = np.argsort(inserted_keys, kind="stable")
+        positions = np.searchsorted(keys, inserted_keys[by_key], side="right")
+        return SortedIndex(np.insert(keys, positions, inserted_keys[by_key]), np.insert(order, positions, inserted[by_key]))
+
+
+class BitmapIndex:
+    """One Bitmap per value of a low-cardinality dictionary-encoded column."""
+
+    __slots__ = ("bitmaps", "column")
+
+    def __init__(self, bitmaps, column):
+        self.bitmaps = bitmaps
+        self.column = column
+
+    @classmethod
+    def build(cls, column):
+        codes = column.codes
+        return cls({code: Bitmap.from_mask(codes == code) for code in range(len(column.categories))}, column)
+
+    def rows(self, value):
+        code = self.column.code_of(value)
+        bitmap = self.bitmaps.get(code) if code is not None else None
+        return bitmap if bitmap is not None else Bitmap.empty(len(self.column))
+
+    def upserted(self, column, rows, new_rows):
+        """Index of ``column`` after ``rows`` were replaced and ``new_rows`` appended."""
+        size = len(column)
+        old_codes, codes = self.column.codes[rows], column.codes[rows]
+        changed = old_codes != codes
+        touched = set(np.unique(old_codes[changed]).tolist()) | set(np.unique(codes[changed]).tolist())
+        touched |= set(np.unique(column.codes[new_rows]).tolist())
+        bitmaps = {}
+        for code in range(len(column.categories)):
+            bitmap = self.bitmaps.get(code)
+            if bitmap is None:
+                bitmap = Bitmap.empty(size)
+            elif code in touched or bitmap.size != size:
+                bitmap = bitmap.resized(size)
+            if code in touched:
+                bitmap.set(rows[changed & (old_codes == code)], False)
+                bitmap.set(rows[changed & (codes == code)], True)
+                bitmap.set(new_rows[column.codes[new_rows] == code], True)
+            bitmaps[code] = bitmap
+        return BitmapIndex(bitmaps, column)
+
+
+def _day(value):
+    return (value - EPOCH).days
+
+
+class DirectoryIndexes:
+    """Secondary indexes over one EmployeeStore.
+
+    ``dept`` holds a sorted row array per department, ``join_date`` the rows
+    ordered by join day and ``gender`` a bitmap per value. Lookups return
+    sorted row arrays or Bitmaps that combine with intersect() and union().
+    """
+
+    def __init__(self, dept, join_date, gender, join_days):
+        self.dept = dept
+        self.join_date = join_date
+        self.gender = gender
+        self.join_days = join_days
+        # Department rows in id order, sorted on first use (the store never changes)
+        self._by_id = {}
+
+    @classmethod
+    def build(cls, store):
+        days = store.columns["join_date"].days
+        return cls(ValueIndex.build(store.columns["dept"]), SortedIndex.build(days),
+                   BitmapIndex.build(store.columns["gender"]), days)
+
+    def upserted(self, store, rows):
+        """Indexes of ``store``, produced by EmployeeStore.upsert replacing ``rows`` of the indexed store."""
+        rows = np.asarray(rows, dtype=np.int64)
+        new_rows = np.arange(len(self.gender.column), len(store), dtype=np.int64)
+        days = store.columns["join_date"].days
+        return DirectoryIndexes(self.dept.upserted(store.columns["dept"], rows, new_rows),
+                                self.join_date.upserted(days, rows, new_rows),
+                                self.gender.upserted(store.columns["gender"], rows, new_rows), days)
+
+    def departments(self, *names):
+        """Rows of employees in any of these departments."""
+        return union(*(self.dept.rows(name) for name in names))
+
+    def department_by_id(self, name, ids):
+        """Rows of a department's employees ordered by id, and their ids (``ids`` is the store's id column)."""
+        entry = self._by_id.get(name)
+        if entry is None:
+            rows = self.dept.rows(name)
+            keys = ids[rows]
+            # Files are usually sorted by id already
+            if len(keys) > 1 and not (keys[1:] > keys[:-1]).all():
+                order = np.argsort(keys, kind="stable")
+                rows, keys = rows[order], keys[order]
+            entry = self._by_id[name] = (rows, keys)
+        return entry
+
+    def within_departments(self, rows, names):
+        """The given rows that belong to any of these departments."""
+        column = self.dept.column
+        codes = [code for code in (column.code_of(name) for name in names) if code is not None]
+        return rows[np.isin(column.codes[rows], codes)]
+
+    def joined_between(self, first=None, last=None):
+        """Rows of employees who joined between two dates (inclusive; None is open-ended)."""
+        low = MISSING_DAY + 1 if first is None else _day(first)
+        return self.join_date.range(low, None if last is None else _day(last))
+
+    def lookup(self, filters):
+        """Split (field, op, value) filters into index lookups and the rest.
+
+        All join_date bounds are folded into one range lookup.
+
+        Returns:
+            list: Sorted row arrays, KeyRanges and Bitmaps to intersect
+            list: Filters no index serves
+        """
+        operands, residual = [], []
+        low, high = MISSING_DAY + 1, None
+        for field, op, value in filters:
+            if field in ("dept", "gender") and op == "==":
+                operands.append((self.dept if field == "dept" else self.gender).rows(value))
+            elif field == "join_date" and op in ("==", ">", ">=", "<", "<="):
+                day = _day(value)
+                if op in ("==", ">", ">="):
+                    low = max(low, day + 1 if op == ">" else day)
+                if op in ("==", "<", "<="):
+                    high = min(high if high is not None else day, day - 1 if op == "<" else day)
+            else:
+                residual.append((field, op, value))
+        if low != MISSING_DAY + 1 or high is not None:
+            operands.append(KeyRange(self.join_date, self.join_days, low, high) if high is None or low <= high
+                            else _EMPTY)
+        return operands, residual
@@ -0,0 +1,158 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Batching configuration (overridable through environment variables)
+MAX_BATCH_PAIRS = int(os.getenv("INFERENCE_MAX_BATCH_PAIRS", "64"))
+BUCKET_WIDTH = int(os.getenv("INFERENCE_BUCKET_WIDTH", "16"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "0"))
+# Longest a caller waits for its batched results before giving up
+RESULT_TIMEOUT = float(os.getenv("INFERENCE_BATCH_TIMEOUT", "60"))
+
+
+class BatchingClassifier:
+    """Zero-shot pipeline wrapper that batches concurrent calls by length.
+
+    Calls from concurrent request threads are queued; a single inference
+    thread drains the queue, groups sequences sharing the same labels and
+    hypothesis template, sorts them by token length and runs each length
+    bucket as one pipeline batch, so padding only happens within a bucket.
+    Nothing waits for a batch to fill: requests that arrive while the model
+    is busy simply form the next batch (optionally wait MAX_WAIT_MS for more).
+
+    A failing group only fails its own callers; the inference thread keeps
+    serving, and callers give up after RESULT_TIMEOUT seconds.
+
+    Instances are called exactly like the transformers zero-shot pipeline.
+    """
+
+    def __init__(self, pipeline, max_batch_pairs=MAX_BATCH_PAIRS, bucket_width=BUCKET_WIDTH,
+                 max_wait_ms=MAX_WAIT_MS, result_timeout=RESULT_TIMEOUT):
+        self.pipeline = pipeline
+        self.tokenizer = pipeline.tokenizer
+        self.max_batch_pairs = max_batch_pairs
+        self.bucket_width = bucket_width
+        self.max_wait = max_wait_ms / 1000.0
+        self.result_timeout = result_timeout
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.stats = {"batches": 0, "sequences": 0, "pairs": 0, "tokens": 0, "busy_seconds": 0.0}
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+
+    def __call__(self, sequences, candidate_labels, hypothesis_template=None, multi_label=False):
+        single = isinstance(sequences, str)
+        key = (tuple(candidate_labels), hypothesis_template, multi_label)
+        futures = []
+        for sequence in ([sequences] if single else sequences):
+            future = Future()
+            self._queue.put((key, sequence, future))
+            futures.append(future)
+        deadline = time.monotonic() + self.result_timeout
+        try:
+            results = [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+        except FutureTimeoutError:
+            # Sequences the inference thread has not picked up yet are dropped
+            for future in futures:
+                future.cancel()
+            raise TimeoutError(f"Batched inference did not answer within {self.result_timeout}s")
+        return results[0] if single else results
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def tokens_per_second(self):
+        with self._stats_lock:
+            busy = self.stats["busy_seconds"]
+            return self.stats["tokens"] / busy if busy else 0.0
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            if self.max_wait:
+                deadline = time.monotonic() + self.max_wait
+                while len(items) < self.max_batch_pairs:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        items.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            # Everything that queued up while the model was busy joins this round
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            groups = defaultdict(list)
+            for key, sequence, future in items:
+                # Callers that timed out have cancelled their futures
+                if future.set_running_or_notify_cancel():
+                    groups[key].append((sequence, future))
+            for key, group in groups.items():
+                try:
+                    self._run_group(key, group)
+                except Exception as e:
+                    logger.error("Batched inference failed: %s", e)
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _run_group(self, key, group):
+        labels, template, multi_label = key
+        lengths = [len(ids) for ids in self.tokenizer([s for s, _ in group], add_special_tokens=False)["input_ids"]]
+        ordered = sorted(zip(lengths, group), key=lambda item: item[0])
+
+        # Cut the length-sorted sequences into buckets of similar length and bounded pair count
+        per_batch = max(1, self.max_batch_pairs // max(1, len(labels)))
+        bucket = []
+        for length, item in ordered:
+            if bucket and (length // self.bucket_width != bucket[0][0] // self.bucket_width or len(bucket) >= per_batch):
+                self._run_bucket(labels, template, multi_label, bucket)
+                bucket = []
+            bucket.append((length, item))
+        if bucket:
+            self._run_bucket(labels, template, multi_label, bucket)
+
+    def _run_bucket(self, labels, template, multi_label, bucket):
+        sequences = [sequence for _, (sequence, _) in bucket]
+        kwargs = {"candidate_labels": list(labels), "multi_label": multi_label, "batch_size": len(sequences) * len(labels)}
+        if template:
+            kwargs["hypothesis_template"] = template
+
+        start = time.perf_counter()
+        try:
+            results = self.pipeline(sequences, **kwargs)
+            if isinstance(results, dict):
+                results = [results]
+            if len(results) != len(sequences):
+                raise RuntimeError(f"Pipeline returned {len(results)} results for {len(sequences)} sequences")
+        except Exception as e:
+            logger.error("Batched inference failed: %s", e)
+            for _, (_, future) in bucket:
+                future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - start
+
+        for (_, (_, future)), result in zip(bucket, results):
+            future.set_result(result)
+        metrics.BATCH_SIZE.observe(len(sequences))
+
+        with self._stats_lock:
+            self.stats["batches"] += 1
+            self.stats["sequences"] += len(sequences)
+            self.stats["pairs"] += len(sequences) * len(labels)
+            self.stats["tokens"] += sum(length for length, _ in bucket) * len(labels)
+            self.stats["busy_seconds"] += elapsed
@@ -0,0 +1,354 @@
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration (overridable through environment variables)
+DEFAULT_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+DEFAULT_CACHE_SIZE = int(os.getenv("INFERENCE_CACHE_SIZE", "1024"))
+DEFAULT_HEALTH_INTERVAL = float(os.getenv("INFERENCE_HEALTH_INTERVAL", "5"))
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("INFERENCE_REQUEST_TIMEOUT", "60"))
+# Requests each worker serves concurrently, so its batcher can coalesce them
+WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS", "4"))
+VIRTUAL_NODES = 64
+
+
+class WorkerUnavailable(RuntimeError):
+    """Raised when a request cannot be served because its worker went away."""
+
+
+def normalize_query(query):
+    """Normalize query text for routing and cache lookups."""
+    return " ".join(query.lower().split())
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping query keys to worker ids.
+
+    Each worker is placed on the ring at several virtual points so that
+    removing a worker only moves the keys it owned to its neighbours.
+    """
+
+    def __init__(self, replicas=VIRTUAL_NODES):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        self._nodes = set()
+
+    def add(self, node):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node):
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        self._points = [p for p in self._points if self._owners[p] != node]
+        self._owners = {p: n for p, n in self._owners.items() if n != node}
+
+    def get(self, key):
+        """Return the node owning ``key`` or None if the ring is empty."""
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[idx]]
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+def _worker_main(worker_id, num_workers, requests, responses, cache_size):
+    """Entry point of an inference worker process.
+
+    Loads its own classifier, then answers classification requests from its
+    queue on a few threads, memoizing results per normalized query in a
+    bounded LRU cache.
+    """
+    try:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_workers))
+    except ImportError:
+        pass
+
+    from concurrent.futures import ThreadPoolExecutor
+    import main_model
+
+    classifier = main_model.load_classifier()
+    cache = OrderedDict()
+    cache_lock = threading.Lock()
+    responses.put((None, "ready", worker_id))
+
+    def handle(request_id, query, traced):
+        key = normalize_query(query)
+        with cache_lock:
+            cached = cache.get(key)
+            if cached is not None:
+                cache.move_to_end(key)
+        if cached is not None:
+            responses.put((request_id, "ok", (cached, True, [], None)))
+            return
+
+        try:
+            # Stage timings (and the request trace, if asked for) are shipped
+            # back so the API process can export them
+            with metrics.collect() as entries:
+                if traced:
+                    with metrics.trace_request() as trace:
+                        is_related, label, confidence, scores = main_model.is_corporate_related(query, classifier)
+                    trace_data = trace.export()
+                else:
+                    is_related, label, confidence, scores = main_model.is_corporate_related(query, classifier)
+                    trace_data = None
+            result = (bool(is_related), label, float(confidence), {k: float(v) for k, v in scores.items()})
+        except Exception as e:
+            responses.put((request_id, "error", str(e)))
+            return
+
+        with cache_lock:
+            cache[key] = result
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+        responses.put((request_id, "ok", (result, False, entries, trace_data)))
+
+    with ThreadPoolExecutor(max_workers=WORKER_THREADS) as executor:
+        while True:
+            item = requests.get()
+            if item is None:
+                break
+            request_id, kind, payload = item
+            if kind == "ping":
+                responses.put((request_id, "ok", worker_id))
+                continue
+            executor.submit(handle, request_id, *payload)
+
+
+class _Worker:
+    def __init__(self, worker_id, process, requests):
+        self.worker_id = worker_id
+        self.process = process
+        self.requests = requests
+        self.ready = False
+        self.pending = set()
+        self.last_seen = time.monotonic()
+
+
+class InferencePool:
+    """Router over a pool of local inference worker processes.
+
+    Queries are routed by consistent-hashing their normalized text, so
+    repeated queries land on the worker that already has them cached.
+    A health thread respawns dead or unresponsive workers; while a worker
+    is down its keys are served by the next worker on the ring.
+    """
+
+    def __init__(self, num_workers=None, cache_size=DEFAULT_CACHE_SIZE,
+                 health_interval=DEFAULT_HEALTH_INTERVAL, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        self.num_workers = num_workers or DEFAULT_WORKERS or (os.cpu_count() or 1)
+        self.cache_size = cache_size
+        self.health_interval = health_interval
+        self.request_timeout = request_timeout
+
+        self._ctx = mp.get_context("spawn")
+        self._responses = None
+        self._workers = {}
+        self._ring = HashRing()
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+        self.stats = {"requests": 0, "cache_hits": 0, "respawns": 0}
+
+    # -- lifecycle -----------------------------------------------------
+
+    def start(self):
+        """Spawn the workers and the listener and health threads."""
+        self._responses = self._ctx.Queue()
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+
+        for target in (self._listen, self._health_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Started inference pool with %s workers", self.num_workers)
+
+    def stop(self):
+        """Stop all workers and background threads."""
+        self._stopping.set()
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            try:
+                worker.requests.put(None)
+            except Exception:
+                pass
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._responses.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def wait_ready(self, timeout=None):
+        """Block until at least one worker has loaded its model."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    @property
+    def ready(self):
+        return len(self._ring) > 0
+
+    @property
+    def in_flight(self):
+        return len(self._futures)
+
+    def _spawn(self, worker_id):
+        requests = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.num_workers, requests, self._responses, self.cache_size),
+            name=f"inference-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        with self._lock:
+            self._workers[worker_id] = _Worker(worker_id, process, requests)
+
+    # -- request path --------------------------------------------------
+
+    def classify(self, query):
+        """Classify a query on the worker that owns it.
+
+        Returns the same tuple as ``main_model.is_corporate_related``.
+        If the owning worker dies mid-request the query is re-routed once.
+        """
+        key = normalize_query(query)
+        for attempt in range(2):
+            with self._lock:
+                worker_id = self._ring.get(key)
+            if worker_id is None:
+                raise WorkerUnavailable("No inference workers available")
+            try:
+                future = self._submit(worker_id, "classify", (query, metrics.tracing()))
+                result, cache_hit, entries, trace_data = future.result(timeout=self.request_timeout)
+            except WorkerUnavailable:
+                logger.warning("Worker %s went away, re-routing query (attempt %s)", worker_id, attempt + 1)
+                continue
+            except FutureTimeoutError:
+                raise WorkerUnavailable(f"Worker {worker_id} timed out after {self.request_timeout}s")
+            self.stats["requests"] += 1
+            if cache_hit:
+                self.stats["cache_hits"] += 1
+            metrics.CACHE_REQUESTS.inc("inference_pool", "hit" if cache_hit else "miss")
+            metrics.replay(entries)
+            metrics.merge_trace(trace_data)
+            if cache_hit:
+                metrics.trace_count("cache_hits")
+                metrics.trace_rule("inference_cache")
+            return result
+        raise WorkerUnavailable("Inference workers unavailable after retry")
+
+    def _submit(self, worker_id, kind, payload):
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                raise WorkerUnavailable(f"Worker {worker_id} is not running")
+            self._futures[request_id] = (worker_id, future)
+            worker.pending.add(request_id)
+        worker.requests.put((request_id, kind, payload))
+        return future
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            item = self._responses.get()
+            if item is None:
+                break
+            request_id, status, payload = item
+
+            if status == "ready":
+                with self._lock:
+                    worker = self._workers.get(payload)
+                    if worker is not None:
+                        worker.ready = True
+                        worker.last_seen = time.monotonic()
+                        self._ring.add(payload)
+                logger.info("Inference worker %s is ready", payload)
+                continue
+
+            with self._lock:
+                worker_id, future = self._futures.pop(request_id, (None, None))
+                worker = self._workers.get(worker_id)
+                if worker is not None:
+                    worker.pending.discard(request_id)
+                    worker.last_seen = time.monotonic()
+            if future is None:
+                continue
+            if status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    # -- health checking -----------------------------------------------
+
+    def _health_loop(self):
+        while not self._stopping.wait(self.health_interval):
+            with self._lock:
+                workers = list(self._workers.values())
+            for worker in workers:
+                if not worker.process.is_alive():
+                    logger.error("Inference worker %s died (exit code %s)", worker.worker_id, worker.process.exitcode)
+                    self._replace(worker)
+                elif worker.ready and worker.pending and \
+                        time.monotonic() - worker.last_seen > self.request_timeout:
+                    logger.error("Inference worker %s is unresponsive, restarting", worker.worker_id)
+                    worker.process.terminate()
+                    self._replace(worker)
+                elif worker.ready and not worker.pending:
+                    # Idle workers are pinged so last_seen stays meaningful
+                    try:
+                        self._submit(worker.worker_id, "ping", None)
+                    except WorkerUnavailable:
+                        pass
+
+    def _replace(self, worker):
+        """Drop a failed worker from the ring, fail its requests and respawn it."""
+        with self._lock:
+            self._ring.remove(worker.worker_id)
+            self._workers.pop(worker.worker_id, None)
+            orphaned = [self._futures.pop(rid, (None, None))[1] for rid in worker.pending]
+        for future in orphaned:
+            if future is not None and not future.done():
+                future.set_exception(WorkerUnavailable(f"Worker {worker.worker_id} died"))
+        if not self._stopping.is_set():
+            self.stats["respawns"] += 1
+            self._spawn(worker.worker_id)
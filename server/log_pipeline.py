@@ -0,0 +1,116 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+import metrics
+
+# Logging configuration (overridable through environment variables)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Keep one in every N DEBUG records; the rest are dropped before they are queued
+LOG_DEBUG_SAMPLE_EVERY = int(os.getenv("LOG_DEBUG_SAMPLE_EVERY", "100"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with ``extra`` fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """Pass every record at INFO and above but only one in ``every`` DEBUG records."""
+
+    def __init__(self, every=LOG_DEBUG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        # itertools.count is atomic under the GIL, so no lock is needed
+        if next(self._counter) % self.every == 0:
+            return True
+        metrics.LOG_RECORDS_DISCARDED.inc("sampled")
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks the logging thread.
+
+    Records are handed to the listener thread unformatted, so the message
+    is only built (``msg % args``) if the record is actually written. When
+    the bounded queue is full the record is dropped and counted.
+    """
+
+    def prepare(self, record):
+        # Same-process queue: no need to pre-format or strip args for pickling
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DISCARDED.inc("queue_full")
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE):
+    """Route all logging through a bounded queue to a background writer thread.
+
+    Safe to call more than once; only the first call configures logging.
+
+    Returns:
+        QueueListener: The listener writing records to stdout
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(DebugSampler())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+def queue_depth():
+    """Number of records waiting to be written, or None before setup_logging."""
+    return _listener.queue.qsize() if _listener is not None else None
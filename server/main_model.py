@@ -1,18 +1,42 @@
 from transformers import pipeline
 import logging
-import sys
+import os
 import re
 import pandas as pd
 from datetime import datetime
+import audit_log
+import directory
+import log_pipeline
+import metrics
+import query_engine
+import tenants
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-                   handlers=[logging.StreamHandler(sys.stdout)])
+# Configure logging (JSON records written by a background thread, see log_pipeline)
+log_pipeline.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Global classifier
 classifier = None
 
+# Optional pool of inference worker processes; when set, classification is
+# routed to the workers instead of the in-process classifier
+inference_pool = None
+
+# Optional audit log writer recording every process_user_query decision
+audit_writer = None
+
+# Optional store of violations recorded at runtime, added to past_violations
+violation_store = None
+
+# Optional per-user rate limiter and abuse detector
+rate_limiter = None
+
+# Optional per-user session context reused by follow-up questions
+session_cache = None
+
+# Optional distilled student classifier; confident student answers skip the teacher model
+student = None
+
 # Department list based on the unique departments in the dataset
 DEPARTMENTS = [
     "Human Resources", "Engineering", "Sales", "Marketing", "Accounting"
@@ -44,17 +68,209 @@ DEPARTMENT_MAPPING = {
     "bookkeeping": "Accounting"
 }
 
-def load_classifier(model_name="facebook/bart-large-mnli"):
-    """Load the zero-shot classification model."""
+# Authorization policy applied by check_authorization. policy_simulator.py
+# replays historical requests under a modified copy to preview its effect.
+AUTHORIZATION_POLICY = {
+    # Format: employee_id: [departments_with_access]
+    "special_roles": {
+        10: ["Human Resources", "Engineering", "Sales", "Marketing"],  # HR admin with access to multiple departments
+        16: ["Human Resources", "Accounting"],  # HR lead with finance access
+        13: ["Accounting", "Sales", "Marketing"],  # Finance director
+    },
+    # Special roles covering at least this many departments may run cross-departmental queries
+    "special_role_cross_dept_min": 3,
+    # Cross-department access rules
+    "cross_dept_access": {
+        "Human Resources": DEPARTMENTS,  # HR can access all departments
+        "Accounting": ["Sales", "Marketing"],  # Finance can access revenue departments
+        "Engineering": [],  # Engineering has limited cross-department access
+    },
+    # (minimum past violations, risk added), first match wins
+    "violation_risk": [(3, 1.0), (2, 0.7), (1, 0.3)],
+    # (tenure below this many months, risk added), first match wins
+    "tenure_risk": [(1, 0.4), (3, 0.2)],
+    "new_employee_months": 3,
+    "high_risk_threshold": 1.0,
+    "cross_dept_risk_threshold": 0.5,
+    # Special roles are restricted from this many violations on
+    "special_role_max_violations": 3,
+    # HR keeps cross-department access below this many violations
+    "hr_cross_dept_max_violations": 5,
+}
+
+# Topic labels scored by the second classification stage
+CORPORATE_LABELS = [
+    "employee data request",
+    "hr question",
+    "corporate policy",
+    "business operations",
+    "performance metrics",
+    "company data",
+    "technical work request",
+    "development inquiry",
+    "engineering question",
+    "project management",
+    "system administration",
+    "software development",
+    "technical documentation",
+    "code repository access",
+    "development standards",
+    "security violation",
+    "data breach attempt",
+    "unauthorized access request",
+    "sensitive information query",
+    "confidential data access",
+    "financial data request",
+    "salary information query",
+    "personal employee information",
+    "system administration query",
+    "database access request"
+]
+
+NON_CORPORATE_LABELS = [
+    "personal question",
+    "entertainment topic",
+    "food and recipes",
+    "general knowledge",
+    "lifestyle question",
+    "inappropriate content",
+    "spam content",
+    "malicious query",
+    "social engineering attempt"
+]
+
+# Topic labels grouped into branches. The topic stage scores the branch
+# hypotheses first and only expands branches whose score clears
+# TOPIC_BRANCH_THRESHOLD. Keyword hints restrict which corporate branches are
+# considered at all; the non-corporate branch is always scored.
+TOPIC_LABEL_TREE = {
+    "security or restricted data access": {
+        "labels": [
+            "security violation",
+            "data breach attempt",
+            "unauthorized access request",
+            "sensitive information query",
+            "confidential data access",
+            "system administration query",
+            "database access request"
+        ],
+        "keywords": ["access", "password", "credential", "confidential", "sensitive", "secret",
+                     "database", "admin", "security", "breach", "permission", "private"]
+    },
+    "software engineering work": {
+        "labels": [
+            "technical work request",
+            "development inquiry",
+            "engineering question",
+            "system administration",
+            "software development",
+            "technical documentation",
+            "code repository access",
+            "development standards"
+        ],
+        "keywords": ["code", "coding", "development", "developer", "backend", "frontend", "programming",
+                     "software", "engineering", "technical", "api", "system", "deployment", "repository",
+                     "git", "github", "docker", "kubernetes", "cloud", "devops", "testing", "debugging",
+                     "architecture", "infrastructure", "platform", "dashboard"]
+    },
+    "human resources and employee data": {
+        "labels": [
+            "employee data request",
+            "hr question",
+            "salary information query",
+            "personal employee information"
+        ],
+        "keywords": ["employee", "employees", "staff", "personnel", "hr", "salary", "salaries", "hire",
+                     "hired", "joined", "join", "benefits", "leave", "training", "certification",
+                     "headcount", "gender", "violations", "people", "team"]
+    },
+    "business operations and finance": {
+        "labels": [
+            "corporate policy",
+            "business operations",
+            "performance metrics",
+            "company data",
+            "project management",
+            "financial data request"
+        ],
+        "keywords": ["company", "corporate", "business", "policy", "policies", "budget", "finance",
+                     "financial", "revenue", "profit", "sales", "marketing", "project", "performance",
+                     "review", "quarter", "organization", "management", "office", "workplace", "department"]
+    },
+    "personal or non-work topic": {
+        "labels": NON_CORPORATE_LABELS,
+        "keywords": []
+    }
+}
+NON_CORPORATE_BRANCH = "personal or non-work topic"
+
+# Length-bucketed batching of concurrent NLI calls and the per-query token budget
+INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "true").lower() == "true"
+MAX_QUERY_TOKENS = int(os.getenv("MAX_QUERY_TOKENS", "128"))
+
+# Tokenizer for the token budget when no local classifier is loaded
+_tokenizer = None
+
+# Early-exit thresholds on the domain stage: confident domain decisions skip the topic stage
+DOMAIN_EARLY_REJECT_THRESHOLD = float(os.getenv("DOMAIN_EARLY_REJECT_THRESHOLD", "0.70"))
+DOMAIN_EARLY_ACCEPT_THRESHOLD = float(os.getenv("DOMAIN_EARLY_ACCEPT_THRESHOLD", "0.95"))
+
+TOPIC_LABEL_TREE_ENABLED = os.getenv("TOPIC_LABEL_TREE", "true").lower() == "true"
+TOPIC_BRANCH_THRESHOLD = float(os.getenv("TOPIC_BRANCH_THRESHOLD", "0.35"))
+
+_BRANCH_KEYWORD_PATTERNS = {
+    branch: re.compile(r'\b(' + '|'.join(re.escape(k) for k in spec["keywords"]) + r')\b')
+    for branch, spec in TOPIC_LABEL_TREE.items() if spec["keywords"]
+}
+
+# Classification engine: "nli" (zero-shot cross-encoder) or "embedding" (bi-encoder)
+CLASSIFIER_ENGINE = os.getenv("CLASSIFIER_ENGINE", "nli")
+
+# Labels and hypothesis templates for the two classification stages
+DOMAIN_LABELS = ["corporate business query", "non-corporate personal query"]
+DOMAIN_HYPOTHESIS_TEMPLATE = "This is a {}"
+TOPIC_HYPOTHESIS_TEMPLATE = "This query is about {}"
+
+def load_classifier(model_name=None, engine=None):
+    """Load the classification engine.
+    
+    Args:
+        model_name (str): Model to load; defaults to the engine's default model
+        engine (str): "nli" for the zero-shot cross-encoder pipeline or "embedding"
+            for the bi-encoder engine; defaults to the CLASSIFIER_ENGINE env variable
+        
+    Returns:
+        A callable with the zero-shot pipeline's calling convention
+    """
+    engine = (engine or CLASSIFIER_ENGINE).lower()
     try:
-        print("Loading classifier model...")
-        return pipeline("zero-shot-classification", model=model_name, framework="pt")
+        print(f"Loading classifier model ({engine} engine)...")
+        if engine == "embedding":
+            from embedding_engine import EmbeddingClassifier
+            embedding_classifier = EmbeddingClassifier(model_name) if model_name else EmbeddingClassifier()
+            # Hypotheses for both stages, including every branch and leaf of
+            # the topic tree, are embedded once, up front
+            embedding_classifier.warm_up([
+                (DOMAIN_LABELS, DOMAIN_HYPOTHESIS_TEMPLATE),
+                (CORPORATE_LABELS + NON_CORPORATE_LABELS, TOPIC_HYPOTHESIS_TEMPLATE),
+                (list(TOPIC_LABEL_TREE), TOPIC_HYPOTHESIS_TEMPLATE),
+                ([label for spec in TOPIC_LABEL_TREE.values() for label in spec["labels"]], TOPIC_HYPOTHESIS_TEMPLATE)
+            ])
+            return embedding_classifier
+        if engine != "nli":
+            raise ValueError(f"Unknown classifier engine: {engine}")
+        nli_pipeline = pipeline("zero-shot-classification", model=model_name or "facebook/bart-large-mnli", framework="pt")
+        if INFERENCE_BATCHING:
+            from inference_batcher import BatchingClassifier
+            return BatchingClassifier(nli_pipeline)
+        return nli_pipeline
     except Exception as e:
-        logger.error(f"Error loading model: {e}")
+        logger.error("Error loading model: %s", e)
         raise
 
 def classify_query(classifier, query, labels, hypothesis_template=None, multi_label=False):
     """Classify a query using zero-shot classification."""
+    metrics.trace_count("nli_pairs", len(labels))
     try:
         if hypothesis_template:
             result = classifier(query, candidate_labels=labels, hypothesis_template=hypothesis_template, multi_label=multi_label)
@@ -62,9 +278,284 @@ def classify_query(classifier, query, labels, hypothesis_template=None, multi_la
             result = classifier(query, candidate_labels=labels, multi_label=multi_label)
         return result
     except Exception as e:
-        logger.error(f"Error during classification: {e}")
+        logger.error("Error during classification: %s", e)
         raise
 
+def model_ready():
+    """Return True once either the local classifier or the inference pool can serve queries."""
+    if inference_pool is not None:
+        return inference_pool.ready
+    return classifier is not None
+
+def get_tokenizer():
+    """Return the tokenizer of the active classification engine."""
+    global _tokenizer
+    if classifier is not None and getattr(classifier, "tokenizer", None) is not None:
+        return classifier.tokenizer
+    if _tokenizer is None:
+        from transformers import AutoTokenizer
+        if CLASSIFIER_ENGINE.lower() == "embedding":
+            from embedding_engine import DEFAULT_EMBEDDING_MODEL as model_name
+        else:
+            model_name = "facebook/bart-large-mnli"
+        _tokenizer = AutoTokenizer.from_pretrained(model_name)
+    return _tokenizer
+
+def apply_token_budget(query, max_tokens=None):
+    """Truncate a query to the per-query token budget before it reaches the model.
+    
+    Args:
+        query (str): The user query
+        max_tokens (int): Token budget; defaults to MAX_QUERY_TOKENS (0 disables)
+        
+    Returns:
+        str: The query, truncated if it exceeded the budget
+        bool: Whether the query was truncated
+    """
+    if max_tokens is None:
+        max_tokens = MAX_QUERY_TOKENS
+    # Every token covers at least one character, so short queries need no tokenization
+    if max_tokens <= 0 or len(query) <= max_tokens:
+        return query, False
+    
+    tokenizer = get_tokenizer()
+    token_ids = tokenizer(query, add_special_tokens=False)["input_ids"]
+    if len(token_ids) <= max_tokens:
+        return query, False
+    
+    logger.info("Query truncated from %s to %s tokens", len(token_ids), max_tokens)
+    return tokenizer.decode(token_ids[:max_tokens], skip_special_tokens=True).strip(), True
+
+def get_inference_stats():
+    """Return batching and throughput counters of the local classifier, if it batches."""
+    if classifier is None or not hasattr(classifier, "tokens_per_second"):
+        return None
+    stats = dict(classifier.stats)
+    stats["tokens_per_second"] = classifier.tokens_per_second()
+    stats["queue_depth"] = classifier.queue_depth
+    return stats
+
+def get_cascade_stats():
+    """Return domain stage counters and the fraction of queries that skipped the topic stage."""
+    stats = {event: metrics.CASCADE_EVENTS.get(event) for event in ("domain_stage", "early_accept", "early_reject")}
+    skipped = stats["early_accept"] + stats["early_reject"]
+    stats["skip_rate"] = skipped / stats["domain_stage"] if stats["domain_stage"] else 0.0
+    return stats
+
+def run_corporate_check(query):
+    """Classify a query through the student/teacher cascade.
+    
+    The keyword gate and the distilled student (if loaded) run first; the
+    teacher is_corporate_related runs on the inference pool if configured,
+    otherwise in-process, only when the student is not confident.
+    """
+    global classifier
+
+    if student is not None:
+        # Keyword and red-flag rejections always come from the gate, never the student
+        with metrics.stage("keyword_gate"):
+            gate_result = keyword_pre_gate(query.strip())
+        if gate_result is not None:
+            return gate_result
+        with metrics.stage("student"):
+            student_result = student.predict(query.strip())
+        if student_result is not None:
+            metrics.cascade_event("student_answer")
+            metrics.trace_rule("student")
+            return student_result
+        metrics.cascade_event("student_defer")
+
+    if inference_pool is not None:
+        return inference_pool.classify(query)
+
+    if classifier is None:
+        classifier = load_classifier()
+    return is_corporate_related(query, classifier)
+
+def keyword_pre_gate(query):
+    """Reject queries that hit non-corporate keywords or security red-flag patterns.
+    
+    This is the cheap first step of is_corporate_related and runs before any model.
+    
+    Args:
+        query (str): The user query
+        
+    Returns:
+        tuple or None: An (is_corporate, label, confidence, scores) rejection, or None
+            if the query passes the gate
+    """
+    match = _keyword_gate_match(query)
+    if match is None:
+        return None
+    category, hit, label = match
+    if category == "security_red_flag":
+        logger.warning("Detected security red flag pattern: %s", hit)
+        metrics.trace_rule("security_red_flag")
+    else:
+        logger.warning("Detected %s keyword '%s' - flagging as inappropriate", category, hit)
+        metrics.trace_rule(f"keyword_gate:{category}")
+    return False, label, 1.0, {label: 1.0}
+
+def _keyword_gate_match(query):
+    """The keyword or red-flag pattern a query hits in the gate.
+    
+    Returns:
+        tuple or None: (category, keyword or pattern, rejection label), or None
+    """
+    # Enhanced check for obviously non-corporate keywords and security threats
+    non_corporate_keywords = {
+        "inappropriate": ["sex", "porn", "nude", "tinder", "girlfriend", "boyfriend", "marry"],
+        "entertainment": ["joke", "movie", "game", "play", "music", "song", "concert", "netflix"],
+        "food": ["pancake", "recipe", "food", "cook", "restaurant", "meal", "dinner", "lunch", "breakfast"],
+        "lifestyle": ["vacation", "hobby", "garden", "pet", "dog", "cat"],
+        "security_threats": ["hack", "crack", "exploit", "bypass", "inject", "malware", "virus", "phishing", "steal", "leak"],
+        "suspicious_requests": ["all passwords", "admin access", "backdoor", "root access", "dump database", "full database", "entire system"]
+    }
+    
+    # Enhanced security pattern detection
+    security_red_flags = [
+        r'\ball\s+(passwords|data)\b',
+        r'\bentire\s+(database|system|company)\b',
+        r'\bdump\s+(data|database|table)\b',
+        r'\bfull\s+(access|dump)\b',
+        r'\bpassword\s+(list|file|database)\b',
+        r'\badmin\s+(credentials|password|access)\b',
+        r'\bunauthorized\s+access\b',
+        r'\bbypass\s+(security|authentication)\b'
+    ]
+    
+    # Broad listings are red flags unless the query names one department
+    # ("List all employees in the Sales department"), whose access
+    # check_authorization then decides like for any other department request
+    broad_listing_flags = [
+        r'\ball\s+(employees|users)\b',
+        r'\bfull\s+list\b',
+        r'\bshow\s+(all|every|entire)\b',
+        r'\bgive\s+me\s+(all|everything|complete)\b'
+    ]
+    
+    # Check for non-corporate keywords and security threats
+    for category, keywords in non_corporate_keywords.items():
+        for keyword in keywords:
+            if re.search(r'\b' + keyword + r'\b', query.lower()):
+                if category == "security_threats" or category == "suspicious_requests":
+                    return category, keyword, "security violation"
+                else:
+                    return category, keyword, f"{category} question"
+    
+    # Check for security red flag patterns
+    for pattern in security_red_flags:
+        if re.search(pattern, query.lower()):
+            return "security_red_flag", pattern, "security violation"
+    for pattern in broad_listing_flags:
+        if re.search(pattern, query.lower()) and extract_requested_department(query) in (None, "ALL_DEPARTMENTS"):
+            return "security_red_flag", pattern, "security violation"
+    
+    return None
+
+def _over_broad_score(query):
+    """Security score of a query from its broad quantifiers and department scope."""
+    security_score = 0
+    
+    # Count suspicious words that might indicate over-broad requests
+    suspicious_quantifiers = ["all", "every", "entire", "complete", "full", "total"]
+    suspicious_count = sum(1 for word in suspicious_quantifiers if word in query.lower())
+    
+    # Reduce legitimacy if too many suspicious quantifiers
+    if suspicious_count >= 2:
+        security_score += 0.3
+    
+    # Check for overly broad department requests
+    if "all departments" in query.lower() or "every department" in query.lower():
+        security_score += 0.4
+    
+    return security_score
+
+def security_rule(query):
+    """The rule rejecting a query as a security violation before any label is scored.
+    
+    The keyword gate and the over-broad request rule match wording, not
+    intent, and also fire on harmless requests ("Show all employees"),
+    so their rejections do not count as violations.
+    
+    Returns:
+        str or None: "keyword_gate:<category>", "security_red_flag" or
+            "over_broad_request", or None if a model labelled the query
+    """
+    match = _keyword_gate_match(query.strip())
+    if match is not None:
+        category, _, label = match
+        if label != "security violation":
+            return None
+        return category if category == "security_red_flag" else f"keyword_gate:{category}"
+    if _over_broad_score(query) >= 0.5:
+        return "over_broad_request"
+    return None
+
+def score_topic_labels(query, classifier, branch_threshold=None):
+    """Score topic labels by walking TOPIC_LABEL_TREE instead of scoring every label.
+    
+    Branches are pruned twice: corporate branches without a keyword hint are
+    dropped before any scoring (unless no branch has a hint), and branches whose
+    hypothesis scores below the threshold are not expanded. Leaves of a scored
+    but unexpanded branch take the branch score as a stand-in for their own,
+    so the result has the same shape as a flat multi-label classification.
+    It is only an estimate: zero-shot scores of a branch and of its leaves are
+    independent, and a leaf can score above or below its branch.
+    
+    Args:
+        query (str): The user query
+        classifier: The zero-shot classifier
+        branch_threshold (float): Minimum branch score for expansion
+        
+    Returns:
+        dict: 'labels' and 'scores' sorted by descending score, plus 'pairs_scored'
+    """
+    if branch_threshold is None:
+        branch_threshold = TOPIC_BRANCH_THRESHOLD
+    query_lower = query.lower()
+    
+    hinted = [branch for branch, pattern in _BRANCH_KEYWORD_PATTERNS.items() if pattern.search(query_lower)]
+    candidates = hinted + [NON_CORPORATE_BRANCH] if hinted else list(TOPIC_LABEL_TREE)
+    
+    branch_result = classify_query(
+        classifier,
+        query,
+        candidates,
+        hypothesis_template=TOPIC_HYPOTHESIS_TEMPLATE,
+        multi_label=True
+    )
+    branch_scores = dict(zip(branch_result['labels'], branch_result['scores']))
+    
+    # Always expand the best branch so there is at least one scored leaf
+    expanded = [b for b in candidates if branch_scores[b] >= branch_threshold]
+    if not expanded:
+        expanded = [branch_result['labels'][0]]
+    
+    expanded_labels = [label for branch in expanded for label in TOPIC_LABEL_TREE[branch]["labels"]]
+    leaf_result = classify_query(
+        classifier,
+        query,
+        expanded_labels,
+        hypothesis_template=TOPIC_HYPOTHESIS_TEMPLATE,
+        multi_label=True
+    )
+    scores = dict(zip(leaf_result['labels'], leaf_result['scores']))
+    for branch in candidates:
+        if branch not in expanded:
+            # Unscored leaves estimated from their branch score
+            for label in TOPIC_LABEL_TREE[branch]["labels"]:
+                scores[label] = branch_scores[branch]
+    
+    logger.debug("Topic tree: hinted=%s, expanded=%s, pairs=%s", hinted, expanded, len(candidates) + len(expanded_labels))
+    
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "labels": [label for label, _ in ranked],
+        "scores": [score for _, score in ranked],
+        "pairs_scored": len(candidates) + len(expanded_labels)
+    }
+
 def is_corporate_related(query, classifier, confidence_threshold=0.45):
     """Determine if the query is related to corporate or employee data using multiple checks."""
     try:
@@ -72,114 +563,69 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
         query = query.strip()
         
         # Define broader more specific categories with enhanced security detection
-        corporate_labels = [
-            "employee data request", 
-            "hr question", 
-            "corporate policy",
-            "business operations",
-            "performance metrics",
-            "company data",
-            "technical work request",
-            "development inquiry",
-            "engineering question",
-            "project management",
-            "system administration",
-            "software development",
-            "technical documentation",
-            "code repository access",
-            "development standards",
-            "security violation",
-            "data breach attempt",
-            "unauthorized access request",
-            "sensitive information query",
-            "confidential data access",
-            "financial data request",
-            "salary information query",
-            "personal employee information",
-            "system administration query",
-            "database access request"
-        ]
-        
-        non_corporate_labels = [
-            "personal question",
-            "entertainment topic",
-            "food and recipes",
-            "general knowledge",
-            "lifestyle question",
-            "inappropriate content",
-            "spam content",
-            "malicious query",
-            "social engineering attempt"
-        ]
+        corporate_labels = CORPORATE_LABELS
+        non_corporate_labels = NON_CORPORATE_LABELS
         
         # Combined labels for classification
         all_labels = corporate_labels + non_corporate_labels
         
-        # Enhanced check for obviously non-corporate keywords and security threats
-        non_corporate_keywords = {
-            "inappropriate": ["sex", "porn", "nude", "tinder", "girlfriend", "boyfriend", "marry"],
-            "entertainment": ["joke", "movie", "game", "play", "music", "song", "concert", "netflix"],
-            "food": ["pancake", "recipe", "food", "cook", "restaurant", "meal", "dinner", "lunch", "breakfast"],
-            "lifestyle": ["vacation", "hobby", "garden", "pet", "dog", "cat"],
-            "security_threats": ["hack", "crack", "exploit", "bypass", "inject", "malware", "virus", "phishing", "steal", "leak"],
-            "suspicious_requests": ["all passwords", "admin access", "backdoor", "root access", "dump database", "full database", "entire system"]
-        }
-        
-        # Enhanced security pattern detection
-        security_red_flags = [
-            r'\ball\s+(employees|users|passwords|data)\b',
-            r'\bentire\s+(database|system|company)\b',
-            r'\bdump\s+(data|database|table)\b',
-            r'\bfull\s+(access|list|dump)\b',
-            r'\bshow\s+(all|every|entire)\b',
-            r'\bgive\s+me\s+(all|everything|complete)\b',
-            r'\bpassword\s+(list|file|database)\b',
-            r'\badmin\s+(credentials|password|access)\b',
-            r'\bunauthorized\s+access\b',
-            r'\bbypass\s+(security|authentication)\b'
-        ]
-        
-        # Check for non-corporate keywords and security threats
-        for category, keywords in non_corporate_keywords.items():
-            for keyword in keywords:
-                if re.search(r'\b' + keyword + r'\b', query.lower()):
-                    logger.warning(f"Detected {category} keyword '{keyword}' - flagging as inappropriate")
-                    if category == "security_threats" or category == "suspicious_requests":
-                        return False, "security violation", 1.0, {"security violation": 1.0}
-                    else:
-                        return False, f"{category} question", 1.0, {f"{category} question": 1.0}
-        
-        # Check for security red flag patterns
-        for pattern in security_red_flags:
-            if re.search(pattern, query.lower()):
-                logger.warning(f"Detected security red flag pattern: {pattern}")
-                return False, "security violation", 1.0, {"security violation": 1.0}
+        # Reject on non-corporate keywords and security red flags before any model runs
+        with metrics.stage("keyword_gate"):
+            gate_result = keyword_pre_gate(query)
+        if gate_result is not None:
+            return gate_result
         
         # First classification: corporate vs non-corporate
-        domain_result = classify_query(
-            classifier,
-            query,
-            ["corporate business query", "non-corporate personal query"],
-            hypothesis_template="This is a {}"
-        )
+        with metrics.stage("domain_nli"):
+            domain_result = classify_query(
+                classifier,
+                query,
+                DOMAIN_LABELS,
+                hypothesis_template=DOMAIN_HYPOTHESIS_TEMPLATE
+            )
         
         # Extract domain classification results
         domain_label = domain_result['labels'][0]
         domain_score = domain_result['scores'][0]
         
+        metrics.cascade_event("domain_stage")
+        
         # If high confidence that it's non-corporate, reject immediately
-        if domain_label == "non-corporate personal query" and domain_score >= 0.70:
-            logger.info(f"Rejected query as non-corporate with confidence {domain_score:.2f}")
+        if domain_label == "non-corporate personal query" and domain_score >= DOMAIN_EARLY_REJECT_THRESHOLD:
+            metrics.cascade_event("early_reject")
+            metrics.trace_rule("domain_early_reject")
+            logger.info("Rejected query as non-corporate with confidence %.2f", domain_score)
             return False, "non-corporate query", domain_score, {"non-corporate query": domain_score}
         
+        # Enhanced security scoring
+        security_score = _over_broad_score(query)
+        
+        # If security score is too high, flag as security violation
+        if security_score >= 0.5:
+            logger.warning("High security score detected: %s", security_score)
+            metrics.trace_rule("over_broad_request")
+            return False, "security violation", security_score, {"security violation": security_score}
+        
+        # If high confidence that it's corporate, accept without running the topic stage
+        if domain_label == "corporate business query" and domain_score >= DOMAIN_EARLY_ACCEPT_THRESHOLD:
+            metrics.cascade_event("early_accept")
+            metrics.trace_rule("domain_early_accept")
+            logger.info("Accepted query as corporate with confidence %.2f (topic stage skipped)", domain_score)
+            return True, "business operations", domain_score, {"business operations": domain_score}
+        
         # Second classification: specific topic
-        result = classify_query(
-            classifier, 
-            query, 
-            all_labels, 
-            hypothesis_template="This query is about {}",
-            multi_label=True
-        )
+        with metrics.stage("topic_nli"):
+            if TOPIC_LABEL_TREE_ENABLED:
+                # Only branches that look relevant are expanded into their labels
+                result = score_topic_labels(query, classifier)
+            else:
+                result = classify_query(
+                    classifier, 
+                    query, 
+                    all_labels, 
+                    hypothesis_template=TOPIC_HYPOTHESIS_TEMPLATE,
+                    multi_label=True
+                )
         
         # Get all scores
         scores = {label: score for label, score in zip(result['labels'], result['scores'])}
@@ -241,23 +687,6 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
         # Check for legitimate request patterns
         has_legitimate_patterns = any(re.search(pattern, query.lower()) for pattern in legitimate_patterns)
         
-        # Enhanced security scoring
-        security_score = 0
-        
-        # Count suspicious words that might indicate over-broad requests
-        suspicious_quantifiers = ["all", "every", "entire", "complete", "full", "total"]
-        suspicious_count = sum(1 for word in suspicious_quantifiers if word in query.lower())
-        
-        # Reduce legitimacy if too many suspicious quantifiers
-        if suspicious_count >= 2:
-            security_score += 0.3
-            logger.warning(f"Multiple suspicious quantifiers detected: {suspicious_count}")
-        
-        # Check for overly broad department requests
-        if "all departments" in query.lower() or "every department" in query.lower():
-            security_score += 0.4
-            logger.warning("Overly broad department request detected")
-        
         # Get highest scores for corporate and non-corporate categories
         highest_corporate_score = max([scores.get(label, 0) for label in corporate_labels])
         highest_non_corporate_score = max([scores.get(label, 0) for label in non_corporate_labels])
@@ -268,11 +697,7 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
         
         # Enhanced decision logic with security scoring
         is_corporate = False
-        
-        # If security score is too high, flag as security violation
-        if security_score >= 0.5:
-            logger.warning(f"High security score detected: {security_score}")
-            return False, "security violation", security_score, {"security violation": security_score}
+        rule = "no_corporate_rule"
         
         # Case 1: Strong corporate keyword presence with reasonable score and legitimate patterns
         if has_corporate_keywords and highest_corporate_score >= 0.35:
@@ -291,6 +716,7 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
                     adjusted_confidence = highest_corporate_score
             
             if is_corporate:
+                rule = "corporate_keywords"
                 # Find the actual highest corporate label
                 for label in corporate_labels:
                     if scores.get(label, 0) == highest_corporate_score:
@@ -301,6 +727,7 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
         # Case 2: Corporate score significantly higher than non-corporate
         elif highest_corporate_score > highest_non_corporate_score + 0.15:
             is_corporate = True
+            rule = "corporate_margin"
             # Find the actual highest corporate label
             for label in corporate_labels:
                 if scores.get(label, 0) == highest_corporate_score:
@@ -311,10 +738,12 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
         # Case 3: Standard threshold for corporate labels
         elif predicted_label in corporate_labels and confidence >= confidence_threshold:
             is_corporate = True
+            rule = "corporate_label_threshold"
         
         # Additional check: if domain classification is strongly corporate, give benefit of doubt
         if not is_corporate and domain_label == "corporate business query" and domain_score >= 0.80:
             is_corporate = True
+            rule = "domain_fallback"
             predicted_label = "business operations"  # Default to a general business category
             confidence = domain_score
         
@@ -325,8 +754,9 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
             has_dev_keywords = any(keyword in query.lower() for keyword in dev_keywords)
             
             if has_dev_keywords and highest_corporate_score >= 0.20:  # Even lower threshold for dev queries
-                logger.info(f"Development query detected with corporate keywords - overriding classification")
+                logger.info("Development query detected with corporate keywords - overriding classification")
                 is_corporate = True
+                rule = "development_override"
                 predicted_label = "technical work request"
                 confidence = max(0.65, highest_corporate_score)  # Minimum confidence for dev queries
         
@@ -340,26 +770,29 @@ def is_corporate_related(query, classifier, confidence_threshold=0.45):
             
             for pattern in show_patterns:
                 if re.search(pattern, query.lower()):
-                    logger.info(f"Engineering display request detected: '{query}' - overriding classification")
+                    logger.info("Engineering display request detected: '%s' - overriding classification", query)
                     is_corporate = True
+                    rule = "engineering_display_override"
                     predicted_label = "engineering question"
                     confidence = 0.70
                     break
         
-        logger.info(f"Classification result: corporate={is_corporate}, label={predicted_label}, confidence={confidence:.2f}")
-        logger.debug(f"All scores: {scores}")
+        logger.info("Classification result: corporate=%s, label=%s, confidence=%.2f", is_corporate, predicted_label, confidence)
+        logger.debug("All scores: %s", scores)
+        metrics.trace_rule(rule)
         
         return is_corporate, predicted_label, confidence, scores
     
     except Exception as e:
-        logger.error(f"Error in corporate relevance check: {e}")
+        logger.error("Error in corporate relevance check: %s", e)
         raise
 
-def analyze_query_security_risk(query):
+def analyze_query_security_risk(query, abuse=None):
     """Analyze the security risk level of a query based on various factors.
     
     Args:
         query (str): The user query to analyze
+        abuse (dict): Recent rejected/high-risk query counts of the user when they indicate probing
         
     Returns:
         float: Security risk score (0.0 = low risk, 1.0 = high risk)
@@ -404,6 +837,12 @@ def analyze_query_security_risk(query):
         risk_score += 0.15
         risk_details["pressure_language"] = f"Pressure words: {pressure_count}"
     
+    # 6. Escalate users whose recent requests look like probing
+    if abuse:
+        risk_score += 0.4
+        risk_details["repeated_violations"] = (f"{abuse['rejected']} rejected and {abuse['high_risk']} high-risk queries "
+                                               f"in the last {abuse['window_seconds']:.0f}s")
+    
     return min(1.0, risk_score), risk_details
 
 def extract_requested_department(query):
@@ -434,7 +873,7 @@ def extract_requested_department(query):
             
             for pattern in patterns:
                 if re.search(pattern, query):
-                    logger.info(f"Found department mention: {standard_name} (matched: {dept_variant})")
+                    logger.debug("Found department mention: %s (matched: %s)", standard_name, dept_variant)
                     return standard_name
         
         # Check for cross-departmental queries first
@@ -467,13 +906,13 @@ def extract_requested_department(query):
         # Check if this is a cross-departmental query
         for pattern in cross_dept_patterns:
             if re.search(pattern, query):
-                logger.info(f"Detected cross-departmental query: {pattern}")
+                logger.debug("Detected cross-departmental query: %s", pattern)
                 return "ALL_DEPARTMENTS"  # Special marker for cross-departmental queries
         
         # Check if this is a general employee data request
         for pattern in general_employee_patterns:
             if re.search(pattern, query):
-                logger.info(f"Detected general employee data request: {pattern}")
+                logger.debug("Detected general employee data request: %s", pattern)
                 return "ALL_DEPARTMENTS"  # HR should handle general employee data requests
         
         # Enhanced department indicators with more flexible patterns
@@ -510,12 +949,12 @@ def extract_requested_department(query):
                 try:
                     dept = match.group(group).strip()
                     if dept and len(dept) > 1:  # Ignore single characters
-                        logger.debug(f"Extracted potential department: '{dept}' using pattern: {pattern}")
+                        logger.debug("Extracted potential department: '%s' using pattern: %s", dept, pattern)
                         
                         # Check if this extracted term maps to a known department
                         if dept.lower() in DEPARTMENT_MAPPING:
                             potential_departments.append(DEPARTMENT_MAPPING[dept.lower()])
-                            logger.info(f"Mapped '{dept}' to {DEPARTMENT_MAPPING[dept.lower()]}")
+                            logger.debug("Mapped '%s' to %s", dept, DEPARTMENT_MAPPING[dept.lower()])
                         # Try partial matching for compound terms like "software development"
                         else:
                             for known_dept, standard_name in DEPARTMENT_MAPPING.items():
@@ -523,27 +962,43 @@ def extract_requested_department(query):
                                     any(word in dept.lower() for word in known_dept.split()) or
                                     dept.lower() in known_dept):
                                     potential_departments.append(standard_name)
-                                    logger.info(f"Partial match: '{dept}' mapped to {standard_name}")
+                                    logger.debug("Partial match: '%s' mapped to %s", dept, standard_name)
                                     break
                 except Exception as e:
-                    logger.debug(f"Error processing match: {e}")
+                    logger.debug("Error processing match: %s", e)
                     continue
                         
         # Return the first found department or None
         if potential_departments:
             # Remove duplicates while preserving order
             unique_departments = list(dict.fromkeys(potential_departments))
-            logger.info(f"Final department detection result: {unique_departments[0]}")
+            logger.info("Final department detection result: %s", unique_departments[0])
             return unique_departments[0]
         
         logger.info("No department detected in query")
         return None
     
     except Exception as e:
-        logger.error(f"Error extracting department: {e}")
+        logger.error("Error extracting department: %s", e)
         return None
 
-def check_authorization(employee_id, employee_dept, requested_dept, employee_info=None):
+# Denials check_authorization makes from the user's risk profile (driven by
+# past violations and tenure) rather than the access policy, and errors
+# during the check; neither counts as a new violation
+RISK_DENIAL_REASONS = (
+    "Access denied due to high security risk",
+    "New employees with past violations",
+    "Cross-department access restricted due to security risk",
+    "Special role restricted due to",
+    "Cross-department access restricted due to past violations",
+    "Authorization error",
+)
+
+def is_policy_denial(reason):
+    """Whether a check_authorization denial reason comes from the access policy itself."""
+    return not (reason or "").startswith(RISK_DENIAL_REASONS)
+
+def check_authorization(employee_id, employee_dept, requested_dept, employee_info=None, policy=None):
     """Check if an employee is authorized to access data from a requested department.
     Enhanced with security threat detection and behavioral analysis.
     
@@ -552,11 +1007,13 @@ def check_authorization(employee_id, employee_dept, requested_dept, employee_inf
         employee_dept (str): Department of the employee making the request
         requested_dept (str): Department whose data is being requested
         employee_info (dict): Additional employee information including past_violations, join_date, ip_address
+        policy (dict): Authorization policy, defaults to the current tenant's or AUTHORIZATION_POLICY
         
     Returns:
         bool: True if authorized, False otherwise
         str: Reason for authorization decision
     """
+    policy = policy or tenants.current_policy() or AUTHORIZATION_POLICY
     try:
         # If no specific department was requested/detected
         if not requested_dept:
@@ -569,30 +1026,26 @@ def check_authorization(employee_id, employee_dept, requested_dept, employee_inf
             
             # Only HR and special roles can access cross-departmental data
             if employee_dept == "Human Resources":
-                logger.info(f"HR employee {employee_id} authorized for cross-departmental/employee data query")
+                logger.info("HR employee %s authorized for cross-departmental/employee data query", employee_id)
                 return True, "HR authorized for employee data and cross-departmental access"
             
             # Check if user has special role with broad access
             try:
                 employee_id_int = int(employee_id)
-                special_roles = {
-                    10: ["Human Resources", "Engineering", "Sales", "Marketing"],  # HR admin
-                    16: ["Human Resources", "Accounting"],  # HR lead
-                    13: ["Accounting", "Sales", "Marketing"],  # Finance director
-                }
+                special_roles = policy["special_roles"]
                 
                 if employee_id_int in special_roles:
                     # For cross-departmental queries, check if they have access to multiple departments
                     accessible_depts = special_roles[employee_id_int]
-                    if len(accessible_depts) >= 3:  # Can access 3+ departments
-                        logger.info(f"Special role user {employee_id} authorized for cross-departmental query")
+                    if len(accessible_depts) >= policy["special_role_cross_dept_min"]:
+                        logger.info("Special role user %s authorized for cross-departmental query", employee_id)
                         return True, f"Special role with broad access authorized for cross-departmental data"
                     
             except (ValueError, TypeError):
                 pass
             
             # Deny cross-departmental access for regular employees
-            logger.warning(f"Employee {employee_id} from {employee_dept} denied cross-departmental/employee data access")
+            logger.warning("Employee %s from %s denied cross-departmental/employee data access", employee_id, employee_dept)
             return False, "Employee data and cross-departmental queries require HR or special role authorization"
         
         # Enhanced security checks based on additional factors
@@ -611,12 +1064,10 @@ def check_authorization(employee_id, employee_dept, requested_dept, employee_inf
                 past_violations = 0
             
             # Calculate security risk based on violations
-            if past_violations >= 3:
-                security_risk_score += 1.0  # High risk
-            elif past_violations >= 2:
-                security_risk_score += 0.7  # Medium-high risk
-            elif past_violations >= 1:
-                security_risk_score += 0.3  # Low-medium risk
+            for min_violations, risk in policy["violation_risk"]:
+                if past_violations >= min_violations:
+                    security_risk_score += risk
+                    break
                 
             # 3. Check join date - newer employees might have more restrictions
             join_date = employee_info.get('join_date', '')
@@ -645,49 +1096,49 @@ def check_authorization(employee_id, employee_dept, requested_dept, employee_inf
                     if join_date_obj:
                         today = datetime.now()
                         months_employed = (today.year - join_date_obj.year) * 12 + (today.month - join_date_obj.month)
-                        is_new_employee = months_employed < 3  # Less than 3 months at company
+                        is_new_employee = months_employed < policy["new_employee_months"]
                         
                         # Add risk for very new employees
-                        if months_employed < 1:
-                            security_risk_score += 0.4
-                        elif months_employed < 3:
-                            security_risk_score += 0.2
+                        for max_months, risk in policy["tenure_risk"]:
+                            if months_employed < max_months:
+                                security_risk_score += risk
+                                break
                 except Exception as e:
-                    logger.warning(f"Error processing join date: {e}")
+                    logger.warning("Error processing join date: %s", e)
             
             # Enhanced security decision logic
-            logger.info(f"Security risk score for employee {employee_id}: {security_risk_score}")
+            logger.info("Security risk score for employee %s: %s", employee_id, security_risk_score)
             
             # Automatic rejection for very high security risk - but with exceptions
-            if security_risk_score >= 1.0:
+            if security_risk_score >= policy["high_risk_threshold"]:
                 # Exception: HR users accessing their own department or employee data
                 if employee_dept == "Human Resources" and (requested_dept == "Human Resources" or requested_dept == "ALL_DEPARTMENTS"):
-                    logger.info(f"HR employee {employee_id} with high risk score granted access to HR/employee data due to job requirements")
+                    logger.info("HR employee %s with high risk score granted access to HR/employee data due to job requirements", employee_id)
                     # Continue with normal authorization flow instead of blocking
                 else:
-                    logger.warning(f"Employee {employee_id} has very high security risk score - access denied")
+                    logger.warning("Employee %s has very high security risk score - access denied", employee_id)
                     return False, f"Access denied due to high security risk (score: {security_risk_score:.1f})"
             
             # Special case: New employees with past violations have heavily restricted access
             if is_new_employee and past_violations > 0:
                 # New employees with violations can only access their own department
                 if employee_dept != requested_dept:
-                    logger.warning(f"New employee {employee_id} with past violations - restricted to own department")
+                    logger.warning("New employee %s with past violations - restricted to own department", employee_id)
                     return False, "New employees with past violations can only access their own department"
             
             # Medium-high risk employees get restricted cross-department access
-            if security_risk_score >= 0.5 and employee_dept != requested_dept:
-                logger.warning(f"Medium-high risk employee {employee_id} requesting cross-department access")
+            if security_risk_score >= policy["cross_dept_risk_threshold"] and employee_dept != requested_dept:
+                logger.warning("Medium-high risk employee %s requesting cross-department access", employee_id)
                 return False, f"Cross-department access restricted due to security risk (score: {security_risk_score:.1f})"
             
             # Localhost gets elevated privileges (typically for admin/dev purposes)
             if is_localhost:
-                logger.info(f"Request from localhost ({ip_address}) - granting elevated access")
+                logger.info("Request from localhost (%s) - granting elevated access", ip_address)
                 return True, "Localhost connection with elevated access"
         
         # Always allow employees to access their own department's data
         if employee_dept == requested_dept:
-            logger.info(f"Employee {employee_id} authorized to access their own department ({employee_dept})")
+            logger.info("Employee %s authorized to access their own department (%s)", employee_id, employee_dept)
             return True, "Access to own department data"
         
         # Special roles with broader access
@@ -698,57 +1149,85 @@ def check_authorization(employee_id, employee_dept, requested_dept, employee_inf
             # If it can't be converted to int, it won't match any special role keys
             employee_id_int = None
         
-        special_roles = {
-            # Format: employee_id: [departments_with_access]
-            10: ["Human Resources", "Engineering", "Sales", "Marketing"],  # HR admin with access to multiple departments
-            16: ["Human Resources", "Accounting"],  # HR lead with finance access
-            13: ["Accounting", "Sales", "Marketing"],  # Finance director
-        }
+        special_roles = policy["special_roles"]
         
         # Check for special roles - using the integer ID for comparison
         if employee_id_int is not None and employee_id_int in special_roles and requested_dept in special_roles[employee_id_int]:
             # If employee has past violations, extra scrutiny even with special role
             if employee_info and past_violations > 0:
-                logger.warning(f"Special role user {employee_id} has {past_violations} violations - applying conditional restrictions")
+                logger.warning("Special role user %s has %s violations - applying conditional restrictions", employee_id, past_violations)
                 # Be more lenient with HR accessing their own department or employee data
                 if employee_dept == "Human Resources" and (requested_dept == "Human Resources" or requested_dept == "ALL_DEPARTMENTS"):
-                    logger.info(f"HR special role user {employee_id} granted access despite violations for critical HR functions")
-                elif past_violations >= 3:
+                    logger.info("HR special role user %s granted access despite violations for critical HR functions", employee_id)
+                elif past_violations >= policy["special_role_max_violations"]:
                     return False, f"Special role restricted due to {past_violations} violations"
             
-            logger.info(f"Employee {employee_id} has special role authorization for {requested_dept}")
+            logger.info("Employee %s has special role authorization for %s", employee_id, requested_dept)
             return True, f"Special role authorization for {requested_dept}"
         
         # Cross-department access rules
-        cross_dept_access = {
-            "Human Resources": DEPARTMENTS,  # HR can access all departments
-            "Accounting": ["Sales", "Marketing"],  # Finance can access revenue departments
-            "Engineering": [],  # Engineering has limited cross-department access
-        }
+        cross_dept_access = policy["cross_dept_access"]
         
         # Check cross-department access rules - with added restriction for employees with violations
         if employee_dept in cross_dept_access and requested_dept in cross_dept_access[employee_dept]:
             # If employee has past violations, extra scrutiny for cross-department access
             if employee_info and past_violations > 0:
                 # Be more lenient with HR users accessing other departments as it's part of their job
-                if employee_dept == "Human Resources" and past_violations < 5:  # Allow HR with fewer than 5 violations
-                    logger.info(f"HR employee {employee_id} with {past_violations} violations granted cross-dept access for HR functions")
+                if employee_dept == "Human Resources" and past_violations < policy["hr_cross_dept_max_violations"]:
+                    logger.info("HR employee %s with %s violations granted cross-dept access for HR functions", employee_id, past_violations)
                 else:
-                    logger.warning(f"Employee {employee_id} has {past_violations} violations - restricted cross-dept access")
+                    logger.warning("Employee %s has %s violations - restricted cross-dept access", employee_id, past_violations)
                     return False, f"Cross-department access restricted due to past violations"
                 
-            logger.info(f"Employee from {employee_dept} has cross-department authorization for {requested_dept}")
+            logger.info("Employee from %s has cross-department authorization for %s", employee_dept, requested_dept)
             return True, f"Cross-department authorization from {employee_dept} to {requested_dept}"
         
         # Default: no access
-        logger.warning(f"Employee {employee_id} from {employee_dept} NOT authorized to access {requested_dept}")
+        logger.warning("Employee %s from %s NOT authorized to access %s", employee_id, employee_dept, requested_dept)
         return False, f"No authorization from {employee_dept} to {requested_dept}"
     
     except Exception as e:
-        logger.error(f"Error in authorization check: {e}")
+        logger.error("Error in authorization check: %s", e)
         # Default to denying access on error
         return False, f"Authorization error: {str(e)}"
 
+def data_access_check(employee_id, employee_info, requested_dept, policy=None):
+    """Predicate telling which departments an approved query may read employee data from.
+
+    A specific department was approved as a whole and a query naming no
+    department reads the employee's own; a cross-departmental query covers
+    the employee's own department and every department check_authorization allows.
+    """
+    own_dept = employee_info.get('dept')
+    if requested_dept == "ALL_DEPARTMENTS":
+        return lambda dept: dept == own_dept or check_authorization(employee_id, own_dept, dept, employee_info, policy)[0]
+    allowed = requested_dept or own_dept
+    return lambda dept: dept == allowed
+
+def listing_scope(user_id, requested_dept=None, policy=None):
+    """The user and the departments whose employees they may list.
+
+    Unlike data_access_check, no query was approved beforehand: every
+    department (or only the requested one) goes through check_authorization,
+    with violations recorded since the data export counted.
+
+    Returns:
+        dict or None: The user, None if not found
+        list: Authorized departments, sorted
+    """
+    user = directory.get_directory().get(user_id)
+    if not user:
+        return None, []
+    try:
+        user['past_violations'] = int(user.get('past_violations', 0))
+    except (ValueError, TypeError):
+        user['past_violations'] = 0
+    if violation_store is not None:
+        user['past_violations'] += violation_store.count(user_id)
+    candidates = [requested_dept] if requested_dept else directory.get_directory().departments()
+    return user, sorted(dept for dept in candidates
+                        if check_authorization(user_id, user.get('dept'), dept, user, policy)[0])
+
 def process_result(is_related, predicted_label, confidence, employee_info=None, query=None):
     """Process and display classification results with authorization check."""
     print(f"Prediction: {predicted_label} (confidence: {confidence:.2f})")
@@ -800,7 +1279,7 @@ def load_user_data(csv_path="MOCK_DATA.csv"):
             df['join_date'] = pd.to_datetime(df['join_date'], format='%d/%m/%Y', errors='coerce')
         return df
     except Exception as e:
-        logger.error(f"Error loading user data: {e}")
+        logger.error("Error loading user data: %s", e)
         raise
 
 def get_user_by_id(user_id, user_data):
@@ -814,57 +1293,132 @@ def get_user_by_id(user_id, user_data):
             
         user = user_data[user_data['id'] == user_id]
         if user.empty:
-            logger.warning(f"User with ID {user_id} not found")
+            logger.warning("User with ID %s not found", user_id)
             return None
         return user.iloc[0].to_dict()
     except Exception as e:
-        logger.error(f"Error retrieving user by ID: {e}")
+        logger.error("Error retrieving user by ID: %s", e)
         return None
 
-def process_user_query(user_id, query):
+def process_user_query(user_id, query, conversation_id=None):
     """Process a user query with authentication and classification
     
     Args:
         user_id: User ID to look up in CSV
         query: The query text to classify
+        conversation_id: Optional chat conversation the query continues (see session_cache.py)
         
     Returns:
         dict: Response with query status, classification, and authorization details
     """
-    global classifier
-    
-    # Make sure classifier is loaded
-    if classifier is None:
-        classifier = load_classifier()
-    
-    try:
-        # Load user data
-        user_data = load_user_data()
-        
-        # Get user information
-        user = get_user_by_id(user_id, user_data)
-        if not user:
-            return {
-                "status": "error",
-                "message": f"User with ID {user_id} not found",
-                "query": query,
-                "is_appropriate": False
-            }
-        
-        # Ensure past_violations is an integer
+    tenant = tenants.current()
+    details = {"tenant": tenant.name if tenant is not None else None}
+    policy = tenants.current_policy() or AUTHORIZATION_POLICY
+    with metrics.stage("process_user_query"):
+        result = _process_user_query(user_id, query, details, conversation_id)
+    session = details.pop("session", None)
+    if session is not None and result.get("status") == "approved" and result.get("requested_dept"):
+        # Only departments the user was authorized for carry over to follow-ups
+        session_cache.remember_department(session, result["requested_dept"])
+    if query_engine.QUERY_ENGINE_ENABLED and result.get("status") == "approved" and details.get("user"):
+        # Answer approved employee-data questions from the directory
         try:
-            user['past_violations'] = int(user.get('past_violations', 0))
-        except (ValueError, TypeError):
-            user['past_violations'] = 0
+            result["data"] = query_engine.answer(
+                query, result.get("requested_dept"),
+                data_access_check(user_id, details["user"], result.get("requested_dept")),
+                directory.get_directory(), new_employee_months=policy["new_employee_months"])
+        except Exception as e:
+            logger.error("Query execution failed: %s", e)
+    metrics.DECISIONS.inc(result.get("status", "unknown"), result.get("label") or "none")
+    if violation_store is not None and result.get("status") != "error":
+        # Denials by the risk rules and rejections by keyword rules are not counted
+        counted = is_policy_denial(result.get("auth_reason")) and not details.get("security_rule")
+        violation_store.record_outcome(user_id, result, counted)
+    if rate_limiter is not None and result.get("status") not in ("error", "rate_limited"):
+        rate_limiter.record_outcome(user_id, result.get("status"), details.get("security_risk"))
+    if audit_writer is not None:
+        audit_writer.record(audit_log.decision_record(user_id, result, details))
+    return result
+
+def _process_user_query(user_id, query, details, conversation_id=None):
+    """Body of process_user_query, which wraps it with timing, decision counting and auditing.
+
+    Scores and user details that the response does not carry are put in ``details``.
+    """
+    try:
+        session = generation = None
+        if session_cache is not None:
+            # Read before the record: one read after a concurrent swap is dropped on the next turn
+            generation = directory.get_directory().generation
+            session = session_cache.get(user_id, conversation_id, generation)
+        if session is not None:
+            # Follow-up turn: the employee record was resolved by an earlier one
+            user = dict(session.user)
+        else:
+            with metrics.stage("directory_load"):
+                # Look the user up in the resident employee directory
+                user = directory.get_directory().get(user_id)
+            if not user:
+                logger.warning("User with ID %s not found", user_id)
+                return {
+                    "status": "error",
+                    "message": f"User with ID {user_id} not found",
+                    "query": query,
+                    "is_appropriate": False
+                }
+            
+            # Ensure past_violations is an integer
+            try:
+                user['past_violations'] = int(user.get('past_violations', 0))
+            except (ValueError, TypeError):
+                user['past_violations'] = 0
+            if session_cache is not None:
+                session = session_cache.start(user_id, conversation_id, user, generation)
+        # Violations recorded since the employee data was exported also count towards the risk score
+        if violation_store is not None:
+            user['past_violations'] += violation_store.count(user_id)
+        
+        # Per-user rate limit, enforced before any inference
+        abuse = None
+        if rate_limiter is not None:
+            allowed, retry_after = rate_limiter.acquire(user_id, user.get('dept'))
+            if not allowed:
+                metrics.trace_rule("rate_limited")
+                return {
+                    "status": "rate_limited",
+                    "message": f"Rate limit exceeded, retry in {retry_after:.1f}s",
+                    "query": query,
+                    "is_appropriate": False,
+                    "user_id": user_id,
+                    "user_dept": user.get('dept', ''),
+                    "retry_after": retry_after
+                }
+            abuse = rate_limiter.abuse_signals(user_id)
         
         # Rename department field for compatibility with existing code
         user['department'] = user.get('dept')
-        
-        # Classify the query
-        is_corporate, predicted_label, confidence, scores = is_corporate_related(query, classifier)
+        details["user"] = user
+        details["user_dept"] = user.get('dept')
+        details["past_violations"] = user['past_violations']
+        details["join_date"] = user.get('join_date')
+        details["ip_address"] = user.get('ip_address')
+        
+        # Enforce the token budget, then classify (locally or on the inference pool)
+        model_query, truncated = apply_token_budget(query)
+        classification = session.classification(model_query) if session is not None else None
+        if classification is None:
+            with metrics.stage("classification"):
+                classification = run_corporate_check(model_query)
+            if session is not None:
+                session_cache.remember_classification(session, model_query, classification)
+        is_corporate, predicted_label, confidence, scores = classification
+        if not is_corporate:
+            details["security_rule"] = security_rule(model_query)
         
         # Perform additional security risk analysis
-        security_risk, risk_details = analyze_query_security_risk(query)
+        with metrics.stage("security_risk"):
+            security_risk, risk_details = analyze_query_security_risk(query, abuse)
+        details.update(scores=scores, security_risk=security_risk, risk_details=risk_details)
         
         result = {
             "query": query,
@@ -873,12 +1427,15 @@ def process_user_query(user_id, query):
             "confidence": float(confidence),
             "user_id": user_id,
             "user_dept": user.get('dept', ''),
-            "user_name": f"{user.get('first_name', '')} {user.get('last_name', '')}"
+            "user_name": f"{user.get('first_name', '')} {user.get('last_name', '')}",
+            "truncated": truncated
         }
         
         # Enhanced security check: if security risk is very high, reject even corporate queries
         if security_risk >= 0.8:
-            logger.warning(f"High security risk detected: {security_risk:.2f}, Details: {risk_details}")
+            logger.warning("High security risk detected: %.2f, Details: %s", security_risk, risk_details)
+            metrics.trace_rule("high_query_risk")
+            details["security_rule"] = "high_query_risk"
             result["status"] = "rejected"
             result["message"] = f"Query rejected due to high security risk (score: {security_risk:.2f})"
             result["is_appropriate"] = False
@@ -890,7 +1447,7 @@ def process_user_query(user_id, query):
         
         # Medium security risk gets flagged for additional review
         if security_risk >= 0.5:
-            logger.info(f"Medium security risk detected: {security_risk:.2f}, Details: {risk_details}")
+            logger.info("Medium security risk detected: %.2f, Details: %s", security_risk, risk_details)
             # Continue processing but add security context to the response
         
         # If non-corporate, check for special cases before rejecting
@@ -910,7 +1467,8 @@ def process_user_query(user_id, query):
                 
                 # If it's an engineering query from engineering department, allow it
                 if has_engineering_terms:
-                    logger.info(f"Allowing engineering query '{query}' for Engineering department user")
+                    logger.info("Allowing engineering query '%s' for Engineering department user", query)
+                    metrics.trace_rule("engineering_department_override")
                     # Reclassify as corporate engineering query
                     is_corporate = True
                     predicted_label = "engineering question"
@@ -936,7 +1494,15 @@ def process_user_query(user_id, query):
                 return result
         
         # Extract requested department from the query
-        requested_dept = extract_requested_department(query)
+        with metrics.stage("extract_department"):
+            requested_dept = extract_requested_department(query)
+        if session is not None:
+            details["session"] = session
+            if not requested_dept and session.last_dept and query_engine.has_data_intent(query):
+                # A follow-up asking for employee data without naming a department continues
+                # the previous approved one; it is authorized again below
+                requested_dept = session.last_dept
+                metrics.trace_rule("session_department")
         result["requested_dept"] = requested_dept if requested_dept else ""
         
         # Handle cross-departmental queries
@@ -944,7 +1510,8 @@ def process_user_query(user_id, query):
             result["requested_dept"] = "ALL_DEPARTMENTS"
             # Check authorization for cross-departmental access
             try:
-                is_authorized, reason = check_authorization(user_id, user.get('dept'), requested_dept, user)
+                with metrics.stage("check_authorization"):
+                    is_authorized, reason = check_authorization(user_id, user.get('dept'), requested_dept, user)
                 result["is_authorized"] = is_authorized
                 result["auth_reason"] = reason
                 
@@ -955,7 +1522,7 @@ def process_user_query(user_id, query):
                     result["status"] = "unauthorized"
                     result["message"] = f"Employee data query unauthorized: {reason}"
             except Exception as auth_error:
-                logger.error(f"Authorization check failed: {auth_error}")
+                logger.error("Authorization check failed: %s", auth_error)
                 result["status"] = "error"
                 result["message"] = f"Authorization check failed: {str(auth_error)}"
                 result["is_authorized"] = False
@@ -965,6 +1532,7 @@ def process_user_query(user_id, query):
         
         # If no specific department was requested
         if not requested_dept:
+            metrics.trace_rule("no_department_requested")
             result["status"] = "approved"
             result["message"] = "Corporate query with no specific department requested"
             result["is_authorized"] = None
@@ -973,7 +1541,8 @@ def process_user_query(user_id, query):
         
         # Check authorization
         try:
-            is_authorized, reason = check_authorization(user_id, user.get('dept'), requested_dept, user)
+            with metrics.stage("check_authorization"):
+                is_authorized, reason = check_authorization(user_id, user.get('dept'), requested_dept, user)
             result["is_authorized"] = is_authorized
             result["auth_reason"] = reason
             
@@ -984,7 +1553,7 @@ def process_user_query(user_id, query):
                 result["status"] = "unauthorized"
                 result["message"] = f"Query unauthorized: {reason}"
         except Exception as auth_error:
-            logger.error(f"Authorization check failed: {auth_error}")
+            logger.error("Authorization check failed: %s", auth_error)
             result["status"] = "error"
             result["message"] = f"Authorization check failed: {str(auth_error)}"
             result["is_authorized"] = False
@@ -993,7 +1562,7 @@ def process_user_query(user_id, query):
         return result
         
     except Exception as e:
-        logger.error(f"Error processing query: {e}")
+        logger.error("Error processing query: %s", e)
         return {
             "status": "error",
             "message": str(e),
@@ -0,0 +1,330 @@
+import bisect
+import contextvars
+import threading
+from contextlib import contextmanager
+from time import perf_counter, thread_time
+
+# Latency buckets in seconds, from sub-millisecond regex stages to multi-second NLI calls
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+REGISTRY = []
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally split by label values."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def _render_samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callback at scrape time.
+
+    The callback returns a number, or a dict mapping label-value tuples to numbers.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _render_samples(self):
+        if self.callback is None:
+            return []
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in value.items()]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram, optionally split by label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._children = {}
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, _HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value, *labelvalues):
+        self.labels(*labelvalues).observe(value)
+
+    def _render_samples(self):
+        lines = []
+        for labelvalues, child in list(self._children.items()):
+            with child.lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = ("le", _format_value(bound) if bound == float("inf") else repr(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {count}")
+        return lines
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Service metrics -------------------------------------------------------
+
+STAGE_SECONDS = Histogram(
+    "dexora_stage_seconds", "Wall time spent in each query processing stage", ("stage",))
+DECISIONS = Counter(
+    "dexora_decisions_total", "User query decisions by status and label", ("status", "label"))
+CASCADE_EVENTS = Counter(
+    "dexora_cascade_events_total", "Classification cascade events (domain stage runs, early exits, student answers)",
+    ("event",))
+CACHE_REQUESTS = Counter(
+    "dexora_cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+BATCH_SIZE = Histogram(
+    "dexora_inference_batch_size", "Sequences per inference batch", buckets=SIZE_BUCKETS)
+QUEUE_DEPTH = Gauge(
+    "dexora_queue_depth", "Items waiting in internal queues (inference, log writer)", ("queue",))
+AUDIT_RECORDS = Counter(
+    "dexora_audit_records_total", "Audit records written to disk or dropped on a full buffer", ("result",))
+VIOLATIONS = Counter(
+    "dexora_violations_recorded_total", "Violations recorded at runtime by outcome status", ("status",))
+RATE_LIMIT_EVENTS = Counter(
+    "dexora_rate_limit_events_total", "Requests rejected by the per-user rate limit and abuse escalations",
+    ("event",))
+EMPLOYEE_UPSERTS = Counter(
+    "dexora_employee_upserts_total", "Employees inserted, updated or rejected by bulk uploads", ("result",))
+LOG_RECORDS_DISCARDED = Counter(
+    "dexora_log_records_discarded_total", "Log records dropped because the log queue was full or sampled out",
+    ("reason",))
+
+# Per-thread/task sink that stage timings and events are copied into, used to
+# forward worker-process measurements back to the API process
+_sink = contextvars.ContextVar("metrics_sink", default=None)
+
+# Per-request trace, only set when a caller asked for a timing breakdown
+_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """Stage timings, counters and fired rules of a single request.
+
+    CPU times are those of the request thread; model compute running on the
+    batcher thread or in a pool worker only shows up in wall time.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.counters = {}
+        self.rules = []
+        self._start = perf_counter()
+        self._cpu_start = thread_time()
+        self._end = None
+
+    def finish(self):
+        self._end = (perf_counter() - self._start, thread_time() - self._cpu_start)
+
+    def merge(self, data):
+        """Merge a trace dict recorded elsewhere (e.g. in a pool worker)."""
+        self.stages.extend(tuple(stage) for stage in data.get("stages", []))
+        for key, value in data.get("counters", {}).items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.rules.extend(data.get("rules", []))
+
+    def to_dict(self):
+        wall, cpu = self._end or (perf_counter() - self._start, thread_time() - self._cpu_start)
+        return {
+            "total_wall_ms": round(wall * 1000, 3),
+            "total_cpu_ms": round(cpu * 1000, 3),
+            "stages": [
+                {"stage": name, "wall_ms": round(w * 1000, 3), "cpu_ms": round(c * 1000, 3)}
+                for name, w, c in self.stages
+            ],
+            "nli_pairs": self.counters.get("nli_pairs", 0),
+            "cache_hits": self.counters.get("cache_hits", 0),
+            "counters": dict(self.counters),
+            "rules": list(self.rules)
+        }
+
+    def export(self):
+        """Raw form of the trace for shipping between processes (see merge)."""
+        return {"stages": list(self.stages), "counters": dict(self.counters), "rules": list(self.rules)}
+
+
+class _StageTimer:
+    __slots__ = ("name", "child", "start", "trace", "cpu_start")
+
+    def __init__(self, name):
+        self.name = name
+        self.child = STAGE_SECONDS.labels(name)
+
+    def __enter__(self):
+        self.trace = _trace.get()
+        if self.trace is not None:
+            self.cpu_start = thread_time()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = perf_counter() - self.start
+        self.child.observe(elapsed)
+        sink = _sink.get()
+        if sink is not None:
+            sink.append(("stage", self.name, elapsed))
+        if self.trace is not None:
+            self.trace.stages.append((self.name, elapsed, thread_time() - self.cpu_start))
+        return False
+
+
+def stage(name):
+    """Context manager timing a processing stage into dexora_stage_seconds."""
+    return _StageTimer(name)
+
+
+def cascade_event(event):
+    """Count a classification cascade event."""
+    CASCADE_EVENTS.inc(event)
+    sink = _sink.get()
+    if sink is not None:
+        sink.append(("cascade", event, 1))
+
+
+@contextmanager
+def trace_request():
+    """Record a per-request timing breakdown for everything run in this context."""
+    trace = RequestTrace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        _trace.reset(token)
+
+
+def tracing():
+    """Return True if the current request asked for a timing breakdown."""
+    return _trace.get() is not None
+
+
+def trace_count(key, amount=1):
+    """Add to a per-request counter (no-op unless the request is traced)."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.counters[key] = trace.counters.get(key, 0) + amount
+
+
+def trace_rule(rule):
+    """Record which decision or short-circuit rule fired (no-op unless traced)."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.rules.append(rule)
+
+
+def merge_trace(data):
+    """Merge a trace dict from another process into the current request's trace."""
+    trace = _trace.get()
+    if trace is not None and data:
+        trace.merge(data)
+
+
+@contextmanager
+def collect():
+    """Collect the stage timings and events recorded in this context into a list."""
+    entries = []
+    token = _sink.set(entries)
+    try:
+        yield entries
+    finally:
+        _sink.reset(token)
+
+
+def replay(entries):
+    """Record entries collected in another process (see collect) into this one."""
+    for kind, name, value in entries:
+        if kind == "stage":
+            STAGE_SECONDS.labels(name).observe(value)
+        elif kind == "cascade":
+            CASCADE_EVENTS.inc(name, amount=value)
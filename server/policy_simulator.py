@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""What-if simulator for authorization policy changes.
+
+Replays historical requests (user snapshot, requested department) under the
+current AUTHORIZATION_POLICY and a candidate policy and reports which
+decisions would flip, by department, user and rule. Requests are read and
+evaluated in chunks with vectorized pandas/numpy logic that mirrors
+check_authorization, so memory stays bounded for corpora of any size.
+
+With --tenant the requests are replayed under that tenant's policy (from
+TENANTS_CONFIG, see tenants.py) and the candidate overrides it; audit
+records are limited to that tenant's, or to requests without a tenant when
+no tenant is given.
+
+Usage:
+    python policy_simulator.py --policy candidate.json --audit-dir audit
+    python policy_simulator.py --policy candidate.json --audit-dir audit --tenant acme
+    python policy_simulator.py --policy candidate.json --corpus requests.csv --output diff.json
+"""
+
+import argparse
+import copy
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from main_model import AUTHORIZATION_POLICY
+from tenants import TENANTS_CONFIG, TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 200_000
+MAX_EXAMPLES = 20
+
+HR = "Human Resources"
+ALL_DEPARTMENTS = "ALL_DEPARTMENTS"
+
+# Decision rules of check_authorization in evaluation order: (rule, authorized, reason)
+RULES = [
+    ("no_department", False, "No specific department detected in the query"),
+    ("all_departments_hr", True, "HR authorized for employee data and cross-departmental access"),
+    ("all_departments_special_role", True, "Special role with broad access authorized for cross-departmental data"),
+    ("all_departments_denied", False, "Employee data and cross-departmental queries require HR or special role authorization"),
+    ("high_risk", False, "Access denied due to high security risk (score: {risk:.1f})"),
+    ("new_employee_violations", False, "New employees with past violations can only access their own department"),
+    ("cross_dept_risk", False, "Cross-department access restricted due to security risk (score: {risk:.1f})"),
+    ("localhost", True, "Localhost connection with elevated access"),
+    ("own_department", True, "Access to own department data"),
+    ("special_role_violations", False, "Special role restricted due to {past_violations} violations"),
+    ("special_role", True, "Special role authorization for {requested_dept}"),
+    ("cross_dept_violations", False, "Cross-department access restricted due to past violations"),
+    ("cross_dept", True, "Cross-department authorization from {user_dept} to {requested_dept}"),
+    ("no_authorization", False, "No authorization from {user_dept} to {requested_dept}"),
+]
+RULE_NAMES = np.array([name for name, _, _ in RULES])
+RULE_AUTHORIZED = np.array([authorized for _, authorized, _ in RULES])
+
+CORPUS_COLUMNS = ["user_id", "user_dept", "requested_dept", "past_violations", "join_date", "ip_address", "query", "ts"]
+
+
+def load_policy(path, base=None):
+    """Load a candidate policy: a JSON object overriding keys of the current policy."""
+    policy = copy.deepcopy(base or AUTHORIZATION_POLICY)
+    with open(path) as f:
+        overrides = json.load(f)
+    if "special_roles" in overrides:
+        # JSON object keys are strings; employee IDs are ints
+        overrides["special_roles"] = {int(k): v for k, v in overrides["special_roles"].items()}
+    policy.update(overrides)
+    return policy
+
+
+def normalize_corpus(frame):
+    """Bring a corpus chunk to CORPUS_COLUMNS (``dept`` is accepted for ``user_dept``)."""
+    if "user_dept" not in frame.columns and "dept" in frame.columns:
+        frame = frame.rename(columns={"dept": "user_dept"})
+    for column in CORPUS_COLUMNS:
+        if column not in frame.columns:
+            frame[column] = None
+    frame = frame[CORPUS_COLUMNS].copy()
+    frame["requested_dept"] = frame["requested_dept"].fillna("").astype(str)
+    # Requests without a requested department never reach check_authorization
+    return frame[frame["requested_dept"] != ""].reset_index(drop=True)
+
+
+def _months_employed(join_dates, as_of):
+    if pd.api.types.is_datetime64_any_dtype(join_dates):
+        parsed = join_dates
+    else:
+        # Same formats as check_authorization; timestamps keep only their date part.
+        # Join dates repeat across requests, so only the distinct values are parsed.
+        codes, uniques = pd.factorize(join_dates.astype(str).str.slice(0, 10))
+        text = pd.Series(uniques)
+        parsed_uniques = pd.to_datetime(text, format="%Y-%m-%d", errors="coerce")
+        for fmt in ("%d/%m/%Y", "%m/%d/%Y"):
+            parsed_uniques = parsed_uniques.fillna(pd.to_datetime(text, format=fmt, errors="coerce"))
+        parsed = pd.Series(parsed_uniques.to_numpy()[codes], index=join_dates.index)
+    return ((as_of.dt.year - parsed.dt.year) * 12 + (as_of.dt.month - parsed.dt.month)).to_numpy(dtype=float)
+
+
+def _first_match(conditions, values, size):
+    # np.select over (condition, value) rules where the first match wins
+    if not conditions:
+        return np.zeros(size)
+    return np.select(conditions, values, 0.0)
+
+
+def _pairs_isin(left, right, pairs):
+    if not pairs:
+        return np.zeros(len(left), dtype=bool)
+    return pd.MultiIndex.from_arrays([left, right]).isin(list(pairs))
+
+
+def extract_features(frame, as_of=None):
+    """Policy-independent columns of a corpus chunk, shared by every policy evaluated on it.
+
+    Args:
+        frame (DataFrame): Chunk from normalize_corpus
+        as_of (datetime): Reference time for tenure; rows with a ``ts`` use their own time
+    """
+    default_as_of = pd.Timestamp(as_of or datetime.now())
+    as_of_times = pd.to_datetime(frame["ts"], errors="coerce", utc=True).dt.tz_localize(None)
+    as_of_times = as_of_times.fillna(default_as_of)
+    return {
+        "user_ids": pd.to_numeric(frame["user_id"], errors="coerce").fillna(-1).astype(np.int64).to_numpy(),
+        "dept": frame["user_dept"].fillna("").astype(str).to_numpy(),
+        "requested": frame["requested_dept"].to_numpy(),
+        "violations": pd.to_numeric(frame["past_violations"], errors="coerce").fillna(0).astype(np.int64).to_numpy(),
+        "months": _months_employed(frame["join_date"], as_of_times),
+        "localhost": frame["ip_address"].isin(["127.0.0.1", "localhost"]).to_numpy()
+    }
+
+
+def evaluate(frame, policy, as_of=None, features=None):
+    """Vectorized check_authorization over a normalized corpus chunk.
+
+    Args:
+        frame (DataFrame): Chunk from normalize_corpus
+        policy (dict): Authorization policy
+        as_of (datetime): Reference time for tenure; rows with a ``ts`` use their own time
+        features (dict): Output of extract_features for this chunk, if already computed
+
+    Returns:
+        DataFrame: ``authorized``, ``rule`` (index into RULES) and ``risk`` per row
+    """
+    features = features or extract_features(frame, as_of)
+    user_ids, dept, requested = features["user_ids"], features["dept"], features["requested"]
+    violations, months, localhost = features["violations"], features["months"], features["localhost"]
+
+    risk = _first_match([violations >= minimum for minimum, _ in policy["violation_risk"]],
+                        [r for _, r in policy["violation_risk"]], len(frame)) \
+        + _first_match([months < maximum for maximum, _ in policy["tenure_risk"]],
+                       [r for _, r in policy["tenure_risk"]], len(frame))
+
+    special_roles = policy["special_roles"]
+    special_pairs = {(int(uid), d) for uid, depts in special_roles.items() for d in depts}
+    broad_roles = [int(uid) for uid, depts in special_roles.items() if len(depts) >= policy["special_role_cross_dept_min"]]
+    cross_pairs = {(src, d) for src, depts in policy["cross_dept_access"].items() for d in depts}
+
+    is_hr = dept == HR
+    all_depts = requested == ALL_DEPARTMENTS
+    other_dept = dept != requested
+    hr_own_or_all = is_hr & ((requested == HR) | all_depts)
+    special = _pairs_isin(user_ids, requested, special_pairs)
+    cross = _pairs_isin(dept, requested, cross_pairs)
+
+    conditions = [
+        requested == "",
+        all_depts & is_hr,
+        all_depts & np.isin(user_ids, broad_roles),
+        all_depts,
+        (risk >= policy["high_risk_threshold"]) & ~hr_own_or_all,
+        (months < policy["new_employee_months"]) & (violations > 0) & other_dept,
+        (risk >= policy["cross_dept_risk_threshold"]) & other_dept,
+        localhost,
+        ~other_dept,
+        special & (violations > 0) & ~hr_own_or_all & (violations >= policy["special_role_max_violations"]),
+        special,
+        cross & (violations > 0) & ~(is_hr & (violations < policy["hr_cross_dept_max_violations"])),
+        cross,
+    ]
+    rule = np.select(conditions, np.arange(len(conditions)), len(RULES) - 1)
+    return pd.DataFrame({"authorized": RULE_AUTHORIZED[rule], "rule": rule, "risk": risk}, index=frame.index)
+
+
+def describe(rule, row, risk):
+    """Reason text check_authorization gives for a rule."""
+    template = RULES[rule][2]
+    return template.format(risk=risk, past_violations=row["past_violations"], requested_dept=row["requested_dept"],
+                           user_dept=row["user_dept"])
+
+
+def read_csv_corpus(path, chunk_rows=CHUNK_ROWS):
+    """Stream a CSV corpus of past requests in normalized chunks."""
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        yield normalize_corpus(chunk)
+
+
+def read_audit_corpus(directory, chunk_rows=CHUNK_ROWS, tenant=None, **filters):
+    """Stream decision audit records of one tenant as normalized corpus chunks.
+
+    Tenants have their own policies, so only records of ``tenant`` (None for
+    requests without a tenant) are read.
+    """
+    from audit_query import query_audit
+
+    rows = []
+    for record in query_audit(directory, **filters):
+        if record.get("tenant") == tenant and record.get("requested_dept"):
+            rows.append(record)
+        if len(rows) >= chunk_rows:
+            yield normalize_corpus(pd.DataFrame(rows))
+            rows = []
+    if rows:
+        yield normalize_corpus(pd.DataFrame(rows))
+
+
+def _plain(value):
+    # numpy scalars and NaN as JSON-friendly Python values
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class PolicyDiff:
+    """Accumulates the comparison of two policies over corpus chunks."""
+
+    COUNTS = ["evaluated", "granted_before", "granted_after", "newly_granted", "newly_denied", "reason_changed"]
+
+    def __init__(self, max_examples=MAX_EXAMPLES):
+        self.max_examples = max_examples
+        self.by_requested_dept = None
+        self.by_user_dept = None
+        self.by_user = None
+        self.by_rule = None
+        self.examples = []
+
+    @staticmethod
+    def _add(total, part):
+        return part if total is None else total.add(part, fill_value=0)
+
+    def update(self, frame, before, after):
+        counts = pd.DataFrame({
+            "evaluated": 1,
+            "granted_before": before["authorized"],
+            "granted_after": after["authorized"],
+            "newly_granted": ~before["authorized"] & after["authorized"],
+            "newly_denied": before["authorized"] & ~after["authorized"],
+            "reason_changed": before["rule"] != after["rule"]
+        }, index=frame.index).astype(np.int64)
+        flipped = (counts["newly_granted"] | counts["newly_denied"]).astype(bool)
+
+        self.by_requested_dept = self._add(self.by_requested_dept, counts.groupby(frame["requested_dept"]).sum())
+        self.by_user_dept = self._add(self.by_user_dept, counts.groupby(frame["user_dept"].fillna("")).sum())
+        if flipped.any():
+            user_ids = frame.loc[flipped, "user_id"]
+            self.by_user = self._add(
+                self.by_user, counts.loc[flipped, ["newly_granted", "newly_denied"]].groupby(user_ids).sum())
+
+        changed = counts["reason_changed"].astype(bool)
+        if changed.any():
+            transitions = pd.DataFrame({"before": RULE_NAMES[before.loc[changed, "rule"]],
+                                        "after": RULE_NAMES[after.loc[changed, "rule"]]})
+            self.by_rule = self._add(self.by_rule, transitions.value_counts())
+
+        for i in np.flatnonzero(flipped.to_numpy())[:max(0, self.max_examples - len(self.examples))]:
+            row = frame.iloc[i]
+            self.examples.append({
+                "user_id": _plain(row["user_id"]),
+                "user_dept": _plain(row["user_dept"]),
+                "requested_dept": row["requested_dept"],
+                "query": _plain(row["query"]),
+                "before": describe(before["rule"].iat[i], row, before["risk"].iat[i]),
+                "after": describe(after["rule"].iat[i], row, after["risk"].iat[i])
+            })
+
+    def report(self, top_users=50):
+        def table(frame, key):
+            if frame is None:
+                return []
+            frame = frame.astype(np.int64).reset_index()
+            return frame.rename(columns={frame.columns[0]: key}).to_dict(orient="records")
+
+        totals = self.by_requested_dept.sum().astype(np.int64).to_dict() if self.by_requested_dept is not None \
+            else dict.fromkeys(self.COUNTS, 0)
+        users = None
+        if self.by_user is not None:
+            users = self.by_user.assign(total=self.by_user.sum(axis=1)).sort_values("total", ascending=False)
+            users = users.drop(columns="total").head(top_users)
+        rules = []
+        if self.by_rule is not None:
+            rules = [{"before": b, "after": a, "count": int(c)}
+                     for (b, a), c in self.by_rule.sort_values(ascending=False).items()]
+        return {
+            "totals": {k: int(v) for k, v in totals.items()},
+            "by_requested_dept": table(self.by_requested_dept, "requested_dept"),
+            "by_user_dept": table(self.by_user_dept, "user_dept"),
+            "by_user": table(users, "user_id"),
+            "by_rule": rules,
+            "examples": self.examples
+        }
+
+
+def simulate(chunks, candidate, current=None, as_of=None, max_examples=MAX_EXAMPLES):
+    """Compare two policies over a stream of corpus chunks and return the diff report."""
+    current = current or AUTHORIZATION_POLICY
+    diff = PolicyDiff(max_examples)
+    for i, chunk in enumerate(chunks):
+        if chunk.empty:
+            continue
+        features = extract_features(chunk, as_of)
+        diff.update(chunk, evaluate(chunk, current, features=features), evaluate(chunk, candidate, features=features))
+        logger.info("Simulated chunk %s (%s requests)", i + 1, len(chunk))
+    return diff.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay past requests under a candidate authorization policy")
+    parser.add_argument("--policy", required=True, help="JSON file overriding keys of AUTHORIZATION_POLICY")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--corpus", help="CSV of past requests (user_id, user_dept, requested_dept, past_violations, "
+                                         "join_date, ip_address, query, optional ts)")
+    source.add_argument("--audit-dir", help="Replay decisions recorded in the audit log")
+    parser.add_argument("--since", help="With --audit-dir, only replay decisions from this time on")
+    parser.add_argument("--until", help="With --audit-dir, only replay decisions before this time")
+    parser.add_argument("--tenant", help="Replay under this tenant's policy (and only its audit records)")
+    parser.add_argument("--tenants-config", default=TENANTS_CONFIG, help="Tenant configuration (TENANTS_CONFIG)")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    args = parser.parse_args()
+
+    current = AUTHORIZATION_POLICY
+    if args.tenant:
+        if not args.tenants_config:
+            parser.error("--tenant needs --tenants-config or TENANTS_CONFIG")
+        tenant = TenantRegistry.from_config(args.tenants_config, load_policy).get(args.tenant)
+        if tenant is None:
+            parser.error(f"Unknown tenant: {args.tenant}")
+        current = tenant.policy or AUTHORIZATION_POLICY
+    candidate = load_policy(args.policy, base=current)
+    if args.corpus:
+        chunks = read_csv_corpus(args.corpus)
+    else:
+        chunks = read_audit_corpus(args.audit_dir, tenant=args.tenant, since=args.since, until=args.until)
+    report = simulate(chunks, candidate, current)
+
+    totals = report["totals"]
+    print("\n===== POLICY SIMULATION =====")
+    print(f"Requests evaluated: {totals['evaluated']}")
+    print(f"Granted: {totals['granted_before']} -> {totals['granted_after']} "
+          f"(+{totals['newly_granted']} newly granted, -{totals['newly_denied']} newly denied)")
+    print(f"Decisions with a different reason: {totals['reason_changed']}")
+    print(f"\n{'requested dept':<20} {'evaluated':>10} {'granted':>10} {'denied':>10}")
+    for row in report["by_requested_dept"]:
+        if row["newly_granted"] or row["newly_denied"]:
+            print(f"{row['requested_dept']:<20} {row['evaluated']:>10} {row['newly_granted']:>10} {row['newly_denied']:>10}")
+    print("\nRule transitions:")
+    for row in report["by_rule"][:20]:
+        print(f"  {row['before']} -> {row['after']}: {row['count']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nFull report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
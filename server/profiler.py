@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Limits for on-demand profiling of the live process
+MAX_PROFILE_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+DEFAULT_SAMPLE_HZ = 100
+MAX_SAMPLE_HZ = 1000
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is requested while another one is running."""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    # Semicolons separate frames in the collapsed format
+    name = code.co_name.replace(";", ":")
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame, thread_name):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name.replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(labels))
+
+
+def sample_stacks(seconds, hz=DEFAULT_SAMPLE_HZ):
+    """Sample the stacks of every thread in this process.
+
+    Only one profile runs at a time; concurrent requests raise ProfilerBusy.
+
+    Args:
+        seconds (float): How long to sample, capped at PROFILE_MAX_SECONDS
+        hz (int): Samples per second, capped at MAX_SAMPLE_HZ
+
+    Returns:
+        Counter: Collapsed stacks ("thread;outer;...;inner") mapped to sample counts
+        int: Number of sampling ticks taken
+    """
+    seconds = max(0.0, min(float(seconds), MAX_PROFILE_SECONDS))
+    interval = 1.0 / max(1, min(int(hz), MAX_SAMPLE_HZ))
+
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        own_id = threading.get_ident()
+        stacks = Counter()
+        ticks = 0
+        deadline = time.monotonic() + seconds
+        next_tick = time.monotonic()
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stacks[_collapse(frame, names.get(thread_id, f"thread-{thread_id}"))] += 1
+            ticks += 1
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Sampling fell behind; skip ahead rather than bursting
+                next_tick = time.monotonic()
+        return stacks, ticks
+    finally:
+        _profile_lock.release()
+
+
+def format_collapsed(stacks):
+    """Render stacks in the collapsed format read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
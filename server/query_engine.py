@@ -0,0 +1,316 @@
+import calendar
+import logging
+import os
+import re
+from datetime import date, timedelta
+
+import numpy as np
+
+import metrics
+from employee_store import EPOCH, MISSING_DAY
+from indexes import intersect
+
+logger = logging.getLogger(__name__)
+
+# Query execution configuration (overridable through environment variables)
+QUERY_ENGINE_ENABLED = os.getenv("QUERY_ENGINE_ENABLED", "true").lower() == "true"
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "100"))
+
+# Fields returned for listed employees (IP addresses and profile URLs are left out)
+RESULT_FIELDS = ("id", "first_name", "last_name", "email", "gender", "dept", "join_date", "past_violations")
+
+_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+_MONTH_PATTERN = "|".join(sorted(_MONTHS, key=len, reverse=True))
+
+_DATA_INTENT = re.compile(
+    r"\b(employees?|staff|people|personnel|workers?|colleagues|hires|joiners|team\s+members|headcount)\b|\bhow\s+many\b"
+    r"|\b(?:average|mean)\s+(?:number\s+of\s+)?(?:past\s+)?violations?\b")
+_JOINED = r"\b(?:joined|hired|started|onboarded)\b"
+_DATE = rf"(?:(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+)?(?:(?P<month>{_MONTH_PATTERN})\.?\s+)?(?P<year>(?:19|20)\d{{2}})\b"
+_JOINED_DATE = re.compile(rf"{_JOINED}\s+(?:the\s+company\s+)?(?P<op>after|since|before|in|during|on)\s+{_DATE}")
+_JOINED_RECENTLY = re.compile(
+    rf"{_JOINED}\s+(?:with)?in\s+the\s+(?:last|past)\s+(?P<count>\d+\s+)?(?P<unit>day|week|month|year)s?\b")
+_NEW_EMPLOYEES = re.compile(r"\bnew\s+(?:employees?|hires?|joiners?|staff|people)\b|\brecent(?:ly\s+joined|\s+hires)\b")
+
+_FEMALE = re.compile(r"\b(?:female|women|woman)\b")
+_MALE = re.compile(r"\b(?:male|men|man)\b")
+
+_NO_VIOLATIONS = re.compile(r"\b(?:no|without|zero)\s+(?:past\s+|any\s+)?violations?\b|\bclean\s+records?\b")
+_VIOLATIONS_ABOVE = re.compile(r"\b(?:more\s+than|over|above)\s+(\d+)\s+(?:past\s+)?violations?\b")
+_VIOLATIONS_AT_LEAST = re.compile(r"\b(?:at\s+least\s+(\d+)|(\d+)\s+or\s+more)\s+(?:past\s+)?violations?\b")
+_WITH_VIOLATIONS = re.compile(r"\b(?:with|having|have|had)\s+(?:past\s+|any\s+|prior\s+)?violations?\b")
+
+_COUNT = re.compile(r"\bhow\s+many\b|\bcount\b|\bnumber\s+of\b|\bheadcount\b")
+_AVERAGE_VIOLATIONS = re.compile(r"\b(?:average|mean)\s+(?:number\s+of\s+)?(?:past\s+)?violations?\b")
+_GROUP_BY = re.compile(r"\b(?:by|per|for\s+each|each|breakdown\s+of)\s+(department|dept|gender)s?\b")
+
+_NEWEST = re.compile(r"\b(?:newest|latest|most\s+recent(?:ly\s+joined)?)\b")
+_OLDEST = re.compile(r"\b(?:oldest|earliest|longest[-\s]serving|most\s+senior)\b")
+_MOST_VIOLATIONS = re.compile(r"\bmost\s+violations\b")
+_LIMIT = re.compile(r"\b(?:top|first|newest|latest|oldest|earliest)\s+(\d+)\b|\b(\d+)\s+(?:employees|people|staff|hires)\b")
+
+_COMPARISONS = {
+    "==": np.equal, "!=": np.not_equal, ">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+}
+
+
+class QueryPlan:
+    """Filters, aggregate, ordering and row limit compiled from one query.
+
+    Filters are (field, op, value) triples over dept, join_date, gender and
+    past_violations, all of which must hold. Without an aggregate the plan
+    lists the matching employees.
+    """
+
+    def __init__(self):
+        self.filters = []
+        self.aggregate = None      # None, "count" or "mean"
+        self.aggregate_field = None
+        self.group_by = None
+        self.sort = None
+        self.descending = False
+        self.limit = None
+
+    def to_dict(self):
+        return {
+            "filters": [[field, op, value.isoformat() if isinstance(value, date) else value]
+                        for field, op, value in self.filters],
+            "aggregate": self.aggregate,
+            "aggregate_field": self.aggregate_field,
+            "group_by": self.group_by,
+            "sort": self.sort,
+            "descending": self.descending,
+            "limit": self.limit
+        }
+
+    def __repr__(self):
+        return f"QueryPlan({self.to_dict()!r})"
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _date_range(match):
+    # First and last day covered by a "[day] [month] year" match
+    year = int(match.group("year"))
+    month = _MONTHS.get((match.group("month") or "").lower())
+    if month is None:
+        return date(year, 1, 1), date(year, 12, 31)
+    if match.group("day"):
+        day = date(year, month, min(int(match.group("day")), calendar.monthrange(year, month)[1]))
+        return day, day
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _join_date_filters(query, as_of, new_employee_months):
+    match = _JOINED_DATE.search(query)
+    if match:
+        first, last = _date_range(match)
+        op = match.group("op")
+        if op == "after":
+            return [("join_date", ">", last)]
+        if op == "since":
+            return [("join_date", ">=", first)]
+        if op == "before":
+            return [("join_date", "<", first)]
+        return [("join_date", ">=", first), ("join_date", "<=", last)]
+
+    match = _JOINED_RECENTLY.search(query)
+    if match:
+        count = int((match.group("count") or "1").strip())
+        unit = match.group("unit")
+        if unit == "day":
+            since = as_of - timedelta(days=count)
+        elif unit == "week":
+            since = as_of - timedelta(weeks=count)
+        else:
+            since = _add_months(as_of, -count * (12 if unit == "year" else 1))
+        return [("join_date", ">=", since)]
+
+    if _NEW_EMPLOYEES.search(query):
+        return [("join_date", ">=", _add_months(as_of, -new_employee_months))]
+    return []
+
+
+def has_data_intent(query):
+    """Whether a query asks for employee data (the condition for compile_query to return a plan)."""
+    return bool(_DATA_INTENT.search(query.lower()))
+
+
+def compile_query(query, requested_dept=None, as_of=None, new_employee_months=3):
+    """Compile an approved query into a QueryPlan.
+
+    Args:
+        query (str): The user query
+        requested_dept (str): Department extracted from the query, "ALL_DEPARTMENTS" or None
+        as_of (date): Reference date for relative dates, defaults to today
+        new_employee_months (int): How recently "new employees" joined
+
+    Returns:
+        QueryPlan or None: None if the query does not ask for employee data
+    """
+    if not has_data_intent(query):
+        return None
+    query = query.lower()
+    as_of = as_of or date.today()
+    plan = QueryPlan()
+
+    if requested_dept and requested_dept != "ALL_DEPARTMENTS":
+        plan.filters.append(("dept", "==", requested_dept))
+    plan.filters.extend(_join_date_filters(query, as_of, new_employee_months))
+
+    if _FEMALE.search(query):
+        plan.filters.append(("gender", "==", "Female"))
+    elif _MALE.search(query):
+        plan.filters.append(("gender", "==", "Male"))
+
+    above, at_least = _VIOLATIONS_ABOVE.search(query), _VIOLATIONS_AT_LEAST.search(query)
+    if _NO_VIOLATIONS.search(query):
+        plan.filters.append(("past_violations", "==", 0))
+    elif above:
+        plan.filters.append(("past_violations", ">", int(above.group(1))))
+    elif at_least:
+        plan.filters.append(("past_violations", ">=", int(at_least.group(1) or at_least.group(2))))
+    elif _WITH_VIOLATIONS.search(query):
+        plan.filters.append(("past_violations", ">", 0))
+
+    if _AVERAGE_VIOLATIONS.search(query):
+        plan.aggregate, plan.aggregate_field = "mean", "past_violations"
+    elif _COUNT.search(query):
+        plan.aggregate = "count"
+    group = _GROUP_BY.search(query)
+    if group:
+        plan.group_by = "gender" if group.group(1) == "gender" else "dept"
+        plan.aggregate = plan.aggregate or "count"
+
+    if _MOST_VIOLATIONS.search(query):
+        plan.sort, plan.descending = "past_violations", True
+    elif _NEWEST.search(query):
+        plan.sort, plan.descending = "join_date", True
+    elif _OLDEST.search(query):
+        plan.sort = "join_date"
+    limit = _LIMIT.search(query)
+    if limit:
+        plan.limit = int(limit.group(1) or limit.group(2))
+    return plan
+
+
+def _column_values(store, field, value):
+    # Comparable array for a field, and the filter value in the same encoding
+    column = store.columns[field]
+    if field in ("dept", "gender"):
+        code = column.code_of(value)
+        return column.codes, -2 if code is None else code
+    if field == "join_date":
+        return column.days, (value - EPOCH).days
+    return column.values, value
+
+
+def _scan_rows(plan, store, departments):
+    # Full boolean-mask scan, for stores without secondary indexes
+    dept = store.columns["dept"]
+    scope = [code for code in (dept.code_of(name) for name in departments) if code is not None]
+    mask = np.isin(dept.codes, scope)
+    for field, op, value in plan.filters:
+        values, encoded = _column_values(store, field, value)
+        mask &= _COMPARISONS[op](values, encoded)
+        if field == "join_date":
+            mask &= values != MISSING_DAY
+    return np.flatnonzero(mask)
+
+
+def _indexed_rows(plan, store, departments):
+    # Intersect the index lookups, then check the department scope and the
+    # remaining filters on the candidates only
+    indexes = store.indexes
+    operands, residual = indexes.lookup(plan.filters)
+    if not operands:
+        # Nothing narrows the search down; a scan is as cheap as merging department rows
+        return _scan_rows(plan, store, departments)
+    rows = indexes.within_departments(intersect(*operands), departments)
+    for field, op, value in residual:
+        values, encoded = _column_values(store, field, value)
+        rows = rows[_COMPARISONS[op](values[rows], encoded)]
+    return rows
+
+
+def execute(plan, store, departments, max_rows=QUERY_MAX_ROWS):
+    """Run a plan over an EmployeeStore, restricted to the given departments.
+
+    Filters are answered from the store's secondary indexes when it has
+    them, so the work follows the size of the result rather than the store.
+
+    Args:
+        plan (QueryPlan): Compiled query
+        store (EmployeeStore): Employees to query
+        departments (iterable): Departments the user may read
+        max_rows (int): Most employees returned by a listing
+
+    Returns:
+        dict: "count", "mean" or "rows" result with the total number of matching employees
+    """
+    departments = list(departments)
+    rows = _indexed_rows(plan, store, departments) if store.indexes is not None else _scan_rows(plan, store, departments)
+    result = {"kind": plan.aggregate or "rows", "total": int(len(rows)), "departments": sorted(departments),
+              "plan": plan.to_dict()}
+
+    if plan.aggregate:
+        values = store.columns[plan.aggregate_field].values[rows] if plan.aggregate == "mean" else None
+        if plan.aggregate == "mean":
+            result["value"] = round(float(values.mean()), 3) if len(rows) else None
+        if plan.group_by:
+            column = store.columns[plan.group_by]
+            codes = column.codes[rows].astype(np.int64)
+            present = codes >= 0
+            counts = np.bincount(codes[present], minlength=len(column.categories))
+            groups = {column.categories[code]: int(count) for code, count in enumerate(counts) if count}
+            if plan.aggregate == "mean":
+                sums = np.bincount(codes[present], weights=values[present], minlength=len(column.categories))
+                groups = {column.categories[code]: round(float(sums[code] / count), 3)
+                          for code, count in enumerate(counts) if count}
+            result["groups"] = groups
+        return result
+
+    if plan.sort:
+        keys = store.columns[plan.sort]
+        keys = (keys.days if plan.sort == "join_date" else keys.values)[rows].astype(np.int64)
+        # Stable sort keeps id order among ties; missing dates sort last either way
+        if plan.sort == "join_date":
+            keys = np.where(keys == MISSING_DAY, np.iinfo(np.int64).min if plan.descending else np.iinfo(np.int64).max,
+                            keys)
+        order = np.argsort(-keys if plan.descending else keys, kind="stable")
+        rows = rows[order]
+    budget = min(plan.limit or max_rows, max_rows)
+    record_rows = rows[:budget]
+    records = (store.record(int(row)) for row in record_rows)
+    result["rows"] = [{field: record[field] for field in RESULT_FIELDS} for record in records]
+    result["returned"] = len(record_rows)
+    result["truncated"] = len(rows) > len(record_rows)
+    return result
+
+
+def answer(query, requested_dept, authorized, directory, max_rows=QUERY_MAX_ROWS, new_employee_months=3):
+    """Compile and run an approved query against the employee directory.
+
+    Args:
+        query (str): The approved user query
+        requested_dept (str): Department the query was approved for, "ALL_DEPARTMENTS" or ""
+        authorized (callable): Predicate telling whether a department's data may be read
+        directory: Employee directory (see directory.get_directory)
+
+    Returns:
+        dict or None: Query result, None if the query does not ask for employee data
+    """
+    plan = compile_query(query, requested_dept, new_employee_months=new_employee_months)
+    if plan is None:
+        return None
+    departments = [dept for dept in directory.departments() if authorized(dept)]
+    with metrics.stage("query_execution"):
+        result = execute(plan, directory.scan_store(departments), departments, max_rows)
+    logger.info("Query plan %s matched %s employees in %s", plan.to_dict(), result["total"], departments)
+    return result
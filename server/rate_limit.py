@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import tenants
+
+logger = logging.getLogger(__name__)
+
+# Rate limiting configuration (overridable through environment variables)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Default bucket: refill rate in requests per second and burst size
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "0.5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+# Per-department overrides, e.g. '{"Human Resources": {"rate": 2, "burst": 30}}'
+DEPARTMENT_RATE_LIMITS = {
+    "Human Resources": {"rate": 1.0, "burst": 20},
+}
+DEPARTMENT_RATE_LIMITS.update(json.loads(os.getenv("RATE_LIMIT_DEPARTMENTS", "{}")))
+
+# Abuse detection: rejected/unauthorized and high-risk queries per user over a sliding window
+ABUSE_WINDOW_SECONDS = float(os.getenv("ABUSE_WINDOW_SECONDS", "300"))
+ABUSE_REJECTED_THRESHOLD = int(os.getenv("ABUSE_REJECTED_THRESHOLD", "5"))
+ABUSE_HIGH_RISK_THRESHOLD = int(os.getenv("ABUSE_HIGH_RISK_THRESHOLD", "3"))
+HIGH_RISK_SCORE = 0.5
+
+# Memory bounds: idle users are evicted, and the table never exceeds the maximum
+RATE_LIMIT_IDLE_SECONDS = float(os.getenv("RATE_LIMIT_IDLE_SECONDS", "900"))
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "100000"))
+
+WINDOW_SLOTS = 10
+
+
+class SlidingWindowCounter:
+    """Approximate sliding-window event counter in constant memory and time.
+
+    The window is split into WINDOW_SLOTS slots; a slot is reset when the
+    clock comes back around to it, so counts age out one slot at a time.
+    """
+
+    __slots__ = ("slot_seconds", "counts", "epochs")
+
+    def __init__(self, window_seconds=ABUSE_WINDOW_SECONDS):
+        self.slot_seconds = window_seconds / WINDOW_SLOTS
+        self.counts = [0] * WINDOW_SLOTS
+        self.epochs = [-1] * WINDOW_SLOTS
+
+    def add(self, now, amount=1):
+        epoch = int(now / self.slot_seconds)
+        slot = epoch % WINDOW_SLOTS
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.counts[slot] = 0
+        self.counts[slot] += amount
+
+    def total(self, now):
+        oldest = int(now / self.slot_seconds) - WINDOW_SLOTS
+        return sum(count for count, epoch in zip(self.counts, self.epochs) if epoch > oldest)
+
+
+class _UserState:
+    __slots__ = ("tokens", "updated", "rejected", "high_risk")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+        self.rejected = SlidingWindowCounter()
+        self.high_risk = SlidingWindowCounter()
+
+
+class RateLimiter:
+    """Per-user token buckets and abuse windows, held in memory.
+
+    Users are kept in LRU order; users idle for RATE_LIMIT_IDLE_SECONDS are
+    evicted (their bucket would be full again anyway) and the table is capped
+    at RATE_LIMIT_MAX_USERS entries. Users are keyed by tenant and user id
+    (see tenants.scoped), so tenants never share a bucket.
+    """
+
+    def __init__(self, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST, department_limits=None,
+                 idle_seconds=RATE_LIMIT_IDLE_SECONDS, max_users=RATE_LIMIT_MAX_USERS):
+        self.default_limit = (rate, burst)
+        self.department_limits = {
+            dept: (float(limit.get("rate", rate)), float(limit.get("burst", burst)))
+            for dept, limit in (department_limits if department_limits is not None else DEPARTMENT_RATE_LIMITS).items()
+        }
+        self.idle_seconds = idle_seconds
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"allowed": 0, "limited": 0, "escalated": 0, "evicted": 0}
+
+    def _state(self, user_id, burst, now):
+        state = self._users.get(user_id)
+        if state is None:
+            state = _UserState(burst, now)
+            self._users[user_id] = state
+            self._evict(now)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _evict(self, now):
+        # Oldest entries first; stop at the first user that is still active
+        while self._users:
+            user_id, state = next(iter(self._users.items()))
+            if len(self._users) <= self.max_users and now - state.updated < self.idle_seconds:
+                break
+            del self._users[user_id]
+            self.stats["evicted"] += 1
+
+    def acquire(self, user_id, department=None):
+        """Take one token from the user's bucket.
+
+        Returns:
+            bool: True if the request may proceed
+            float: Seconds until a token is available (0 if allowed)
+        """
+        rate, burst = self.department_limits.get(department, self.default_limit)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(tenants.scoped(user_id), burst, now)
+            state.tokens = min(burst, state.tokens + (now - state.updated) * rate)
+            state.updated = now
+            if state.tokens >= 1:
+                state.tokens -= 1
+                self.stats["allowed"] += 1
+                return True, 0.0
+            self.stats["limited"] += 1
+        metrics.RATE_LIMIT_EVENTS.inc("limited")
+        return False, (1 - state.tokens) / rate if rate > 0 else float("inf")
+
+    def abuse_signals(self, user_id):
+        """Recent rejections and high-risk queries of a user, if they indicate probing.
+
+        Returns:
+            dict or None: Window counts when a threshold is reached, otherwise None
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._users.get(tenants.scoped(user_id))
+            if state is None:
+                return None
+            rejected, high_risk = state.rejected.total(now), state.high_risk.total(now)
+        if rejected < ABUSE_REJECTED_THRESHOLD and high_risk < ABUSE_HIGH_RISK_THRESHOLD:
+            return None
+        self.stats["escalated"] += 1
+        metrics.RATE_LIMIT_EVENTS.inc("escalated")
+        return {"rejected": rejected, "high_risk": high_risk, "window_seconds": ABUSE_WINDOW_SECONDS}
+
+    def record_outcome(self, user_id, status, security_risk=None):
+        """Feed a request outcome into the user's abuse windows."""
+        rejected = status in ("rejected", "unauthorized")
+        high_risk = security_risk is not None and security_risk >= HIGH_RISK_SCORE
+        if not (rejected or high_risk):
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._users.get(tenants.scoped(user_id))
+            if state is None:
+                return
+            if rejected:
+                state.rejected.add(now)
+            if high_risk:
+                state.high_risk.add(now)
+
+    @property
+    def tracked_users(self):
+        return len(self._users)
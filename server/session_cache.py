@@ -0,0 +1,171 @@
+"""Per-user session context for multi-turn chat.
+
+The chat front end sends follow-up questions from the same user every few
+seconds. A session keeps what earlier turns resolved: the employee record
+with the authorization inputs of the user's risk profile (violations from
+the data export, join date, IP address), the last department a query was
+approved for and the most recent classification results. Follow-ups that
+ask for employee data without naming a department continue that
+department ("and which employees joined in 2023?") and still go through
+check_authorization; other questions (policies, say) are never turned
+into department requests.
+
+Sessions are keyed by tenant, user and optional conversation id. They
+expire SESSION_TTL_SECONDS after their last turn, and the least recently
+used ones are evicted once the cache holds SESSION_CACHE_MAX_MB. A session
+also remembers the generation of the directory its record was read from
+and is dropped once the directory changed (a reload, an upload or a tenant
+directory loaded again after eviction).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import tenants
+
+# Session cache configuration (overridable through environment variables)
+SESSION_CACHE_ENABLED = os.getenv("SESSION_CACHE_ENABLED", "true").lower() == "true"
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "300"))
+SESSION_CACHE_MAX_MB = float(os.getenv("SESSION_CACHE_MAX_MB", "64"))
+# Classification results kept per session
+SESSION_RECENT_RESULTS = int(os.getenv("SESSION_RECENT_RESULTS", "8"))
+
+# Estimated sizes counted against the memory cap: a session with its
+# employee record, and a classification result besides its query and scores
+SESSION_BYTES = 2048
+RESULT_BYTES = 256
+SCORE_BYTES = 96
+
+
+def _result_bytes(query, result):
+    scores = result[3] if len(result) > 3 and result[3] else ()
+    return RESULT_BYTES + len(query) + SCORE_BYTES * len(scores)
+
+
+class Session:
+    """What earlier turns of a conversation resolved."""
+
+    __slots__ = ("key", "user", "generation", "last_dept", "results", "updated", "nbytes")
+
+    def __init__(self, key, user, generation, now):
+        self.key = key
+        self.user = user
+        self.generation = generation
+        self.last_dept = None
+        self.results = OrderedDict()
+        self.updated = now
+        self.nbytes = SESSION_BYTES
+
+    def classification(self, query):
+        """Classification result of an earlier turn with the same query, or None."""
+        result = self.results.get(query)
+        metrics.CACHE_REQUESTS.inc("session_classification", "hit" if result is not None else "miss")
+        if result is not None:
+            metrics.trace_rule("session_classification")
+        return result
+
+
+class SessionCache:
+    """Sessions in LRU order, expired after a TTL and capped in memory."""
+
+    def __init__(self, ttl_seconds=SESSION_TTL_SECONDS, max_mb=SESSION_CACHE_MAX_MB,
+                 recent_results=SESSION_RECENT_RESULTS):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_mb * 1e6
+        self.recent_results = recent_results
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stale": 0, "evicted": 0}
+
+    @staticmethod
+    def key(user_id, conversation_id=None):
+        return tenants.scoped(str(user_id)) + (conversation_id,)
+
+    def get(self, user_id, conversation_id=None, generation=None):
+        """The live session of a user and conversation, or None.
+
+        ``generation`` is the directory's current one; sessions started on
+        another generation hold outdated records and are dropped.
+        """
+        key = self.key(user_id, conversation_id)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and now - session.updated >= self.ttl_seconds:
+                self._remove(key)
+                self.stats["expired"] += 1
+                session = None
+            elif session is not None and session.generation != generation:
+                self._remove(key)
+                self.stats["stale"] += 1
+                session = None
+            if session is None:
+                self.stats["misses"] += 1
+            else:
+                session.updated = now
+                self._sessions.move_to_end(key)
+                self.stats["hits"] += 1
+        metrics.CACHE_REQUESTS.inc("session", "hit" if session is not None else "miss")
+        return session
+
+    def start(self, user_id, conversation_id, user, generation=None):
+        """Open (or replace) the session of a user and conversation with their record from that directory generation."""
+        key = self.key(user_id, conversation_id)
+        now = time.monotonic()
+        session = Session(key, dict(user), generation, now)
+        with self._lock:
+            if key in self._sessions:
+                self._remove(key)
+            self._sessions[key] = session
+            self.nbytes += session.nbytes
+            self._evict(now)
+        return session
+
+    def remember_classification(self, session, query, result):
+        with self._lock:
+            previous = session.results.pop(query, None)
+            if previous is not None:
+                self._resize(session, -_result_bytes(query, previous))
+            session.results[query] = result
+            self._resize(session, _result_bytes(query, result))
+            while len(session.results) > self.recent_results:
+                oldest, dropped = session.results.popitem(last=False)
+                self._resize(session, -_result_bytes(oldest, dropped))
+            self._evict(time.monotonic())
+
+    def remember_department(self, session, dept):
+        """Let follow-ups continue a department the session's last approved query requested."""
+        session.last_dept = dept
+
+    def clear(self):
+        """Drop every session."""
+        with self._lock:
+            self._sessions.clear()
+            self.nbytes = 0
+
+    def _resize(self, session, delta):
+        # Only sessions still in the cache count towards its size
+        session.nbytes += delta
+        if self._sessions.get(session.key) is session:
+            self.nbytes += delta
+
+    def _remove(self, key):
+        self.nbytes -= self._sessions.pop(key).nbytes
+
+    def _evict(self, now):
+        # Oldest entries first; stop at the first session that is live and within the cap
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if self.nbytes <= self.max_bytes and now - session.updated < self.ttl_seconds:
+                break
+            expired = now - session.updated >= self.ttl_seconds
+            self._remove(key)
+            self.stats["expired" if expired else "evicted"] += 1
+
+    @property
+    def sessions(self):
+        return len(self._sessions)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Binary snapshots of the employee directory.
+
+A snapshot holds the arrays of an EmployeeStore in one file: a fixed
+header, a JSON table of contents and the raw arrays, each aligned to 64
+bytes. Loading memory-maps the file read-only and wraps the arrays without
+copying, so load time does not depend on the directory size and every
+process mapping the same snapshot shares its pages.
+
+When the store has them, its secondary indexes are saved as arrays too
+and its dashboard aggregates in the table of contents, so a loaded
+snapshot is ready to serve without rebuilding either. Snapshots without
+them still load; the directory then builds them.
+
+Usage:
+    python snapshot.py MOCK_DATA.csv MOCK_DATA.csv.snap
+"""
+
+import argparse
+import json
+import os
+import struct
+import time
+from collections import Counter
+
+import numpy as np
+
+from aggregates import DepartmentAggregates
+from employee_store import (CategoryColumn, DateColumn, EmployeeStore, IntColumn, IPv4Column,
+                            StringColumn)
+from indexes import Bitmap, BitmapIndex, DirectoryIndexes, SortedIndex, ValueIndex
+
+MAGIC = b"DXEMPSNP"
+SNAPSHOT_VERSION = 1
+# Magic, format version, table of contents length
+HEADER = struct.Struct("<8sII")
+ALIGNMENT = 64
+
+
+class SnapshotError(ValueError):
+    """Raised for files that are not snapshots or have another format version."""
+
+
+def _column_arrays(name, column):
+    # (array name, array) pairs plus the column's non-array metadata
+    if isinstance(column, StringColumn):
+        return [(f"{name}.heap", column.heap), (f"{name}.offsets", column.offsets)], {"type": "string"}
+    if isinstance(column, CategoryColumn):
+        return [(f"{name}.codes", column.codes)], {"type": "category", "categories": column.categories}
+    if isinstance(column, IPv4Column):
+        return ([(f"{name}.packed", column.packed), (f"{name}.valid", column.valid)],
+                {"type": "ipv4", "other": {str(row): value for row, value in column.other.items()}})
+    if isinstance(column, DateColumn):
+        return [(f"{name}.days", column.days)], {"type": "date"}
+    return [(f"{name}.values", column.values)], {"type": "int"}
+
+
+def _index_arrays(indexes):
+    # (array name, array) pairs of DirectoryIndexes; the per-value row arrays
+    # and bitmaps are concatenated and split again by code on load
+    dept_codes = sorted(indexes.dept.rows_by_code)
+    dept_rows = [indexes.dept.rows_by_code[code].astype(np.int64) for code in dept_codes]
+    gender_codes = sorted(indexes.gender.bitmaps)
+    gender_bits = [indexes.gender.bitmaps[code].bits for code in gender_codes]
+    return [
+        ("indexes.dept.codes", np.array(dept_codes, dtype=np.int32)),
+        ("indexes.dept.offsets", np.cumsum([0] + [len(rows) for rows in dept_rows], dtype=np.int64)),
+        ("indexes.dept.rows", np.concatenate(dept_rows) if dept_rows else np.empty(0, dtype=np.int64)),
+        ("indexes.join_date.keys", indexes.join_date.keys),
+        ("indexes.join_date.order", indexes.join_date.order),
+        ("indexes.gender.codes", np.array(gender_codes, dtype=np.int32)),
+        ("indexes.gender.bits", np.concatenate(gender_bits) if gender_bits else np.empty(0, dtype=np.uint8)),
+    ]
+
+
+def _load_indexes(array, columns, rows):
+    dept_codes = array("indexes.dept.codes").tolist()
+    offsets = array("indexes.dept.offsets")
+    dept_rows = array("indexes.dept.rows")
+    dept = ValueIndex({code: dept_rows[offsets[i]:offsets[i + 1]] for i, code in enumerate(dept_codes)},
+                      columns["dept"])
+    join_date = SortedIndex(array("indexes.join_date.keys"), array("indexes.join_date.order"))
+    width = (rows + 7) // 8
+    bits = array("indexes.gender.bits")
+    gender = BitmapIndex({code: Bitmap(bits[i * width:(i + 1) * width], rows)
+                          for i, code in enumerate(array("indexes.gender.codes").tolist())}, columns["gender"])
+    return DirectoryIndexes(dept, join_date, gender, columns["join_date"].days)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(store, path, source=None):
+    """Write a store to a snapshot file (atomically, via a temporary file)."""
+    arrays, columns = [], {}
+    for name, column in store.columns.items():
+        column_arrays, columns[name] = _column_arrays(name, column)
+        arrays.extend(column_arrays)
+    if store.dense_index is not None:
+        arrays.append(("index", store.dense_index))
+    if store.indexes is not None:
+        arrays.extend(_index_arrays(store.indexes))
+    aggregates = None
+    if store.aggregates is not None:
+        aggregates = [[dept, breakdown, key, int(count)] for (dept, breakdown, key), count in store.aggregates.counts.items()]
+
+    # Array offsets are relative to the (aligned) end of the table of contents
+    table, offset = {}, 0
+    for name, array in arrays:
+        offset = _align(offset)
+        table[name] = {"dtype": array.dtype.str, "count": int(array.size), "offset": offset}
+        offset += array.nbytes
+    toc = json.dumps({"rows": len(store), "columns": columns, "arrays": table, "aggregates": aggregates,
+                      "source": source, "created": time.time()}).encode("utf-8")
+    data_start = _align(HEADER.size + len(toc))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(toc)))
+        f.write(toc)
+        for name, array in arrays:
+            f.seek(data_start + table[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    """Memory-map a snapshot and return an EmployeeStore backed by it."""
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(mapped) < HEADER.size:
+        raise SnapshotError(f"{path} is not an employee snapshot")
+    magic, version, toc_length = HEADER.unpack(mapped[:HEADER.size].tobytes())
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not an employee snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"{path} has snapshot version {version}, expected {SNAPSHOT_VERSION}")
+    toc = json.loads(mapped[HEADER.size:HEADER.size + toc_length].tobytes())
+    data_start = _align(HEADER.size + toc_length)
+
+    def array(name):
+        entry = toc["arrays"][name]
+        return np.frombuffer(mapped, dtype=np.dtype(entry["dtype"]), count=entry["count"],
+                             offset=data_start + entry["offset"])
+
+    columns = {}
+    for name, meta in toc["columns"].items():
+        kind = meta["type"]
+        if kind == "string":
+            columns[name] = StringColumn(array(f"{name}.heap"), array(f"{name}.offsets"))
+        elif kind == "category":
+            columns[name] = CategoryColumn(array(f"{name}.codes"), meta["categories"])
+        elif kind == "ipv4":
+            other = {int(row): value for row, value in meta["other"].items()}
+            columns[name] = IPv4Column(array(f"{name}.packed"), array(f"{name}.valid"), other)
+        elif kind == "date":
+            columns[name] = DateColumn(array(f"{name}.days"))
+        else:
+            columns[name] = IntColumn(array(f"{name}.values"))
+    dense_index = array("index") if "index" in toc["arrays"] else None
+    store = EmployeeStore(columns, dense_index=dense_index)
+    if "indexes.dept.rows" in toc["arrays"]:
+        store.indexes = _load_indexes(array, columns, toc["rows"])
+    if toc.get("aggregates") is not None:
+        store.aggregates = DepartmentAggregates(Counter({(dept, breakdown, key): count
+                                                         for dept, breakdown, key, count in toc["aggregates"]}))
+    return store
+
+
+def build_snapshot(csv_path, snapshot_path):
+    """Convert an employee CSV into a snapshot, with its indexes and aggregates."""
+    store = EmployeeStore.from_csv(csv_path)
+    store.indexes = DirectoryIndexes.build(store)
+    store.aggregates = DepartmentAggregates.from_store(store)
+    write_snapshot(store, snapshot_path, source={"path": os.path.abspath(csv_path),
+                                                 "mtime": os.path.getmtime(csv_path)})
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a binary snapshot of the employee directory")
+    parser.add_argument("csv", nargs="?", default="MOCK_DATA.csv", help="Employee CSV")
+    parser.add_argument("snapshot", nargs="?", help="Output path (default: <csv>.snap)")
+    args = parser.parse_args()
+
+    snapshot_path = args.snapshot or args.csv + ".snap"
+    start = time.perf_counter()
+    store = build_snapshot(args.csv, snapshot_path)
+    print(f"Wrote {len(store)} employees to {snapshot_path} ({os.path.getsize(snapshot_path) / 1e6:.1f} MB) "
+          f"in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""SQLite backend for the employee directory.
+
+Employees live in an indexed SQLite table (WAL mode, so readers never
+block on the importer or other writers) and are read through a small
+thread-safe connection pool.
+
+Usage:
+    python sqlite_directory.py MOCK_DATA.csv --db employees.db
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import pandas as pd
+
+from aggregates import DepartmentAggregates, grouped_counts, record_counts
+from employee_store import EmployeeStore
+
+logger = logging.getLogger(__name__)
+
+# SQLite directory configuration (overridable through environment variables)
+SQLITE_DIRECTORY_PATH = os.getenv("SQLITE_DIRECTORY_PATH", "employees.db")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+
+IMPORT_CHUNK_ROWS = 50_000
+
+COLUMNS = ("id", "first_name", "last_name", "email", "gender", "ip_address", "dept", "profile_url",
+           "join_date", "past_violations")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS employees (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT,
+    last_name TEXT,
+    email TEXT,
+    gender TEXT,
+    ip_address TEXT,
+    dept TEXT,
+    profile_url TEXT,
+    join_date TEXT,
+    past_violations INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS employees_dept ON employees (dept);
+CREATE INDEX IF NOT EXISTS employees_join_date ON employees (join_date);
+CREATE INDEX IF NOT EXISTS employees_email ON employees (email);
+"""
+
+# Statements are kept as constants so each pooled connection compiles them
+# once and reuses them from its prepared statement cache
+SELECT_BY_ID = "SELECT * FROM employees WHERE id = ?"
+SELECT_BY_DEPT = "SELECT * FROM employees WHERE dept = ? ORDER BY id"
+SELECT_BY_DEPT_LIMIT = "SELECT * FROM employees WHERE dept = ? ORDER BY id LIMIT ?"
+SELECT_BY_DEPT_AFTER = "SELECT * FROM employees WHERE dept = ? AND id > ? ORDER BY id LIMIT ?"
+SELECT_DEPARTMENTS = "SELECT DISTINCT dept FROM employees WHERE dept IS NOT NULL"
+COUNT_ALL = "SELECT COUNT(*) FROM employees"
+COUNT_BY_DEPT = "SELECT dept, COUNT(*) AS employees FROM employees GROUP BY dept"
+# (dept, breakdown, key, employees) rows for aggregates.grouped_counts
+AGGREGATE_COUNTS = """
+SELECT dept, NULL, NULL, COUNT(*) FROM employees GROUP BY dept
+UNION ALL SELECT dept, 'gender', gender, COUNT(*) FROM employees GROUP BY dept, gender
+UNION ALL SELECT dept, 'joins_by_month', substr(join_date, 1, 7), COUNT(*) FROM employees GROUP BY 1, 3
+UNION ALL SELECT dept, 'violations', past_violations, COUNT(*) FROM employees GROUP BY dept, past_violations
+"""
+# Aggregated fields of the employees with the ids in a JSON array
+SELECT_AGGREGATE_FIELDS = ("SELECT dept, gender, join_date, past_violations FROM employees "
+                           "WHERE id IN (SELECT value FROM json_each(?))")
+UPSERT = (f"INSERT INTO employees ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+          f"ON CONFLICT(id) DO UPDATE SET "
+          + ", ".join(f"{c} = excluded.{c}" for c in COLUMNS[1:]))
+
+
+def _employee_row(cursor, row):
+    # Rows come back as dicts shaped like get_user_by_id's, with join_date as a date
+    record = {description[0]: value for description, value in zip(cursor.description, row)}
+    if record.get("join_date"):
+        record["join_date"] = date.fromisoformat(record["join_date"])
+    return record
+
+
+def connect(path, readonly=False):
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False, cached_statements=128)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def ensure_schema(path):
+    conn = connect(path)
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections shared by request threads."""
+
+    def __init__(self, path, size=SQLITE_POOL_SIZE, readonly=True):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.stats = {"checkouts": 0, "waits": 0}
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def _checkout(self):
+        self.stats["checkouts"] += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                conn = connect(self.path, readonly=self.readonly)
+                conn.row_factory = _employee_row
+                return conn
+        self.stats["waits"] += 1
+        return self._idle.get()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SQLiteDirectory:
+    """Employee directory served by indexed SQLite queries."""
+
+    def __init__(self, path=SQLITE_DIRECTORY_PATH, pool_size=SQLITE_POOL_SIZE):
+        self.path = path
+        ensure_schema(path)
+        self.pool = ConnectionPool(path, pool_size)
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._aggregates = None
+        self._data_version = None
+        self._upserts = 0
+
+    @property
+    def stats(self):
+        return dict(self.pool.stats, backend="sqlite", path=self.path)
+
+    @property
+    def generation(self):
+        """Changes with every upsert through this directory and every commit by another connection."""
+        with self._write_lock:
+            version = self._writer_connection().execute("PRAGMA data_version").fetchone()[0]
+            return self._upserts, version
+
+    def get(self, user_id):
+        """Employee record by id, or None."""
+        try:
+            user_id = int(user_id)
+        except (ValueError, TypeError):
+            return None
+        with self.pool.connection() as conn:
+            return conn.execute(SELECT_BY_ID, (user_id,)).fetchone()
+
+    def list_department(self, dept, limit=None):
+        """Employees of a department, by id."""
+        with self.pool.connection() as conn:
+            if limit is None:
+                return conn.execute(SELECT_BY_DEPT, (dept,)).fetchall()
+            return conn.execute(SELECT_BY_DEPT_LIMIT, (dept, limit)).fetchall()
+
+    def department_page(self, dept, after=None, limit=100):
+        """Keyset page of a department's employees by id, read through the dept index.
+
+        Returns:
+            list: Up to ``limit`` records with an id above ``after`` (from the start if None)
+            int: Key to pass as ``after`` for the next page, None if the page is empty
+        """
+        with self.pool.connection() as conn:
+            if after is None:
+                records = conn.execute(SELECT_BY_DEPT_LIMIT, (dept, limit)).fetchall()
+            else:
+                records = conn.execute(SELECT_BY_DEPT_AFTER, (dept, after, limit)).fetchall()
+        return records, records[-1]["id"] if records else None
+
+    def departments(self):
+        with self.pool.connection() as conn:
+            return [row["dept"] for row in conn.execute(SELECT_DEPARTMENTS)]
+
+    def scan_store(self, departments):
+        """Columnar store of the employees of these departments, read through the dept index."""
+        departments = list(departments)
+        placeholders = ", ".join("?" * len(departments))
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT * FROM employees WHERE dept IN ({placeholders}) ORDER BY id",
+                                departments).fetchall() if departments else []
+        frame = pd.DataFrame(rows, columns=list(COLUMNS))
+        frame["join_date"] = pd.to_datetime(frame["join_date"])
+        return EmployeeStore.from_dataframe(frame)
+
+    def department_counts(self):
+        with self.pool.connection() as conn:
+            return {row["dept"]: row["employees"] for row in conn.execute(COUNT_BY_DEPT)}
+
+    def _writer_connection(self):
+        # Callers hold _write_lock
+        if self._writer is None:
+            self._writer = connect(self.path)
+        return self._writer
+
+    def upsert(self, frame):
+        """Insert or replace employees by id in one transaction; returns (inserted, updated).
+
+        Loaded aggregates are adjusted by the replaced and written rows.
+        """
+        with self._write_lock:
+            conn = self._writer_connection()
+            self._upserts += 1
+            if self._aggregates is None:
+                return upsert_frame(conn, frame)
+            ids = json.dumps(pd.to_numeric(frame["id"]).astype(int).tolist())
+            replaced = conn.execute(SELECT_AGGREGATE_FIELDS, (ids,)).fetchall()
+            inserted, updated = upsert_frame(conn, frame)
+            written = conn.execute(SELECT_AGGREGATE_FIELDS, (ids,)).fetchall()
+            self._aggregates = self._aggregates.updated(record_counts(replaced), record_counts(written))
+            return inserted, updated
+
+    def aggregates(self):
+        """DepartmentAggregates of the table.
+
+        They are computed with GROUP BY queries on first use and recomputed
+        only when another connection (e.g. the CSV importer) has committed
+        since; upserts through this directory adjust them instead.
+        """
+        if not self._write_lock.acquire(blocking=self._aggregates is None):
+            # An upsert is running and adjusts the aggregates when it commits
+            return self._aggregates
+        try:
+            conn = self._writer_connection()
+            # data_version only changes on commits by other connections
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._aggregates is None or version != self._data_version:
+                self._aggregates = DepartmentAggregates(grouped_counts(conn.execute(AGGREGATE_COUNTS)))
+                self._data_version = version
+            return self._aggregates
+        finally:
+            self._write_lock.release()
+
+    def persist(self):
+        # Upserts are committed as they are applied
+        pass
+
+
+def _import_rows(chunk):
+    chunk = chunk.reindex(columns=list(COLUMNS))
+    join_dates = pd.to_datetime(chunk["join_date"], format="%d/%m/%Y", errors="coerce")
+    chunk["join_date"] = join_dates.dt.strftime("%Y-%m-%d").where(join_dates.notna(), None)
+    chunk["past_violations"] = pd.to_numeric(chunk["past_violations"], errors="coerce").fillna(0).astype(int)
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    return list(chunk.itertuples(index=False, name=None))
+
+
+def upsert_frame(conn, frame):
+    """Upsert a DataFrame of employees in one transaction; returns (inserted, updated)."""
+    with conn:
+        before = conn.execute(COUNT_ALL).fetchone()[0]
+        conn.executemany(UPSERT, _import_rows(frame))
+        inserted = conn.execute(COUNT_ALL).fetchone()[0] - before
+    return inserted, len(frame) - inserted
+
+
+def import_csv(csv_path, db_path=SQLITE_DIRECTORY_PATH, chunk_rows=IMPORT_CHUNK_ROWS):
+    """Upsert an employee CSV into the SQLite directory, one transaction per chunk.
+
+    Returns:
+        int: Number of rows imported
+    """
+    ensure_schema(db_path)
+    conn = connect(db_path)
+    imported = 0
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_rows, dtype={"join_date": str}):
+            upsert_frame(conn, chunk)
+            imported += len(chunk)
+            logger.info("Imported %s employees", imported)
+    finally:
+        conn.close()
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import an employee CSV into the SQLite directory")
+    parser.add_argument("csv", nargs="?", default="MOCK_DATA.csv", help="Employee CSV")
+    parser.add_argument("--db", default=SQLITE_DIRECTORY_PATH, help="SQLite database path")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    imported = import_csv(args.csv, args.db)
+    print(f"Imported {imported} employees into {args.db} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
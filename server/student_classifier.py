@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Distilled first-tier classifier for is_corporate_related.
+
+The student is a TF-IDF + logistic regression model trained on the
+decisions of the BART-based is_corporate_related over a historical query
+corpus. It answers queries on its own when its calibrated confidence clears
+the cascade thresholds and defers to the teacher otherwise.
+
+The decision and the topic label come from two models. A label the teacher
+never gave together with the predicted decision (a corporate decision with
+"entertainment topic", say) is a conflict, and the query goes to the
+teacher as well.
+
+Usage:
+    python student_classifier.py --corpus queries.txt --output student_model.joblib
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = os.getenv("STUDENT_MODEL_PATH", "student_model.joblib")
+
+# Agreement with the teacher the default thresholds are tuned for
+DEFAULT_TARGET_AGREEMENT = 0.99
+
+
+def load_corpus(corpus_path):
+    """Load historical queries from a text file (one per line) or a CSV with a 'query' column."""
+    if corpus_path.endswith(".csv"):
+        queries = pd.read_csv(corpus_path)["query"].dropna().astype(str).tolist()
+    else:
+        with open(corpus_path, encoding="utf-8") as f:
+            queries = [line.strip() for line in f]
+    # Duplicates would leak between the train and holdout splits
+    return list(dict.fromkeys(q for q in queries if q))
+
+
+def label_corpus(queries, classifier):
+    """Run the teacher over the corpus and collect its decisions."""
+    from main_model import is_corporate_related
+
+    records = []
+    for i, query in enumerate(queries):
+        is_corporate, label, confidence, _ = is_corporate_related(query, classifier)
+        records.append({
+            "query": query,
+            "is_corporate": bool(is_corporate),
+            "label": label,
+            "confidence": float(confidence)
+        })
+        if (i + 1) % 500 == 0:
+            logger.info("Labelled %s/%s queries", i + 1, len(queries))
+    return pd.DataFrame(records)
+
+
+def _build_features():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.pipeline import FeatureUnion
+
+    return FeatureUnion([
+        ("words", TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, min_df=1)),
+        ("chars", TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5), sublinear_tf=True, min_df=2))
+    ])
+
+
+def train_student(labelled):
+    """Train the decision and label models on teacher-labelled data.
+
+    Returns:
+        dict: The fitted ``decision`` pipeline (calibrated P(corporate)),
+            ``label`` pipeline (teacher's predicted label), the decisions the
+            teacher gave with each label and a default label per decision
+    """
+    from sklearn.calibration import CalibratedClassifierCV
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+
+    decision_counts = labelled["is_corporate"].value_counts()
+    if len(decision_counts) < 2:
+        raise ValueError("Corpus must contain both corporate and non-corporate decisions")
+
+    base = LogisticRegression(C=4.0, max_iter=2000, class_weight="balanced")
+    if decision_counts.min() >= 10:
+        # Sigmoid calibration keeps the confidence usable as a cascade threshold
+        estimator = CalibratedClassifierCV(base, method="sigmoid", cv=3)
+    else:
+        estimator = base
+    decision_model = make_pipeline(_build_features(), estimator)
+    decision_model.fit(labelled["query"], labelled["is_corporate"])
+
+    label_model = None
+    if labelled["label"].nunique() > 1:
+        label_model = make_pipeline(_build_features(), LogisticRegression(C=4.0, max_iter=2000))
+        label_model.fit(labelled["query"], labelled["label"])
+
+    label_decisions = labelled.groupby("label")["is_corporate"].unique()
+    return {
+        "decision": decision_model,
+        "label": label_model,
+        "label_decisions": {label: sorted(bool(d) for d in decisions) for label, decisions in label_decisions.items()},
+        "default_labels": {bool(decision): group["label"].mode().iloc[0]
+                           for decision, group in labelled.groupby("is_corporate")}
+    }
+
+
+def measure_agreement(models, holdout, thresholds=None):
+    """Measure student/teacher agreement and coverage for a grid of thresholds.
+
+    A threshold t means the student answers when P(corporate) >= t or
+    P(corporate) <= 1 - t and defers to the teacher otherwise.
+
+    Returns:
+        list: One dict per threshold with coverage, agreement on the covered
+            queries and overall agreement of the cascade
+    """
+    thresholds = thresholds or [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.97, 0.99]
+    proba = _corporate_proba(models["decision"], holdout["query"])
+    teacher = holdout["is_corporate"].to_numpy()
+    student = proba >= 0.5
+
+    report = []
+    for t in thresholds:
+        covered = (proba >= t) | (proba <= 1 - t)
+        coverage = float(covered.mean()) if len(covered) else 0.0
+        agree_covered = float((student[covered] == teacher[covered]).mean()) if covered.any() else 1.0
+        # Deferred queries get the teacher's own answer
+        cascade = (student == teacher) | ~covered
+        report.append({
+            "threshold": t,
+            "coverage": round(coverage, 4),
+            "student_agreement": round(agree_covered, 4),
+            "cascade_agreement": round(float(cascade.mean()) if len(cascade) else 1.0, 4)
+        })
+    return report
+
+
+def choose_threshold(report, target_agreement=DEFAULT_TARGET_AGREEMENT):
+    """Pick the lowest threshold whose covered agreement meets the target."""
+    for row in sorted(report, key=lambda r: r["threshold"]):
+        if row["student_agreement"] >= target_agreement and row["coverage"] > 0:
+            return row["threshold"]
+    return 1.0
+
+
+def _corporate_proba(decision_model, queries):
+    classes = list(decision_model.classes_)
+    return decision_model.predict_proba(list(queries))[:, classes.index(True)]
+
+
+def distill(corpus_path, output_path=DEFAULT_MODEL_PATH, classifier=None, holdout_fraction=0.2,
+            target_agreement=DEFAULT_TARGET_AGREEMENT, seed=13):
+    """Label a corpus with the teacher, train the student and save it with its report."""
+    import joblib
+    from main_model import load_classifier
+
+    queries = load_corpus(corpus_path)
+    random.Random(seed).shuffle(queries)
+    logger.info("Distilling student from %s unique queries", len(queries))
+
+    labelled = label_corpus(queries, classifier or load_classifier())
+    split = int(len(labelled) * (1 - holdout_fraction))
+    train, holdout = labelled.iloc[:split], labelled.iloc[split:]
+
+    models = train_student(train)
+    report = measure_agreement(models, holdout)
+    threshold = choose_threshold(report, target_agreement)
+
+    artifact = dict(models, threshold=threshold, report=report,
+                    train_size=len(train), holdout_size=len(holdout))
+    joblib.dump(artifact, output_path)
+    with open(os.path.splitext(output_path)[0] + ".report.json", "w") as f:
+        json.dump({k: artifact[k] for k in ("threshold", "report", "train_size", "holdout_size")}, f, indent=2)
+    return artifact
+
+
+class StudentClassifier:
+    """First-tier classifier answering confident queries without the teacher."""
+
+    def __init__(self, models, threshold=None):
+        self.decision_model = models["decision"]
+        self.label_model = models.get("label")
+        self.label_decisions = models["label_decisions"]
+        self.default_labels = models["default_labels"]
+        self.threshold = float(threshold if threshold is not None else models.get("threshold", 1.0))
+        self.stats = {"answered": 0, "deferred": 0, "conflicts": 0}
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH, threshold=None):
+        import joblib
+
+        if threshold is None and os.getenv("STUDENT_THRESHOLD"):
+            threshold = float(os.getenv("STUDENT_THRESHOLD"))
+        return cls(joblib.load(path), threshold)
+
+    def predict(self, query):
+        """Classify a query if the student is confident enough.
+
+        Returns:
+            tuple or None: (is_corporate, label, confidence, scores) like
+                is_corporate_related, or None to defer to the teacher
+        """
+        p_corporate = float(_corporate_proba(self.decision_model, [query])[0])
+        is_corporate = p_corporate >= 0.5
+        confidence = p_corporate if is_corporate else 1.0 - p_corporate
+        if confidence < self.threshold:
+            self.stats["deferred"] += 1
+            return None
+
+        if self.label_model is None:
+            label = self.default_labels[is_corporate]
+        else:
+            label = self.label_model.predict([query])[0]
+            if is_corporate not in self.label_decisions.get(label, ()):
+                # The two models disagree; the teacher decides
+                self.stats["conflicts"] += 1
+                self.stats["deferred"] += 1
+                return None
+
+        self.stats["answered"] += 1
+        return is_corporate, label, confidence, {label: confidence}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill a fast student classifier from is_corporate_related")
+    parser.add_argument("--corpus", required=True, help="Text file (one query per line) or CSV with a 'query' column")
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH, help="Where to write the student model")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of the corpus held out for agreement")
+    parser.add_argument("--target-agreement", type=float, default=DEFAULT_TARGET_AGREEMENT,
+                        help="Student/teacher agreement the cascade threshold is chosen for")
+    args = parser.parse_args()
+
+    artifact = distill(args.corpus, args.output, holdout_fraction=args.holdout,
+                       target_agreement=args.target_agreement)
+
+    print("\n===== STUDENT / TEACHER AGREEMENT (holdout) =====")
+    print(f"{'threshold':>10} {'coverage':>10} {'student':>10} {'cascade':>10}")
+    for row in artifact["report"]:
+        print(f"{row['threshold']:>10.2f} {row['coverage']:>10.2%} "
+              f"{row['student_agreement']:>10.2%} {row['cascade_agreement']:>10.2%}")
+    print(f"\nChosen cascade threshold: {artifact['threshold']:.2f}")
+    print(f"Model saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
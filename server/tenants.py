@@ -0,0 +1,217 @@
+"""Tenants served by one process, each with its own employee directory and policy.
+
+Tenants are listed in a JSON file (TENANTS_CONFIG):
+
+    {"acme": {"data_path": "acme/MOCK_DATA.csv", "policy": "acme_policy.json"},
+     "globex": {"data_path": "globex.csv"}}
+
+``policy`` overrides keys of AUTHORIZATION_POLICY like a policy_simulator.py
+candidate and is loaded once at startup; tenants without one use the
+default policy. A request names its tenant with a /t/<tenant> path prefix or
+the X-Tenant-ID header and is served with that tenant's directory and
+policy, while the classifier, inference pool and caches stay shared.
+
+Directories are loaded on a tenant's first request. When the loaded
+directories exceed TENANT_MEMORY_BUDGET_MB, those of tenants without
+requests in flight and idle for TENANT_IDLE_SECONDS are evicted, least
+recently used first; the next request reloads them (from the snapshot, so
+this is cheap).
+"""
+
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Tenant configuration (overridable through environment variables)
+TENANTS_CONFIG = os.getenv("TENANTS_CONFIG", "")
+TENANT_MEMORY_BUDGET_MB = float(os.getenv("TENANT_MEMORY_BUDGET_MB", "1024"))
+TENANT_IDLE_SECONDS = float(os.getenv("TENANT_IDLE_SECONDS", "60"))
+
+TENANT_HEADER = "X-Tenant-ID"
+TENANT_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_TENANT_PATH = re.compile(r"^/t/([^/]+)(/.*)$")
+
+_current = contextvars.ContextVar("tenant", default=None)
+
+
+class Tenant:
+    """One tenant's configuration and, while loaded, its employee directory."""
+
+    def __init__(self, name, data_path, snapshot_path=None, policy=None):
+        self.name = name
+        self.data_path = data_path
+        self.snapshot_path = snapshot_path if snapshot_path is not None else data_path + ".snap"
+        self.policy = policy
+        self.active = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self._directory = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        """The tenant's EmployeeDirectory, created on first use after startup or eviction."""
+        directory = self._directory
+        if directory is None:
+            with self._lock:
+                if self._directory is None:
+                    from directory import EmployeeDirectory
+                    self._directory = EmployeeDirectory(self.data_path, snapshot_path=self.snapshot_path)
+                    self.loads += 1
+                directory = self._directory
+        return directory
+
+    @property
+    def nbytes(self):
+        directory = self._directory
+        return directory.nbytes() if directory is not None else 0
+
+    def evict(self):
+        with self._lock:
+            self._directory = None
+
+
+class TenantRegistry:
+    """The configured tenants, with per-request activation and idle eviction."""
+
+    def __init__(self, tenants, memory_budget_mb=TENANT_MEMORY_BUDGET_MB, idle_seconds=TENANT_IDLE_SECONDS):
+        self.tenants = tenants
+        self.memory_budget = memory_budget_mb * 1e6
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, path, load_policy, **kwargs):
+        """Registry of the tenants in a JSON config file; ``load_policy`` reads a tenant's policy file."""
+        with open(path) as f:
+            config = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        tenants = {}
+        for name, entry in config.items():
+            if not TENANT_NAME.match(name):
+                raise ValueError(f"Invalid tenant name: {name!r}")
+            if "data_path" not in entry:
+                raise ValueError(f"Tenant {name} has no data_path")
+            # Relative paths are relative to the config file
+            data_path = os.path.join(base, entry["data_path"])
+            snapshot_path = entry.get("snapshot_path")
+            if snapshot_path:
+                snapshot_path = os.path.join(base, snapshot_path)
+            policy = load_policy(os.path.join(base, entry["policy"])) if entry.get("policy") else None
+            tenants[name] = Tenant(name, data_path, snapshot_path, policy)
+        logger.info("Configured %s tenants: %s", len(tenants), ", ".join(sorted(tenants)))
+        return cls(tenants, **kwargs)
+
+    def get(self, name):
+        return self.tenants.get(name)
+
+    @contextmanager
+    def activate(self, tenant):
+        """Serve the enclosed code (and the tasks and threads it starts) with this tenant's data."""
+        with self._lock:
+            tenant.active += 1
+            tenant.last_used = time.monotonic()
+        token = _current.set(tenant)
+        try:
+            yield tenant
+        finally:
+            _current.reset(token)
+            with self._lock:
+                tenant.active -= 1
+                tenant.last_used = time.monotonic()
+            self.evict_idle()
+
+    def resident_bytes(self):
+        return sum(tenant.nbytes for tenant in self.tenants.values())
+
+    def evict_idle(self):
+        """Evict idle tenants' directories, least recently used first, until within the memory budget.
+
+        Returns:
+            list: Names of the evicted tenants
+        """
+        resident = self.resident_bytes()
+        if resident <= self.memory_budget:
+            return []
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            idle = sorted((tenant for tenant in self.tenants.values()
+                           if tenant.active == 0 and tenant.nbytes and now - tenant.last_used >= self.idle_seconds),
+                          key=lambda tenant: tenant.last_used)
+            for tenant in idle:
+                if resident <= self.memory_budget:
+                    break
+                resident -= tenant.nbytes
+                tenant.evict()
+                evicted.append(tenant.name)
+            self.evictions += len(evicted)
+        if evicted:
+            logger.info("Evicted the directories of idle tenants %s (%.1f MB still resident)",
+                        ", ".join(evicted), resident / 1e6)
+        return evicted
+
+    @property
+    def stats(self):
+        now = time.monotonic()
+        return {"tenants": len(self.tenants), "resident_mb": round(self.resident_bytes() / 1e6, 1),
+                "memory_budget_mb": round(self.memory_budget / 1e6, 1), "evictions": self.evictions,
+                "loaded": {name: {"active": tenant.active, "loads": tenant.loads, "mb": round(tenant.nbytes / 1e6, 1),
+                                  "idle_seconds": round(now - tenant.last_used, 1)}
+                           for name, tenant in sorted(self.tenants.items()) if tenant.nbytes}}
+
+
+def route(header, path):
+    """Tenant named by a request: a /t/<tenant> path prefix, else the X-Tenant-ID header.
+
+    Returns:
+        str or None: Tenant name, None if the request names none
+        str: The path to route, with the tenant prefix removed
+    """
+    match = _TENANT_PATH.match(path)
+    if match:
+        return match.group(1), match.group(2)
+    return (header or None), path
+
+
+_registry = None
+
+
+def configure(path, load_policy, **kwargs):
+    """Load the process-wide tenant registry from a config file."""
+    global _registry
+    _registry = TenantRegistry.from_config(path, load_policy, **kwargs)
+    return _registry
+
+
+def get_registry():
+    """The process-wide tenant registry, None when the process serves a single tenant."""
+    return _registry
+
+
+def current():
+    """Tenant of the request being served, None outside tenant requests."""
+    return _current.get()
+
+
+def scoped(user_id):
+    """Key of a user of the current tenant: (tenant name, user id), the name being None outside tenant requests.
+
+    Tenants have their own user id spaces, so per-user state is kept under this key.
+    """
+    tenant = _current.get()
+    return tenant.name if tenant is not None else None, user_id
+
+
+def current_policy():
+    """Authorization policy of the current tenant, None for the default policy."""
+    tenant = _current.get()
+    return tenant.policy if tenant is not None else None
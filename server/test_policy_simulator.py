@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+from datetime import datetime, timedelta
+
+from main_model import DEPARTMENTS, AUTHORIZATION_POLICY, check_authorization, load_user_data
+from policy_simulator import evaluate, describe, normalize_corpus, simulate
+
+def build_requests():
+    """Every user against every department, plus risky variants of the user snapshot"""
+    users = load_user_data().rename(columns={"id": "user_id", "dept": "user_dept"})
+    recent = (datetime.now() - timedelta(days=20)).strftime("%d/%m/%Y")
+    variants = [
+        users,
+        users.assign(past_violations=users["past_violations"] % 4 + 1),
+        users.assign(join_date=recent, past_violations=1),
+        users.assign(ip_address="127.0.0.1"),
+    ]
+    frames = []
+    for variant in variants:
+        for requested in DEPARTMENTS + ["ALL_DEPARTMENTS"]:
+            frames.append(variant.assign(requested_dept=requested, query=""))
+    return normalize_corpus(pd.concat(frames, ignore_index=True))
+
+def test_vectorized_matches_check_authorization():
+    """The simulator's vectorized evaluator must agree with check_authorization row by row"""
+    requests = build_requests()
+    result = evaluate(requests, AUTHORIZATION_POLICY)
+
+    mismatches = 0
+    for i, row in requests.iterrows():
+        authorized, reason = check_authorization(row["user_id"], row["user_dept"], row["requested_dept"], row.to_dict())
+        simulated = describe(result["rule"].iat[i], row, result["risk"].iat[i])
+        if authorized != result["authorized"].iat[i] or reason != simulated:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"❌ MISMATCH user {row['user_id']} -> {row['requested_dept']}: {reason} vs {simulated}")
+
+    print(f"Compared {len(requests)} requests, {mismatches} mismatches")
+    assert mismatches == 0
+    print("✅ SUCCESS: vectorized policy evaluation matches check_authorization")
+
+def test_candidate_policy_diff():
+    """Removing Accounting's access to Sales must only produce newly denied Sales requests"""
+    requests = build_requests()
+    candidate = dict(AUTHORIZATION_POLICY, cross_dept_access=dict(AUTHORIZATION_POLICY["cross_dept_access"],
+                                                                  Accounting=["Marketing"]))
+    report = simulate([requests], candidate)
+    totals = report["totals"]
+    print(f"Newly granted: {totals['newly_granted']}, newly denied: {totals['newly_denied']}")
+
+    flipped_depts = {row["requested_dept"] for row in report["by_requested_dept"] if row["newly_denied"]}
+    assert totals["newly_granted"] == 0 and flipped_depts == {"Sales"}, f"Unexpected diff: {report['by_rule']}"
+    print("✅ SUCCESS: candidate policy diff is limited to Accounting -> Sales")
+
+if __name__ == "__main__":
+    test_vectorized_matches_check_authorization()
+    test_candidate_policy_diff()
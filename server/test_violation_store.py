@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+
+import main_model
+from main_model import listing_scope, process_user_query, security_rule
+from violation_store import ViolationStore
+
+def test_gate_false_positive_is_not_counted():
+    """A harmless query the keyword gate rejects must not count as a violation or change authorization"""
+    query = "Show all employees"
+    user_id = 5  # Accounting, cross-department access to Sales
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ViolationStore(os.path.join(tmp, "violations.db"))
+        previous, main_model.violation_store = main_model.violation_store, store
+        try:
+            _, before = listing_scope(user_id, "Sales")
+            result = process_user_query(user_id, query)
+            _, after = listing_scope(user_id, "Sales")
+        finally:
+            main_model.violation_store = previous
+
+    print(f"Result: {result.get('status')} / {result.get('label')} (rule: {security_rule(query)})")
+    print(f"Violations: {store.count(user_id)}, Sales access before: {before}, after: {after}")
+
+    assert result["status"] == "rejected" and result["label"] == "security violation"
+    assert security_rule(query) == "security_red_flag"
+    assert store.count(user_id) == 0
+    assert before == after == ["Sales"]
+    print("✅ SUCCESS: keyword gate rejection left the violation count and authorization unchanged")
+
+if __name__ == "__main__":
+    test_gate_false_positive_is_not_counted()
@@ -0,0 +1,258 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import metrics
+import tenants
+
+logger = logging.getLogger(__name__)
+
+# Violation store configuration (overridable through environment variables)
+VIOLATION_STORE_ENABLED = os.getenv("VIOLATION_STORE_ENABLED", "true").lower() == "true"
+VIOLATION_DB_PATH = os.getenv("VIOLATION_DB_PATH", "violations.db")
+VIOLATION_FLUSH_INTERVAL = float(os.getenv("VIOLATION_FLUSH_INTERVAL", "2.0"))
+# Violations older than this stop counting towards a user's risk
+VIOLATION_WINDOW_DAYS = float(os.getenv("VIOLATION_WINDOW_DAYS", "90"))
+
+# Rejections that count as a violation; other rejections (e.g. an off-topic
+# question) do not. Outcomes count unless the caller marks them as not
+# counted (see is_violation).
+VIOLATION_LABELS = {
+    "security violation",
+    "data breach attempt",
+    "inappropriate content",
+    "malicious query",
+    "social engineering attempt"
+}
+
+# Users are identified by tenant (empty outside tenant requests, see
+# tenants.py) and user id, since every tenant has its own id space
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS violations (
+    tenant TEXT NOT NULL DEFAULT '',
+    user_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    last_at TEXT,
+    last_status TEXT,
+    last_reason TEXT,
+    PRIMARY KEY (tenant, user_id)
+);
+CREATE TABLE IF NOT EXISTS violation_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tenant TEXT NOT NULL DEFAULT '',
+    user_id INTEGER NOT NULL,
+    at TEXT NOT NULL,
+    status TEXT,
+    label TEXT,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS violation_events_tenant_user ON violation_events (tenant, user_id, at);
+CREATE INDEX IF NOT EXISTS violation_events_at ON violation_events (at);
+CREATE TABLE IF NOT EXISTS violation_resets (
+    tenant TEXT NOT NULL DEFAULT '',
+    user_id INTEGER NOT NULL,
+    at TEXT NOT NULL,
+    PRIMARY KEY (tenant, user_id)
+);
+"""
+
+
+def is_violation(result, counted=True):
+    """Whether a process_user_query outcome counts as a violation.
+
+    ``counted`` False marks an outcome that is no violation of the user's
+    own: a denial by the risk rules, which past violations drive and would
+    otherwise count again, or a security rejection by keyword and pattern
+    rules rather than a model (see main_model.security_rule).
+    """
+    if not counted:
+        return False
+    status = result.get("status")
+    return status == "unauthorized" or (status == "rejected" and result.get("label") in VIOLATION_LABELS)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+class ViolationStore:
+    """Per-user violation counters kept in memory and persisted write-behind.
+
+    Recent violation times are loaded from SQLite at start and updated under
+    a lock when a request ends in a violation; the new events are written to
+    SQLite in one transaction every VIOLATION_FLUSH_INTERVAL seconds by a
+    background thread, so the request path never touches the disk. Counts
+    recorded here come on top of the ``past_violations`` column of the
+    employee data.
+
+    A user's count only covers the last VIOLATION_WINDOW_DAYS and the time
+    since an admin last reset it, so it decays instead of growing forever.
+    Events and the lifetime totals in ``violations`` are kept for auditing.
+    Counts are kept per tenant of the request (see tenants.py).
+    """
+
+    def __init__(self, path=VIOLATION_DB_PATH, flush_interval=VIOLATION_FLUSH_INTERVAL,
+                 window_days=VIOLATION_WINDOW_DAYS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.window = window_days * 86400
+        # Epoch seconds of each (tenant, user)'s counted violations, oldest first
+        self._events = {}
+        self._pending = []
+        self._pending_resets = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.stats = {"recorded": 0, "persisted": 0, "flushes": 0, "flush_errors": 0, "resets": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            since = datetime.fromtimestamp(time.time() - self.window, timezone.utc).isoformat(timespec="microseconds")
+            rows = conn.execute(
+                "SELECT e.tenant, e.user_id, e.at FROM violation_events e "
+                "LEFT JOIN violation_resets r ON r.tenant = e.tenant AND r.user_id = e.user_id "
+                "WHERE e.at >= ? AND (r.at IS NULL OR e.at > r.at) ORDER BY e.at", (since,))
+            events = {}
+            for tenant, user_id, at in rows:
+                events.setdefault((tenant, user_id), deque()).append(datetime.fromisoformat(at).timestamp())
+            self._events = events
+        finally:
+            conn.close()
+        logger.info("Loaded recent violations of %s users from %s", len(self._events), self.path)
+        self._thread = threading.Thread(target=self._run, name="violation-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Persist pending events and stop the writer thread."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _expire(self, key, now):
+        # Drop a user's violations that left the window; call with the lock held
+        events = self._events.get(key)
+        if events is None:
+            return 0
+        while events and now - events[0] >= self.window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return 0
+        return len(events)
+
+    def count(self, user_id):
+        """Violations recorded for a user within the window and since their last reset."""
+        with self._lock:
+            return self._expire(_user_key(user_id), time.time())
+
+    def record(self, user_id, status, label=None, reason=None):
+        """Count a violation for a user and queue it for persistence.
+
+        Returns:
+            int: The user's new violation count
+        """
+        key = _user_key(user_id)
+        now = time.time()
+        event = key + (_now(), status, label, reason)
+        with self._lock:
+            self._expire(key, now)
+            self._events.setdefault(key, deque()).append(now)
+            count = len(self._events[key])
+            self._pending.append(event)
+            self.stats["recorded"] += 1
+        metrics.VIOLATIONS.inc(status)
+        return count
+
+    def record_outcome(self, user_id, result, counted=True):
+        """Record a process_user_query result if it counts as a violation (see is_violation)."""
+        if is_violation(result, counted):
+            return self.record(user_id, result.get("status"), result.get("label"),
+                               result.get("auth_reason") or result.get("message"))
+        return None
+
+    def reset(self, user_id):
+        """Clear a user's counted violations, e.g. after an admin review.
+
+        Returns:
+            int: The number of violations that stopped counting
+        """
+        key = _user_key(user_id)
+        with self._lock:
+            cleared = self._expire(key, time.time())
+            self._events.pop(key, None)
+            self._pending_resets.append(key + (_now(),))
+            self.stats["resets"] += 1
+        logger.info("Reset %s counted violations of user %s", cleared, user_id)
+        return cleared
+
+    @property
+    def pending(self):
+        return len(self._pending) + len(self._pending_resets)
+
+    def flush(self, conn):
+        with self._lock:
+            events, self._pending = self._pending, []
+            resets, self._pending_resets = self._pending_resets, []
+        if not events and not resets:
+            return
+        # One row update per user, however many events it had in this batch
+        latest = {}
+        for event in events:
+            delta, _ = latest.get(event[:2], (0, None))
+            latest[event[:2]] = (delta + 1, event)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO violation_events (tenant, user_id, at, status, label, reason) VALUES (?, ?, ?, ?, ?, ?)",
+                    events)
+                conn.executemany(
+                    "INSERT INTO violations (tenant, user_id, count, last_at, last_status, last_reason) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(tenant, user_id) DO UPDATE SET count = count + excluded.count, "
+                    "last_at = excluded.last_at, last_status = excluded.last_status, last_reason = excluded.last_reason",
+                    [(tenant, user, delta, at, status, reason)
+                     for (tenant, user), (delta, (_, _, at, status, _, reason)) in latest.items()])
+                conn.executemany(
+                    "INSERT INTO violation_resets (tenant, user_id, at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(tenant, user_id) DO UPDATE SET at = excluded.at", resets)
+        except sqlite3.Error as e:
+            # Keep the events for the next attempt
+            with self._lock:
+                self._pending[:0] = events
+                self._pending_resets[:0] = resets
+            self.stats["flush_errors"] += 1
+            logger.error("Persisting %s violation events failed: %s", len(events), e)
+            return
+        self.stats["persisted"] += len(events)
+        self.stats["flushes"] += 1
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self._stopping.wait(self.flush_interval):
+                self.flush(conn)
+            self.flush(conn)
+        finally:
+            conn.close()
+
+
+def _user_key(user_id):
+    # (tenant, user id), with "" for no tenant as stored in SQLite
+    try:
+        user_id = int(user_id)
+    except (ValueError, TypeError):
+        pass
+    tenant, user_id = tenants.scoped(user_id)
+    return tenant or "", user_id